@@ -867,12 +867,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.import_dialog.show()
 
     def on_import_coco_clicked(self):
-        proj_data = self.import_dialog.getData()
-        if proj_data:
+        coco_name = self.import_dialog.get_coco_name()
+        if coco_name:
             label_names = self.import_dialog.get_label_names()
-            self.importer = Importer(coco_data=proj_data, alpha=self.settings.read_alpha(), label_names=label_names,
+            self.importer = Importer(alpha=self.settings.read_alpha(), label_names=label_names,
                                      copy_images_path=self.import_dialog.get_copy_images_path(),
-                                     coco_name=self.import_dialog.get_coco_name(), is_coco=True)
+                                     coco_name=coco_name, is_coco=True)
 
             self.importer.finished.connect(self.on_import_finished)
             self.importer.load_percent_conn.percent.connect(self.on_import_percent_change)
@@ -1327,12 +1327,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def on_checking_project_success(self, dataset_dir):
 
-        self.progress_bar = ProgressWindow(self,
-                                           title='Loading project...' if self.settings.read_lang() == 'RU' else 'Загрузка проекта...')
-
-        self.view.load_ids_conn.percent.connect(self.progress_bar_changed)
-
-        self.view.set_ids_from_project(self.project_data.get_data())
+        self.view.set_id_allocator(self.project_data.get_id_allocator())
 
         self.balanceAct.setEnabled(True)
 
@@ -1787,11 +1782,11 @@ class MainWindow(QtWidgets.QMainWindow):
                     self.statusBar().showMessage(
                         f"Can't create label. Area of label is too small {area:0.3f}. Try again", 3000)
 
-                self.view.remove_label_id(id)
+                self.view.id_allocator.release(id)
                 self.write_scene_to_project_data()
                 self.fill_labels_on_tek_image_list_widget()
         else:
-            self.view.remove_label_id(id)
+            self.view.id_allocator.release(id)
             self.write_scene_to_project_data()
             self.fill_labels_on_tek_image_list_widget()
 
@@ -16,6 +16,7 @@ from utils.predictor import SAMImageSetter
 from utils.cnn_worker import CNN_worker
 from utils.sam_predictor import load_model as sam_load_model
 from utils import cls_settings
+from utils import rle
 from utils.edges_from_mask import yolo8masks2points
 from utils.sam_predictor import mask_to_seg, predict_by_points, predict_by_box
 from gd.gd_worker import GroundingSAMWorker
@@ -317,7 +318,12 @@ class Annotator(MainWindow):
             alpha_tek = self.settings.read_alpha()
             color = self.project_data.get_label_color(cls_name)
 
-            self.view.add_polygons_group_to_scene(cls_num, filtered_points_mass, color, alpha_tek)
+            extras = None
+            if int(self.settings.read_keep_rle()) and filtered_points_mass:
+                # маска хранится точно, по своей области на каждый полигон; полигон только для показа
+                extras = [{rle.RLE_FIELD: mask_rle} for mask_rle in rle.encode_parts(sam_mask, filtered_points_mass)]
+
+            self.view.add_polygons_group_to_scene(cls_num, filtered_points_mass, color, alpha_tek, extras=extras)
 
             self.write_scene_to_project_data()
             self.fill_labels_on_tek_image_list_widget()
@@ -467,8 +473,14 @@ class Annotator(MainWindow):
         conf_thres_set = self.settings.read_conf_thres()
         iou_thres_set = self.settings.read_iou_thres()
 
+        lrm = self.lrm
+        source_stats = None
         if self.scanning_mode:
             str_text = "Начинаю классифкацию СНС {0:s} сканирующим окном".format(self.started_cnn)
+            if not lrm:
+                lrm = hf.try_read_lrm(os.path.join(img_path, img_name))
+            # перекрытие фрагментов - по типичному размеру объектов в разметке проекта, считается в воркере
+            source_stats = self.project_data.get_stats().get_images_snapshot()
         else:
             str_text = "Начинаю классифкацию СНС {0:s}".format(self.started_cnn)
 
@@ -477,7 +489,15 @@ class Annotator(MainWindow):
         self.CNN_worker = CNN_worker(model=self.yolo, conf_thres=conf_thres_set, iou_thres=iou_thres_set,
                                      img_name=img_name, img_path=img_path,
                                      scanning=self.scanning_mode,
-                                     linear_dim=self.lrm)
+                                     linear_dim=lrm,
+                                     batch_size=int(self.settings.read_scan_batch()),
+                                     source_stats=source_stats,
+                                     source_dir=self.project_data.get_image_path(),
+                                     keep_rle=bool(int(self.settings.read_keep_rle())),
+                                     lang=self.settings.read_lang())
+
+        # план сканирования до запуска сети: число фрагментов и проходов
+        self.CNN_worker.info_conn.info_message.connect(self.on_cnn_info)
 
         self.CNN_worker.started.connect(self.on_cnn_started)
 
@@ -488,6 +508,9 @@ class Annotator(MainWindow):
         if not self.CNN_worker.isRunning():
             self.CNN_worker.start()
 
+    def on_cnn_info(self, message):
+        self.statusBar().showMessage(message, 5000)
+
     def on_cnn_started(self):
         """
         При начале классификации
@@ -520,7 +543,8 @@ class Annotator(MainWindow):
             if not color:
                 color = cls_settings.PALETTE[cls_num]
 
-            self.view.add_polygon_to_scene(cls_num, points, color=color, id=shape_id)
+            extra = {rle.RLE_FIELD: res[rle.RLE_FIELD]} if rle.RLE_FIELD in res else None
+            self.view.add_polygon_to_scene(cls_num, points, color=color, id=shape_id, extra=extra)
 
             shape = {'id': shape_id, 'cls_num': cls_num, 'points': points, 'conf': res['conf']}
             self.detected_shapes.append(shape)
@@ -632,7 +656,8 @@ class Annotator(MainWindow):
         self.CNN_worker = CNN_worker(model=self.yolo, conf_thres=conf_thres_set, iou_thres=iou_thres_set,
                                      img_name=None, img_path=None,
                                      images_list=images_list,
-                                     scanning=None)
+                                     scanning=None,
+                                     keep_rle=bool(int(self.settings.read_keep_rle())))
 
         self.CNN_worker.started.connect(self.on_cnn_started)
 
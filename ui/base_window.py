@@ -29,6 +29,8 @@ from ui.toolbars import ProgressBarToolbar
 
 from utils import config
 from utils import help_functions as hf
+from utils.cls_remap_worker import ClsRemapWorker
+from utils.export_worker import ExportWorker
 from utils.importer import Importer
 from utils.project import ProjectHandler
 from utils.settings_handler import AppSettings
@@ -227,6 +229,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.exportAnnToCOCOAct = QAction(
             "COCO" if self.settings.read_lang() == 'RU' else "COCO", self, enabled=False,
             triggered=self.exportToCOCO)
+        self.exportAnnToPNGMasksAct = QAction(
+            "Маски PNG" if self.settings.read_lang() == 'RU' else "PNG masks", self, enabled=False,
+            triggered=self.exportToPNGMasks)
+        self.exportAnnToShardsAct = QAction(
+            "Архивы tar (WebDataset)" if self.settings.read_lang() == 'RU' else "Tar shards (WebDataset)", self,
+            enabled=False,
+            triggered=self.exportToShards)
 
         # Import
         self.importAnnFromYoloBoxAct = QAction(
@@ -298,6 +307,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.annotatorExportMenu.addAction(self.exportAnnToYoloBoxAct)
         self.annotatorExportMenu.addAction(self.exportAnnToYoloSegAct)
         self.annotatorExportMenu.addAction(self.exportAnnToCOCOAct)
+        self.annotatorExportMenu.addAction(self.exportAnnToPNGMasksAct)
+        self.annotatorExportMenu.addAction(self.exportAnnToShardsAct)
 
         self.annotatorMenu.addMenu(self.annotatorExportMenu)
 
@@ -551,8 +562,8 @@ class MainWindow(QtWidgets.QMainWindow):
                                                       'Выберите папку для сохранения разметки' if self.settings.read_lang() == 'RU' else "Set folder",
                                                       'images')
         if export_dir:
-            self.project_data.exportToYOLOBox(export_dir)
-            self.on_project_export(export_format="YOLO Box")
+            self.project_data.clear_not_existing_images()
+            self.start_export("YOLO Box", self.project_data.export_yolo, export_dir, False)
 
     def exportToYOLOSeg(self):
         self.save_project()
@@ -560,8 +571,21 @@ class MainWindow(QtWidgets.QMainWindow):
                                                       'Выберите папку для сохранения разметки' if self.settings.read_lang() == 'RU' else "Set folder",
                                                       'images')
         if export_dir:
-            self.project_data.exportToYOLOSeg(export_dir)
-            self.on_project_export(export_format="YOLO Seg")
+            self.project_data.clear_not_existing_images()
+            self.start_export("YOLO Seg", self.project_data.export_yolo, export_dir, True)
+
+    def start_export(self, export_format, export_func, *args):
+        self.export_worker = ExportWorker(export_func, *args)
+
+        self.progress_toolbar.set_signal(self.export_worker.percent_conn.percent)
+        self.progress_toolbar.show_progressbar()
+
+        def on_finished():
+            self.progress_toolbar.hide_progressbar()
+            self.on_project_export(export_format=export_format)
+
+        self.export_worker.finished.connect(on_finished)
+        self.export_worker.start()
 
     def exportToCOCO(self):
         self.save_project()
@@ -571,9 +595,32 @@ class MainWindow(QtWidgets.QMainWindow):
                                                           'JSON File (*.json)')
 
         if export_сoco_file:
-            self.project_data.exportToCOCO(export_сoco_file)
+            self.project_data.clear_not_existing_images()
+            self.start_export("COCO", self.project_data.export_coco, export_сoco_file)
+
+    def exportToPNGMasks(self):
+        self.save_project()
+        export_dir = QFileDialog.getExistingDirectory(self,
+                                                      'Выберите папку для сохранения масок' if self.settings.read_lang() == 'RU' else "Set folder",
+                                                      'images')
+        if export_dir:
+            self.project_data.clear_not_existing_images()
+            self.start_export("PNG masks", self.project_data.export_masks, export_dir)
 
-            self.on_project_export(export_format="COCO")
+    def exportToShards(self):
+        self.save_project()
+        export_dir = QFileDialog.getExistingDirectory(self,
+                                                      'Выберите папку для сохранения архивов' if self.settings.read_lang() == 'RU' else "Set folder",
+                                                      'images')
+        if export_dir:
+            # отсутствующие изображения находит сам экспорт, из проекта они удаляются после его завершения
+            self.start_export("WebDataset", self.project_data.export_shards, export_dir)
+            self.export_worker.finished.connect(self.on_shards_export_finished)
+
+    def on_shards_export_finished(self):
+        missing = self.export_worker.get_result()
+        if missing:
+            self.project_data.remove_missing_images(missing)
 
     def importFromYOLOBox(self):
 
@@ -624,12 +671,12 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def on_import_coco_clicked(self):
 
-        proj_data = self.import_dialog.getData()
-        if proj_data:
+        coco_name = self.import_dialog.get_coco_name()
+        if coco_name:
             label_names = self.import_dialog.get_label_names()
-            self.importer = Importer(coco_data=proj_data, alpha=self.settings.read_alpha(), label_names=label_names,
+            self.importer = Importer(alpha=self.settings.read_alpha(), label_names=label_names,
                                      copy_images_path=self.import_dialog.get_copy_images_path(),
-                                     coco_name=self.import_dialog.get_coco_name(), is_coco=True)
+                                     coco_name=coco_name, is_coco=True)
 
             self.importer.finished.connect(self.on_import_finished)
             self.importer.load_percent_conn.percent.connect(self.on_import_percent_change)
@@ -760,16 +807,15 @@ class MainWindow(QtWidgets.QMainWindow):
         # 2. Убираем имя из комбобокса
         self.del_label_from_combobox(old_name)  # теперь в комбобоксе нет имени
 
-        # 3. Обновляем все полигоны
-        self.project_data.change_data_class_from_to(old_name, new_name)
+        # 3. Обновляем все полигоны - перенумерация считается в фоне
+        cls_remap = self.project_data.get_change_cls_remap(self.project_data.get_label_num(old_name),
+                                                           self.project_data.get_label_num(new_name))
 
-        # 4. Обновляем панель справа
-        self.fill_labels_on_tek_image_list_widget()
+        def on_remap_end(remap_result):
+            self.project_data.change_data_class_from_to(old_name, new_name, remap_result=remap_result)
+            self.on_label_change_end()
 
-        # 5. Переоткрываем изображение и рисуем полигоны из проекта
-        self.open_image(self.tek_image_path)
-        self.load_image_data(self.tek_image_name)
-        self.view.setFocus()
+        self.start_cls_remap(cls_remap, on_remap_end)
 
     def on_ask_del_all(self):
         # 1. Сохраняем данные сцены в проект
@@ -779,18 +825,39 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ask_del_label.close()
 
-        # 2. Удаляем данные о цвете из проекта
-        self.project_data.delete_data_by_class_name(del_name)
+        # 2. Удаляем полигоны и данные о цвете из проекта - перенумерация считается в фоне
+        cls_remap = self.project_data.get_delete_cls_remap(self.project_data.get_label_num(del_name))
 
-        # 3. Убираем имя класса из комбобокса
-        self.del_label_from_combobox(del_name)
+        def on_remap_end(remap_result):
+            self.project_data.delete_data_by_class_name(del_name, remap_result=remap_result)
 
+            # 3. Убираем имя класса из комбобокса
+            self.del_label_from_combobox(del_name)
+            self.on_label_change_end()
+
+        self.start_cls_remap(cls_remap, on_remap_end)
+
+    def start_cls_remap(self, cls_remap, on_remap_end):
+        self.cls_remap_worker = ClsRemapWorker(self.project_data, cls_remap)
+
+        self.progress_toolbar.set_signal(self.cls_remap_worker.percent_conn.percent)
+        self.progress_toolbar.show_progressbar()
+
+        def on_finished():
+            self.progress_toolbar.hide_progressbar()
+            on_remap_end(self.cls_remap_worker.get_remap_result())
+
+        self.cls_remap_worker.finished.connect(on_finished)
+        self.cls_remap_worker.start()
+
+    def on_label_change_end(self):
         # 4. Обновляем панель справа
         self.fill_labels_on_tek_image_list_widget()
 
         # 5. Переоткрываем изображение и рисуем полигоны из проекта
-        self.open_image(self.tek_image_path)
-        self.load_image_data(self.tek_image_name)
+        if self.tek_image_path:
+            self.open_image(self.tek_image_path)
+            self.load_image_data(self.tek_image_name)
 
         self.view.setFocus()
 
@@ -956,6 +1023,8 @@ class MainWindow(QtWidgets.QMainWindow):
         self.exportAnnToYoloBoxAct.setEnabled(is_active)
         self.exportAnnToYoloSegAct.setEnabled(is_active)
         self.exportAnnToCOCOAct.setEnabled(is_active)
+        self.exportAnnToPNGMasksAct.setEnabled(is_active)
+        self.exportAnnToShardsAct.setEnabled(is_active)
         self.cls_combo.setEnabled(is_active)
 
     def open_image(self, image_name):
@@ -1095,15 +1164,11 @@ class MainWindow(QtWidgets.QMainWindow):
     def on_checking_project_success(self, dataset_dir):
 
         self.dataset_dir = dataset_dir
-        # ProgressBar
-        self.progress_toolbar.set_signal(self.view.load_ids_conn.percent)
-        self.progress_toolbar.show_progressbar()
-
-        self.view.set_ids_from_project(self.project_data.get_data(), on_set_callback=self.on_view_ids_set)
+        self.view.set_id_allocator(self.project_data.get_id_allocator())
+        self.on_view_ids_set()
 
     def on_view_ids_set(self):
 
-        self.progress_toolbar.hide_progressbar()
         self.dataset_images = self.filter_images_names(self.dataset_dir)
 
         self.fill_labels_combo_from_project()
@@ -1146,6 +1211,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.loaded_proj_name = project_name
         self.project_data.load(project_name, on_load_callback=self.on_load_project)
 
+        # большие проекты читаются потоково - показываем прогресс построения индекса
+        self.progress_toolbar.set_signal(self.project_data.saver_loader.load_percent_conn.percent)
+        self.progress_toolbar.show_progressbar()
+
     def on_load_project(self):
 
         dataset_dir = self.project_data.get_image_path()
@@ -1172,7 +1241,7 @@ class MainWindow(QtWidgets.QMainWindow):
         loaded_proj_name, _ = QFileDialog.getOpenFileName(self,
                                                           'Загрузка проекта' if self.settings.read_lang() == 'RU' else "Loading project",
                                                           'projects',
-                                                          'JSON Proj File (*.json)')
+                                                          'JSON Proj File (*.json);;SQLite Proj File (*.sqlite);;Binary Proj File (*.aiproj)')
 
         if loaded_proj_name:
             self.load_project(loaded_proj_name)
@@ -1227,7 +1296,7 @@ class MainWindow(QtWidgets.QMainWindow):
             proj_name, _ = QFileDialog.getSaveFileName(self,
                                                        'Выберите имя нового проекта' if self.settings.read_lang == 'RU' else 'Type new project name',
                                                        'projects',
-                                                       'JSON Proj File (*.json)')
+                                                       'JSON Proj File (*.json);;SQLite Proj File (*.sqlite);;Binary Proj File (*.aiproj)')
 
         if proj_name:
             self.loaded_proj_name = proj_name
@@ -1545,10 +1614,23 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tutorial.show()
 
     def undo(self):
-        # print('Undo')
-        self.view.remove_last_changes()
+        # несохраненные правки сцены сначала попадают в историю проекта - и отменяются первыми
         self.write_scene_to_project_data()
-        self.fill_labels_on_tek_image_list_widget()
+        if self.project_data.undo():
+            self.on_history_step()
+
+    def redo(self):
+        self.write_scene_to_project_data()
+        if self.project_data.redo():
+            self.on_history_step()
+
+    def on_history_step(self):
+        # отмена/повтор могли изменить список классов и полигоны текущего изображения
+        cls_idx = self.cls_combo.currentIndex()
+        self.fill_labels_combo_from_project()
+        if 0 <= cls_idx < self.cls_combo.count():
+            self.cls_combo.setCurrentIndex(cls_idx)
+        self.on_label_change_end()
 
     def keyPressEvent(self, e):
         # e.accept()
@@ -1606,6 +1688,11 @@ class MainWindow(QtWidgets.QMainWindow):
 
             self.undo()
 
+        elif (e.key() == 89 or e.key() == 1053) and 'Ctrl' in modifierName:
+            # Ctrl + Y
+
+            self.redo()
+
         elif (e.key() == 67 or e.key() == 1057) and 'Ctrl' in modifierName:
             # Ctrl + C
 
@@ -256,6 +256,7 @@ class ImportFromCOCODialog(QWidget):
         self.setLayout(self.mainLayout)
 
         self.data = {}
+        self.coco_name = None
 
         self.resize(int(width), int(height))
 
@@ -287,15 +288,11 @@ class ImportFromCOCODialog(QWidget):
         """
         coco_name = self.coco_edit_with_button.getEditText()
 
-        if coco_name:
-            with open(coco_name, 'r') as f:
-
-                data = json.load(f)
-                if self.check_coco(data):
-                    self.data = data
-                    self.coco_name = coco_name
-                else:
-                    self.data = None
+        # файл не разбирается здесь - импорт читает его потоком и сам проверяет формат
+        if coco_name and os.path.exists(coco_name):
+            self.coco_name = coco_name
+        else:
+            self.coco_name = None
 
     def get_coco_name(self):
         return self.coco_name
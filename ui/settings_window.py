@@ -1,4 +1,5 @@
-from PyQt5.QtWidgets import QLabel, QGroupBox, QFormLayout, QComboBox, QVBoxLayout, QDoubleSpinBox, QCheckBox
+from PyQt5.QtWidgets import QLabel, QGroupBox, QFormLayout, QComboBox, QVBoxLayout, QDoubleSpinBox, QCheckBox, \
+    QSpinBox
 
 from utils import cls_settings
 from ui.settings_window_base import SettingsWindowBase
@@ -72,11 +73,25 @@ class SettingsWindow(SettingsWindowBase):
         self.IOU_spin.setSingleStep(0.01)
         classifier_layout.addRow(QLabel("IOU порог:" if self.lang == 'RU' else "IoU threshold"), self.IOU_spin)
 
+        self.scan_batch_spin = QSpinBox()
+        self.scan_batch_spin.setMinimum(1)
+        self.scan_batch_spin.setMaximum(64)
+        self.scan_batch_spin.setValue(int(self.settings.read_scan_batch()))
+        classifier_layout.addRow(
+            QLabel("Фрагментов в батче при сканировании:" if self.lang == 'RU' else "Scanning batch size"),
+            self.scan_batch_spin)
+
         self.SAM_HQ_checkbox = QCheckBox()
         self.SAM_HQ_checkbox.setChecked(bool(self.settings.read_sam_hq()))
         sam_hq_label = QLabel('Использовать SAM HQ' if self.lang == 'RU' else 'Use SAM HQ')
         classifier_layout.addRow(sam_hq_label, self.SAM_HQ_checkbox)
 
+        self.keep_rle_checkbox = QCheckBox()
+        self.keep_rle_checkbox.setChecked(bool(int(self.settings.read_keep_rle())))
+        keep_rle_label = QLabel('Сохранять маски SAM и детекторов в RLE' if self.lang == 'RU' else
+                                'Keep SAM and detector masks as RLE')
+        classifier_layout.addRow(keep_rle_label, self.keep_rle_checkbox)
+
         self.classifierGroupBox.setLayout(classifier_layout)
 
     def on_ok_clicked(self):
@@ -87,5 +102,7 @@ class SettingsWindow(SettingsWindowBase):
         self.settings.write_cnn_model(self.cnns[self.cnn_combo.currentIndex()])
         self.settings.write_iou_thres(self.IOU_spin.value())
         self.settings.write_conf_thres(self.conf_thres_spin.value())
+        self.settings.write_scan_batch(self.scan_batch_spin.value())
 
         self.settings.write_sam_hq(int(self.SAM_HQ_checkbox.isChecked()))
+        self.settings.write_keep_rle(int(self.keep_rle_checkbox.isChecked()))
@@ -5,10 +5,10 @@ from PyQt5.QtWidgets import QApplication
 
 from utils import config
 from utils import help_functions as hf
-from utils.ids_worker import IdsSetterWorker
+from utils.id_allocator import IdAllocator
 
 from ui.signals_and_slots import PolygonDeleteConnection, ViewMouseCoordsConnection, PolygonPressedConnection, \
-    PolygonEndDrawing, MaskEndDrawing, PolygonChangeClsNumConnection, LoadIdProgress
+    PolygonEndDrawing, MaskEndDrawing, PolygonChangeClsNumConnection
 from ui.polygons import GrPolygonLabel, GrEllipsLabel
 from ui.grapic_group import GrGroup
 
@@ -34,7 +34,6 @@ class GraphicsView(QtWidgets.QGraphicsView):
         self.polygon_clicked = PolygonPressedConnection()
         self.polygon_delete = PolygonDeleteConnection()
         self.polygon_cls_num_change = PolygonChangeClsNumConnection()
-        self.load_ids_conn = LoadIdProgress()
         self.mouse_move_conn = ViewMouseCoordsConnection()
 
         if on_rubber_band_mode:
@@ -53,7 +52,8 @@ class GraphicsView(QtWidgets.QGraphicsView):
 
         self.drawing_type = "Polygon"
         self.active_item = None
-        self.labels_ids = []
+        # общий с проектом аллокатор id полигонов, см. set_id_allocator
+        self.id_allocator = IdAllocator()
 
         if not active_color:
             self.active_color = config.ACTIVE_COLOR
@@ -352,52 +352,32 @@ class GraphicsView(QtWidgets.QGraphicsView):
 
         return None
 
-    def set_ids_from_project(self, project_data, on_set_callback=None):
-        self.ids_worker = IdsSetterWorker(images_data=project_data['images'])
-        self.on_set_callback = on_set_callback
-        self.ids_worker.load_ids_conn.percent.connect(self.on_load_percent_change)
-
-        self.ids_worker.finished.connect(self.on_ids_worker_finished)
-
-        if not self.ids_worker.isRunning():
-            self.ids_worker.start()
-
-    def on_load_percent_change(self, percent):
-        self.load_ids_conn.percent.emit(percent)
-
-    def on_ids_worker_finished(self):
-        self.labels_ids = self.ids_worker.get_labels_ids()
-        if self.on_set_callback:
-            self.on_set_callback()
+    def set_id_allocator(self, id_allocator):
+        self.id_allocator = id_allocator
 
     def get_unique_label_id(self):
-        id_tek = 0
-        while id_tek in self.labels_ids:
-            id_tek += 1
-        self.labels_ids.append(id_tek)
-        return id_tek
-
-    def remove_label_id(self, id):
-        if id in self.labels_ids:
-            self.labels_ids.remove(id)
+        return self.id_allocator.allocate()
 
     def remove_last_changes(self):
         for item_id in self.last_added:
             self.remove_shape_by_id(item_id)
         self.last_added = []
 
-    def add_polygons_group_to_scene(self, cls_num, point_of_points_mass, color=None, alpha=50):
+    def add_polygons_group_to_scene(self, cls_num, point_of_points_mass, color=None, alpha=50, extras=None):
         self.last_added = []
-        for points_mass in point_of_points_mass:
+        for i, points_mass in enumerate(point_of_points_mass):
             id = self.get_unique_label_id()
             self.last_added.append(id)
-            self.add_polygon_to_scene(cls_num, points_mass, color=color, alpha=alpha, id=id, is_save_last=False)
+            self.add_polygon_to_scene(cls_num, points_mass, color=color, alpha=alpha, id=id, is_save_last=False,
+                                      extra=extras[i] if extras else None)
 
-    def add_polygon_to_scene(self, cls_num, point_mass, color=None, alpha=50, id=None, is_save_last=True):
+    def add_polygon_to_scene(self, cls_num, point_mass, color=None, alpha=50, id=None, is_save_last=True,
+                             extra=None):
         """
         Добавление полигона на сцену
         color - цвет. Если None - будет выбран цвет, соответствующий номеру класса из config.COLORS
         alpha - прозрачность в процентах
+        extra - прочие поля полигона (например, маска RLE), попадают в проект, пока вершины не изменены
         """
 
         if not point_mass:
@@ -409,8 +389,7 @@ class GraphicsView(QtWidgets.QGraphicsView):
                 self.last_added = []
                 self.last_added.append(id)
 
-        if id not in self.labels_ids:
-            self.labels_ids.append(id)
+        self.id_allocator.reserve(id)
 
         polygon_new = GrPolygonLabel(None, color=color, cls_num=cls_num, alpha_percent=alpha, id=id)
 
@@ -423,6 +402,9 @@ class GraphicsView(QtWidgets.QGraphicsView):
             poly.append(QtCore.QPointF(p[0], p[1]))
 
         polygon_new.setPolygon(poly)
+        if extra:
+            polygon_new.extra = extra
+            polygon_new.extra_polygon = QPolygonF(poly)
 
         self.scene().addItem(polygon_new)
 
@@ -936,8 +918,8 @@ class GraphicsView(QtWidgets.QGraphicsView):
 
     def remove_item(self, item, is_delete_id=False):
 
-        if is_delete_id and item.id in self.labels_ids:
-            self.labels_ids.remove(item.id)
+        if is_delete_id:
+            self.id_allocator.release(item.id)
 
         self.scene().removeItem(item)
 
@@ -1052,6 +1034,8 @@ class GraphicsView(QtWidgets.QGraphicsView):
                     for p in pol:
                         points.append([p.x(), p.y()])
                     shape["points"] = points
+                    if getattr(item, 'extra', None) and item.extra_polygon == pol:
+                        shape.update(item.extra)
                     shapes.append(shape)
             except:
                 pass
@@ -0,0 +1,24 @@
+from PySide2 import QtCore
+from ui.signals_and_slots import LoadPercentConnection
+
+
+class ClsRemapWorker(QtCore.QThread):
+    """
+    Расчет перенумерации классов проекта в фоне. Результат применяется в потоке GUI
+    методами ProjectHandler с параметром remap_result
+    """
+
+    def __init__(self, project_data, cls_remap):
+        super(ClsRemapWorker, self).__init__()
+        self.percent_conn = LoadPercentConnection()
+        self.project_data = project_data
+        self.cls_remap = cls_remap
+        self.remap_result = None
+
+    def run(self):
+        self.percent_conn.percent.emit(0)
+        self.remap_result = self.project_data.calc_cls_remap(self.cls_remap,
+                                                             progress_callback=self.percent_conn.percent.emit)
+
+    def get_remap_result(self):
+        return self.remap_result
@@ -1,21 +1,36 @@
 from PySide2 import QtCore
-from .detect_yolo8 import predict_and_return_masks
-from utils.edges_from_mask import yolo8masks2points
-from ui.signals_and_slots import LoadPercentConnection
+from .detect_yolo8 import predict_and_return_masks, predict_masks_batch
+from utils.edges_from_mask import yolo8masks2points_batch
+from ui.signals_and_slots import LoadPercentConnection, InfoConnection
 
 import os
 import torch
 import cv2
 from . import help_functions as hf
-import math
+from .dataset_stats import calc_typical_object_size
+from .tile_stitch import stitch_tile_polygons
+from . import tiling
+from . import rle
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
+# фрагментов в одном проходе сети при сканировании
+SCAN_BATCH_SIZE = 8
+
 
 class CNN_worker(QtCore.QThread):
 
     def __init__(self, model, conf_thres=0.7, iou_thres=0.5,
                  img_name="selected_area.png", img_path=None,
-                 scanning=False, linear_dim=0.0923, images_list=None):
+                 scanning=False, linear_dim=0.0923, images_list=None, batch_size=SCAN_BATCH_SIZE,
+                 object_size=None, source_stats=None, source_dir=None, keep_rle=False, lang='RU'):
+        """
+        object_size - типичный размер объекта в пикселях, задает перекрытие фрагментов при сканировании
+        source_stats, source_dir - вклад изображений проекта в статистику (DatasetStats.get_images_snapshot)
+        и папка изображений: если object_size не задан, он считается по разметке проекта с учетом разрешения
+        keep_rle - добавлять к результатам маску в RLE COCO (поле rle.RLE_FIELD) в координатах изображения
+        """
 
         super(CNN_worker, self).__init__()
 
@@ -27,15 +42,24 @@ class CNN_worker(QtCore.QThread):
         self.img_path = img_path
         self.image_list = images_list
         self.scanning = scanning
+        self.batch_size = max(int(batch_size), 1)
 
         self.mask_results = []
         self.image_list_results = []
 
         self.img_ld = linear_dim
-        self.train_ld = 0.11
-        self.train_img_px = 8000  # в реальности - 1280, но это ужатые 8000 с ld = 0.0923
+        self.train_ld = tiling.TRAIN_LD
+        self.train_img_px = tiling.TRAIN_IMG_PX
+        self.object_size = object_size
+        self.source_stats = source_stats
+        self.source_dir = source_dir
+        self.keep_rle = keep_rle
+        self.lang = lang
+        self.tiling_plan = None
 
         self.psnt_connection = LoadPercentConnection()
+        # план сканирования - текстом, до запуска сети
+        self.info_conn = InfoConnection()
 
     def run(self):
 
@@ -53,6 +77,19 @@ class CNN_worker(QtCore.QThread):
 
         self.run_yolo8(img_path_full, self.scanning)
 
+    def masks_to_rles(self, masks, part_size, img_width, img_height):
+        """
+        Маски YOLOv8 (1 x h x w) -> RLE на изображении: маска растягивается на фрагмент part_size
+        в формате calc_parts и кодируется без построения маски всего изображения
+        """
+        (x_min, x_max), (y_min, y_max) = part_size
+        size = (int(x_max - x_min), int(y_max - y_min))
+        rles = []
+        for mask in masks:
+            part_mask = cv2.resize((mask[0] > 128).astype(np.uint8), size, interpolation=cv2.INTER_NEAREST)
+            rles.append(rle.encode_crop(part_mask, x_min, y_min, img_height, img_width))
+        return rles
+
     def run_yolo8_image_list(self, image_list):
         self.psnt_connection.percent.emit(0)
         self.image_list_results = []
@@ -67,13 +104,18 @@ class CNN_worker(QtCore.QThread):
             image_data = {'filename': os.path.basename(img_path_full), 'shapes': []}
             shapes = []
             for res in results:
-                for i, mask in enumerate(res['masks']):
-                    points = yolo8masks2points(mask, simplify_factor=3, width=image_width, height=image_height)
-                    if not points:
-                        continue
+                points_mass = yolo8masks2points_batch(res['masks'], simplify_factor=3, width=image_width,
+                                                      height=image_height)
+                nums = [i for i, points in enumerate(points_mass) if points]
+                if self.keep_rle:
+                    rles = self.masks_to_rles([res['masks'][i] for i in nums], [[0, img.shape[1]], [0, img.shape[0]]],
+                                              img.shape[1], img.shape[0])
+                for k, i in enumerate(nums):
                     cls_num = res['classes'][i]
 
-                    shape = {'id': id_tek, 'cls_num': cls_num, 'points': points}
+                    shape = {'id': id_tek, 'cls_num': cls_num, 'points': points_mass[i]}
+                    if self.keep_rle:
+                        shape[rle.RLE_FIELD] = rles[k]
                     id_tek += 1
                     shapes.append(shape)
 
@@ -84,59 +126,129 @@ class CNN_worker(QtCore.QThread):
 
         self.psnt_connection.percent.emit(100)
 
+    def prepare_fragments(self, img, part_sizes, resample=1.0):
+        """
+        Вырезка фрагментов. При resample < 1 фрагменты сразу сжимаются к размеру входа сети -
+        в сеть передается меньше данных, маски по-прежнему покрывают фрагмент целиком
+        """
+        parts = []
+        for (x_min, x_max), (y_min, y_max) in part_sizes:
+            part = img[int(y_min):int(y_max), int(x_min):int(x_max), :]
+            if resample < 1:
+                size = (max(int(round(part.shape[1] * resample)), 1), max(int(round(part.shape[0] * resample)), 1))
+                part = cv2.resize(part, size, interpolation=cv2.INTER_AREA)
+            parts.append(np.ascontiguousarray(part))
+        return parts
+
+    def fragments_to_results(self, part_sizes, part_mask_results, img_width, img_height):
+        """
+        Маски фрагментов -> полигоны в координатах изображения (сдвиг на угол фрагмента - векторно)
+        """
+        scanning_results = []
+        for part_size, res in zip(part_sizes, part_mask_results):
+            if not res:
+                continue
+            (x_min, x_max), (y_min, y_max) = part_size
+            points_mass = yolo8masks2points_batch(res['masks'], simplify_factor=3, width=x_max - x_min,
+                                                  height=y_max - y_min)
+            offset = np.array([x_min, y_min], dtype=np.float64)
+            nums = [i for i, points in enumerate(points_mass) if points]
+            if self.keep_rle:
+                rles = self.masks_to_rles([res['masks'][i] for i in nums], part_size, img_width, img_height)
+            for k, i in enumerate(nums):
+                result = {'cls_num': res['classes'][i], 'points': (np.asarray(points_mass[i]) + offset).tolist(),
+                          'conf': res['confs'][i], 'tile': part_size}
+                if self.keep_rle:
+                    result[rle.RLE_FIELD] = rles[k]
+                scanning_results.append(result)
+        return scanning_results
+
+    def scan_fragments(self, img, crop_x_y_sizes, is_progress_show=True, resample=1.0):
+        """
+        Обнаружение по фрагментам батчами по batch_size. Пока сеть обрабатывает батч, в отдельных потоках
+        вырезается следующий батч и переводятся в полигоны маски предыдущего.
+        Прогресс - доля обработанных фрагментов (до 90 %)
+        """
+        batches = [crop_x_y_sizes[i:i + self.batch_size] for i in range(0, len(crop_x_y_sizes), self.batch_size)]
+        scanning_results = []
+        parts_done = 0
+
+        def on_batch_done(future, batch):
+            nonlocal parts_done
+            scanning_results.extend(future.result())
+            parts_done += len(batch)
+            if is_progress_show:
+                self.psnt_connection.percent.emit(90.0 * parts_done / len(crop_x_y_sizes))
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            next_parts = executor.submit(self.prepare_fragments, img, batches[0], resample) if batches else None
+            last_post = None
+            for batch_num, batch in enumerate(batches):
+                parts = next_parts.result()
+                if batch_num + 1 < len(batches):
+                    next_parts = executor.submit(self.prepare_fragments, img, batches[batch_num + 1], resample)
+
+                part_mask_results = predict_masks_batch(self.model, parts, conf=self.conf_thres, iou=self.iou_thres)
+
+                if last_post:
+                    on_batch_done(*last_post)
+                last_post = (executor.submit(self.fragments_to_results, batch, part_mask_results, img.shape[1],
+                                             img.shape[0]), batch)
+
+            if last_post:
+                on_batch_done(*last_post)
+
+        return scanning_results
+
+    def calc_object_size(self):
+        """
+        Типичный размер объекта в пикселях сканируемого изображения. Площади полигонов проекта переводятся в м²
+        по разрешению своих изображений, а размер - обратно в пиксели по разрешению сканируемого.
+        Изображения проекта без разрешения не учитываются; без разрешения сканируемого - None
+        """
+        if not self.source_stats or not self.img_ld:
+            return None
+        lrms = {}
+        for filename, image_stats in self.source_stats.items():
+            if len(image_stats.areas):
+                lrm = hf.try_read_lrm(os.path.join(self.source_dir, filename))
+                if lrm:
+                    lrms[filename] = lrm
+        object_size_m = calc_typical_object_size(self.source_stats, lrms=lrms)
+        return object_size_m / self.img_ld if object_size_m else None
+
+    def plan_tiles(self, img_width, img_height):
+        return tiling.plan_tiles(img_width, img_height, lrm=self.img_ld, train_ld=self.train_ld,
+                                 train_img_px=self.train_img_px, object_size=self.object_size)
+
     def run_yolo8(self, img_path_full, is_scanning, is_progress_show=True):
         img = cv2.imread(img_path_full)
         shape = img.shape
 
         if is_scanning:
+            if self.object_size is None:
+                self.object_size = self.calc_object_size()
+            self.tiling_plan = self.plan_tiles(shape[1], shape[0])
+            self.info_conn.info_message.emit(tiling.describe_plan(self.tiling_plan, batch_size=self.batch_size,
+                                                                  lang=self.lang))
 
             if is_progress_show:
                 self.psnt_connection.percent.emit(0)
 
             self.run_yolo8(img_path_full, is_scanning=False, is_progress_show=False)
 
-            if self.img_ld:
-                frag_size = int(self.train_img_px * self.train_ld / self.img_ld)
-            else:
-                frag_size = 1280
-
-            if math.fabs(frag_size - 1280) < 300:
+            if not self.tiling_plan.parts:
                 if is_progress_show:
                     self.psnt_connection.percent.emit(100)
                 return
 
             scanning_results = [res for res in self.mask_results]
 
-            parts = hf.split_into_fragments(img, frag_size)
-            crop_x_y_sizes, x_parts_num, y_parts_num = hf.calc_parts(shape[1], shape[0], frag_size)
-
-            print(f'Crop image into {x_parts_num}x{y_parts_num}')
-            print(crop_x_y_sizes)
-
-            part_tek = 0
-            for part, part_size in zip(parts, crop_x_y_sizes):
-
-                part_mask_results = predict_and_return_masks(self.model, part, conf=self.conf_thres,
-                                                             iou=self.iou_thres, save_txt=False)
-                x_min, x_max = part_size[0]
-                y_min, y_max = part_size[1]
-
-                for res in part_mask_results:
-                    for i, mask in enumerate(res['masks']):
-                        points = yolo8masks2points(mask, simplify_factor=3, width=x_max - x_min, height=y_max - y_min)
-                        if not points:
-                            continue
-                        points_shifted = []
-                        for x, y in points:
-                            points_shifted.append([x + x_min, y + y_min])
-                        cls_num = res['classes'][i]
-                        conf = res['confs'][i]
-                        scanning_results.append({'cls_num': cls_num, 'points': points_shifted, 'conf': conf})
-
-                part_tek += 1
-                if is_progress_show:
-                    self.psnt_connection.percent.emit(90.0 * part_tek / len(parts))
+            scanning_results.extend(self.scan_fragments(img, self.tiling_plan.parts, is_progress_show=is_progress_show,
+                                                        resample=self.tiling_plan.resample))
 
+            # части объектов на стыках фрагментов сшиваются до удаления дубликатов
+            scanning_results = stitch_tile_polygons(scanning_results)
             self.mask_results = hf.filter_masks(scanning_results, conf_thres=self.conf_thres, iou_filter=0.05)
 
             if is_progress_show:
@@ -154,13 +266,18 @@ class CNN_worker(QtCore.QThread):
 
             mask_results = []
             for res in results:
-                for i, mask in enumerate(res['masks']):
-                    points = yolo8masks2points(mask, simplify_factor=3, width=shape[1], height=shape[0])
-                    if not points:
-                        continue
+                points_mass = yolo8masks2points_batch(res['masks'], simplify_factor=3, width=shape[1], height=shape[0])
+                nums = [i for i, points in enumerate(points_mass) if points]
+                if self.keep_rle:
+                    rles = self.masks_to_rles([res['masks'][i] for i in nums], [[0, shape[1]], [0, shape[0]]],
+                                              shape[1], shape[0])
+                for k, i in enumerate(nums):
                     cls_num = res['classes'][i]
                     conf = res['confs'][i]
-                    mask_results.append({'cls_num': cls_num, 'points': points, 'conf': conf})
+                    result = {'cls_num': cls_num, 'points': points_mass[i], 'conf': conf}
+                    if self.keep_rle:
+                        result[rle.RLE_FIELD] = rles[k]
+                    mask_results.append(result)
 
             self.mask_results = mask_results
             if is_progress_show:
@@ -0,0 +1,122 @@
+import datetime
+import json
+import os
+
+import numpy as np
+
+from utils import image_meta
+from utils import rle
+from utils import project_stream
+from utils.shape_columns import ShapeColumns, iter_columns
+
+# доля прогресса на проход по изображениям - основное время уходит на аннотации
+IMAGES_PASS_PERCENT = 20
+
+
+def make_info():
+    return {"year": datetime.date.today().year, "version": "1.0",
+            "description": "exported to COCO format using AI Annotator", "contributor": "",
+            "url": "", "date_created": datetime.date.today().strftime("%c")}
+
+
+def make_annotations(shapes, image_id, first_id):
+    """
+    Аннотации COCO полигонов одного изображения. Вершины пишутся целыми, как раньше; площади
+    (формула шнурования) и bbox [x, y, w, h] считаются по тем же целым вершинам, по всем полигонам
+    изображения разом. Полигоны без вершин пропускаются.
+    Если у полигона сохранена маска в RLE - пишется она, с площадью и bbox по сериям маски
+    """
+    int_shapes = ShapeColumns(shapes.coords.astype(np.int64), shapes.offsets, shapes.cls_nums, shapes.ids)
+    filled, mins, maxs = int_shapes.bounds()
+    if not len(mins):
+        return []
+
+    areas = int_shapes.areas()[filled].tolist()
+    bboxes = np.hstack([mins, maxs - mins]).astype(np.int64).tolist()
+    coords = int_shapes.coords.ravel().tolist()
+    offsets = (shapes.offsets * 2).tolist()
+
+    extras = shapes.extras or {}
+
+    annotations = []
+    for i, (pos, cls_num) in enumerate(zip(np.flatnonzero(filled).tolist(), shapes.cls_nums[filled].tolist())):
+        mask_rle = extras.get(pos, {}).get(rle.RLE_FIELD)
+        if mask_rle:
+            segmentation, area, bbox = mask_rle, rle.area(mask_rle), rle.bbox(mask_rle)
+        else:
+            segmentation, area, bbox = [coords[offsets[pos]:offsets[pos + 1]]], areas[i], bboxes[i]
+        annotations.append({"segmentation": segmentation, "area": area, "bbox": bbox, "iscrowd": 0,
+                            "id": first_id + i, "image_id": image_id, "category_id": cls_num + 1})
+    return annotations
+
+
+def write_items(f, items, is_first):
+    """
+    Запись элементов JSON-массива. Возвращает, остался ли массив пустым
+    """
+    for item in items:
+        if not is_first:
+            f.write(', ')
+        f.write(json.dumps(item))
+        is_first = False
+    return is_first
+
+
+def write_coco(f, images, path_to_images, labels, progress_callback=None):
+    """
+    Потоковая запись COCO: изображения и аннотации пишутся по одному изображению,
+    в памяти только полигоны текущего изображения и множество пропущенных изображений.
+    id изображения - его позиция в проекте + 1
+    """
+    count = len(images)
+    last_percent = -1
+
+    def emit(percent):
+        nonlocal last_percent
+        if progress_callback and percent != last_percent:
+            progress_callback(percent)
+            last_percent = percent
+
+    f.write('{"info": ')
+    f.write(json.dumps(make_info()))
+
+    f.write(', "images": [')
+    is_first = True
+    missing = set()
+    for pos, filename in enumerate(project_stream.iter_filenames(images)):
+        im_full_path = os.path.join(path_to_images, filename)
+        try:
+            width, height = image_meta.get_image_size(im_full_path)
+        except FileNotFoundError:
+            missing.add(pos)
+            continue
+
+        im_dict = {"id": pos + 1, "width": width, "height": height, "file_name": filename, "license": 0,
+                   "flickr_url": im_full_path, "coco_url": im_full_path, "date_captured": ""}
+        is_first = write_items(f, [im_dict], is_first)
+        emit(int((pos + 1) * IMAGES_PASS_PERCENT / count))
+
+    f.write('], "annotations": [')
+    is_first = True
+    seg_id = 1
+    for pos, (filename, shapes) in enumerate(iter_columns(images)):
+        if pos not in missing:
+            annotations = make_annotations(shapes, pos + 1, seg_id)
+            seg_id += len(annotations)
+            is_first = write_items(f, annotations, is_first)
+        emit(IMAGES_PASS_PERCENT + int((pos + 1) * (100 - IMAGES_PASS_PERCENT) / count))
+
+    f.write('], "licenses": ')
+    f.write(json.dumps([{"id": 0, "name": "Unknown License", "url": ""}]))
+
+    f.write(', "categories": ')
+    f.write(json.dumps([{"supercategory": "type", "id": i + 1, "name": label} for i, label in enumerate(labels)]))
+    f.write('}')
+    emit(100)
+
+
+def export_coco(images, path_to_images, labels, export_path, progress_callback=None):
+    tmp_path = export_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        write_coco(f, images, path_to_images, labels, progress_callback=progress_callback)
+    os.replace(tmp_path, export_path)
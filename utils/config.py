@@ -98,3 +98,16 @@ PATH_TO_SAM_HQ_CHECKPOINT = 'sam_models/sam_hq_vit_h.pth'
 LANGUAGE = 'RU'  # ENG
 
 DOMEN_NAME = 'http://127.0.0.1:8000'
+
+# Журнал изменений проекта: сжатие в основной файл, когда журнал больше
+# JOURNAL_COMPACT_MIN_BYTES и больше JOURNAL_COMPACT_RATIO от размера проекта
+JOURNAL_COMPACT_MIN_BYTES = 8 * 1024 * 1024
+JOURNAL_COMPACT_RATIO = 0.5
+
+# История undo/redo: не больше HISTORY_MAX_ENTRIES записей (они сохраняются в проект),
+# при переполнении старые записи удаляются сразу на HISTORY_TRIM_ENTRIES
+HISTORY_MAX_ENTRIES = 100
+HISTORY_TRIM_ENTRIES = 25
+
+# Проекты больше этого размера загружаются лениво: изображения разбираются по мере обращения
+LAZY_LOAD_MIN_BYTES = 64 * 1024 * 1024
@@ -1,44 +1,88 @@
-from utils.edges_from_mask import mask2seg
-from PIL import Image
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import cv2
 import numpy as np
+import rasterio
+import shapely
+from rasterio import features
 
+# типы, с которыми работает rasterio.features.shapes
+SHAPES_DTYPES = (np.uint8, np.uint16, np.int16, np.int32)
 
-def convert(train_folder, val_folder, cls_names, verbose=True):
-    for folder in [train_folder, val_folder]:
-        if verbose:
-            print(f'Folder {folder}:')
-        pngs = [name for name in os.listdir(folder) if name.endswith('.png')]
 
-        for png_name in pngs:
+def read_mask(png_path):
+    """
+    Маска декодируется один раз, без преобразования глубины. Для цветных масок - первый канал, как в mask2seg
+    """
+    mask = cv2.imread(png_path, cv2.IMREAD_UNCHANGED)
+    if mask is None:
+        raise OSError(f"Can't read mask {png_path}")
+    if mask.ndim == 3:
+        mask = mask[:, :, 0]
+    if mask.dtype not in SHAPES_DTYPES:
+        mask = mask.astype(np.int32)
+    return mask
 
-            if verbose:
-                print(f'>>>{png_name}:')
 
-            txt_name = os.path.join(folder, png_name.split('.png')[0] + '.txt')
-            with open(txt_name, 'w') as f:
-                all_lines = []
-                for i in range(1, len(cls_names)):
+def mask_to_yolo_lines(mask, cls_count, simpify_factor=3):
+    """
+    Строки YOLO Seg для всех классов маски за один проход rasterio.features.shapes:
+    связные области каждого значения 1..cls_count-1 (0 - фон) становятся полигонами класса value - 1.
+    Повторяющиеся строки отбрасываются
+    """
+    img_height, img_width = mask.shape[:2]
+    valid = (mask > 0) & (mask < cls_count)
+    if not valid.any():
+        return []
+
+    lines = []
+    seen = set()
+    for shape, value in features.shapes(np.ascontiguousarray(mask), mask=valid,
+                                        transform=rasterio.Affine(1.0, 0, 0, 0, 1.0, 0)):
+        pol_simplified = shapely.geometry.shape(shape).simplify(simpify_factor, preserve_topology=False)
+        try:
+            xy = np.asarray(pol_simplified.boundary.xy, dtype="int32")
+        except NotImplementedError:
+            # полигоны с дырами и распавшиеся при упрощении пропускаются, как в mask2seg
+            continue
+
+        new_line = f'{int(value) - 1} '
+        for x, y in zip((xy[0] / img_width).tolist(), (xy[1] / img_height).tolist()):
+            new_line += f'{x} {y} '
+        if new_line not in seen:
+            seen.add(new_line)
+            lines.append(new_line + '\n')
+    return lines
 
-                    png_full_path = os.path.join(folder, png_name)
-                    segments = mask2seg(png_full_path, cls_num=i)
 
-                    if len(segments):
+def convert_mask(png_path, txt_path, cls_count, simpify_factor=3):
+    lines = mask_to_yolo_lines(read_mask(png_path), cls_count, simpify_factor=simpify_factor)
+    with open(txt_path, 'w') as f:
+        f.writelines(lines)
+    return len(lines)
 
-                        img = Image.open(png_full_path)
-                        img_width, img_height = img.size
 
-                        for seg in segments:
-                            new_line = f'{i - 1} '
-                            for x, y in zip(seg['x'], seg['y']):
-                                new_line += f'{x/img_width} {y/img_height} '
-                            if new_line not in all_lines:
-                                all_lines.append(new_line)
-                                if verbose:
-                                    print(f'      class: {cls_names[i]}: found {len(segments)} segments')
+def convert(train_folder, val_folder, cls_names, verbose=True, max_workers=None):
+    """
+    Конвертация PNG-масок в YOLO Seg: txt рядом с каждой маской. Маски обрабатываются в пуле процессов
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for folder in [train_folder, val_folder]:
+            if verbose:
+                print(f'Folder {folder}:')
+            pngs = [name for name in os.listdir(folder) if name.endswith('.png')]
+
+            futures = {}
+            for png_name in pngs:
+                txt_name = os.path.join(folder, png_name.split('.png')[0] + '.txt')
+                futures[executor.submit(convert_mask, os.path.join(folder, png_name), txt_name,
+                                        len(cls_names))] = png_name
 
-                                f.write(new_line+'\n')
+            for future in as_completed(futures):
+                segments_count = future.result()
+                if verbose:
+                    print(f'>>>{futures[future]}: found {segments_count} segments')
 
 
 if __name__ == '__main__':
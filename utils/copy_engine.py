@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# auto - reflink, затем жесткая ссылка, затем копирование
+COPY_MODES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+
+# ioctl FICLONE: копия файла с общими блоками (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def calc_file_hash(path):
+    """
+    Хэш всего содержимого файла, чтение кусками по CHUNK_SIZE
+    """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_same_content(src, dst):
+    """
+    dst уже содержит src: тот же файл или то же содержимое целиком.
+    Размер только отсеивает разные файлы - одинаковые по размеру сравниваются по хэшу всего содержимого
+    """
+    try:
+        if os.path.samefile(src, dst):
+            return True
+        if os.path.getsize(src) != os.path.getsize(dst):
+            return False
+        return calc_file_hash(src) == calc_file_hash(dst)
+    except OSError:
+        return False
+
+
+def reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError(f"reflink is not supported on {sys.platform}")
+    import fcntl
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+
+
+def copy_chunked(src, dst):
+    """
+    Копирование кусками. На Linux - copy_file_range: данные не проходят через процесс,
+    а на ФС с поддержкой CoW ядро само делает reflink
+    """
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(f_src.fileno(), f_dst.fileno(), CHUNK_SIZE):
+                    pass
+                return
+            except OSError:
+                # например, копирование между разными ФС на старых ядрах - копируем обычно
+                f_src.seek(0)
+                f_dst.seek(0)
+                f_dst.truncate()
+        shutil.copyfileobj(f_src, f_dst, CHUNK_SIZE)
+
+
+def copy_file(src, dst, mode='auto'):
+    """
+    Копирование файла выбранным способом. Если способ недоступен (другая ФС, нет поддержки) -
+    обычное копирование. Файл пишется во временный и переименовывается.
+    Возвращает использованный способ
+    """
+    tmp_dst = dst + '.part'
+    if os.path.lexists(tmp_dst):
+        os.remove(tmp_dst)
+
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), tmp_dst)
+        os.replace(tmp_dst, dst)
+        return 'symlink'
+
+    methods = {'auto': ('reflink', 'hardlink'), 'reflink': ('reflink',), 'hardlink': ('hardlink',)}.get(mode, ())
+    for method in methods:
+        try:
+            if method == 'reflink':
+                reflink(src, tmp_dst)
+            else:
+                os.link(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return method
+        except (OSError, AttributeError):
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+
+    copy_chunked(src, tmp_dst)
+    shutil.copymode(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+    return 'copy'
+
+
+def copy_files(pairs, mode='auto', progress_callback=None, max_workers=None):
+    """
+    Параллельное копирование списка (src, dst). Файлы, которые уже есть в dst с тем же содержимым, пропускаются.
+    Возвращает число файлов по способам: {"skip": ..., "copy": ..., "hardlink": ...}
+    """
+    if mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode {mode}")
+
+    def copy_one(src, dst):
+        if os.path.exists(dst) and is_same_content(src, dst):
+            return 'skip'
+        return copy_file(src, dst, mode)
+
+    counts = {}
+    if not pairs:
+        return counts
+
+    last_percent = -1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(copy_one, src, dst) for src, dst in pairs]
+        for i, future in enumerate(as_completed(futures)):
+            method = future.result()
+            counts[method] = counts.get(method, 0) + 1
+            percent = int((i + 1) * 100 / len(futures))
+            if progress_callback and percent != last_percent:
+                progress_callback(percent)
+                last_percent = percent
+    return counts
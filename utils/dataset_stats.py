@@ -0,0 +1,181 @@
+from collections import namedtuple
+
+import numpy as np
+
+from utils.shape_columns import ShapeColumns, iter_columns
+
+# вклад одного изображения в статистику: номера классов и площади его полигонов, число вершин
+ImageStats = namedtuple('ImageStats', ('cls_nums', 'areas', 'vertices'))
+
+
+def calc_typical_object_size(images, quantile=0.95, lrms=None):
+    """
+    Типичный размер объекта - сторона квадрата с площадью квантиля quantile площадей полигонов.
+    images - {имя изображения: ImageStats}. Без lrms - в пикселях по всем изображениям.
+    lrms - {имя изображения: м/пиксель}: площади переводятся в м² по разрешению своего изображения,
+    изображения без разрешения не учитываются, размер - в метрах. Без полигонов - None
+    """
+    areas = []
+    for filename, image_stats in images.items():
+        if not len(image_stats.areas):
+            continue
+        if lrms is None:
+            areas.append(image_stats.areas)
+        elif lrms.get(filename):
+            areas.append(image_stats.areas * lrms[filename] ** 2)
+    if not areas:
+        return None
+    areas = np.concatenate(areas)
+    areas = areas[areas > 0]
+    if not len(areas):
+        return None
+    return float(np.sqrt(np.quantile(areas, quantile)))
+
+
+class DatasetStats:
+    """
+    Статистика разметки проекта, обновляемая при каждом изменении изображения:
+    число полигонов и суммарная/минимальная/максимальная площадь по классам,
+    число полигонов на изображениях и число вершин.
+    Строится один раз при первом запросе, дальше запросы - O(число классов)
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.is_built = False
+        self.images = {}
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.area_sums = np.zeros(0, dtype=np.float64)
+        self.area_mins = np.zeros(0, dtype=np.float64)
+        self.area_maxs = np.zeros(0, dtype=np.float64)
+        # классы, у которых удалялся полигон с крайней площадью - min/max пересчитываются при запросе
+        self.extremes_dirty = set()
+        self.vertices = 0
+        self.shapes = 0
+
+    def build(self, images):
+        self.clear()
+        self.is_built = True
+        for filename, shapes in iter_columns(images):
+            self.set_image(filename, shapes)
+
+    def ensure_size(self, size):
+        grow = size - len(self.counts)
+        if grow <= 0:
+            return
+        self.counts = np.concatenate([self.counts, np.zeros(grow, dtype=np.int64)])
+        self.area_sums = np.concatenate([self.area_sums, np.zeros(grow)])
+        self.area_mins = np.concatenate([self.area_mins, np.full(grow, np.inf)])
+        self.area_maxs = np.concatenate([self.area_maxs, np.full(grow, -np.inf)])
+
+    def set_image(self, filename, shapes):
+        """
+        Замена вклада изображения. До первого запроса статистики изменения не учитываются -
+        при построении будет прочитано актуальное состояние проекта
+        """
+        if not self.is_built:
+            return
+
+        self.remove_image(filename)
+
+        shapes = ShapeColumns.from_shapes(shapes)
+        cls_nums = np.asarray(shapes.cls_nums, dtype=np.int64)
+        areas = shapes.areas()
+        vertices = len(shapes.coords)
+        self.images[filename] = ImageStats(cls_nums, areas, vertices)
+
+        self.vertices += vertices
+        self.shapes += len(cls_nums)
+        if not len(cls_nums):
+            return
+
+        cls_nums, areas = self.valid(cls_nums, areas)
+        self.ensure_size(int(cls_nums.max(initial=-1)) + 1)
+        np.add.at(self.counts, cls_nums, 1)
+        np.add.at(self.area_sums, cls_nums, areas)
+        np.minimum.at(self.area_mins, cls_nums, areas)
+        np.maximum.at(self.area_maxs, cls_nums, areas)
+
+    def remove_image(self, filename):
+        if not self.is_built:
+            return
+
+        image_stats = self.images.pop(filename, None)
+        if image_stats is None:
+            return
+
+        self.vertices -= image_stats.vertices
+        self.shapes -= len(image_stats.cls_nums)
+
+        cls_nums, areas = self.valid(image_stats.cls_nums, image_stats.areas)
+        if not len(cls_nums):
+            return
+
+        np.subtract.at(self.counts, cls_nums, 1)
+        np.subtract.at(self.area_sums, cls_nums, areas)
+        is_extreme = (areas <= self.area_mins[cls_nums]) | (areas >= self.area_maxs[cls_nums])
+        self.extremes_dirty.update(cls_nums[is_extreme].tolist())
+
+    @staticmethod
+    def valid(cls_nums, areas):
+        # полигоны с отрицательным номером класса в статистику по классам не входят
+        mask = cls_nums >= 0
+        return cls_nums[mask], areas[mask]
+
+    def update_extremes(self):
+        if not self.extremes_dirty:
+            return
+
+        dirty = np.array(sorted(self.extremes_dirty), dtype=np.int64)
+        self.area_mins[dirty] = np.inf
+        self.area_maxs[dirty] = -np.inf
+        for image_stats in self.images.values():
+            cls_nums, areas = self.valid(image_stats.cls_nums, image_stats.areas)
+            mask = np.isin(cls_nums, dirty)
+            if mask.any():
+                np.minimum.at(self.area_mins, cls_nums[mask], areas[mask])
+                np.maximum.at(self.area_maxs, cls_nums[mask], areas[mask])
+        self.extremes_dirty.clear()
+
+    def class_counts(self):
+        """
+        Номер класса -> число полигонов, только для классов с полигонами
+        """
+        return {cls_num: int(count) for cls_num, count in enumerate(self.counts) if count}
+
+    def class_areas(self):
+        """
+        Номер класса -> (суммарная, минимальная, максимальная площадь)
+        """
+        self.update_extremes()
+        return {cls_num: (float(self.area_sums[cls_num]), float(self.area_mins[cls_num]),
+                          float(self.area_maxs[cls_num]))
+                for cls_num, count in enumerate(self.counts) if count}
+
+    def image_counts(self):
+        """
+        Имя изображения -> число полигонов на нем
+        """
+        return {filename: len(image_stats.cls_nums) for filename, image_stats in self.images.items()}
+
+    def get_image_count(self, filename):
+        image_stats = self.images.get(filename)
+        return len(image_stats.cls_nums) if image_stats else 0
+
+    def typical_object_size(self, quantile=0.95, lrms=None):
+        """
+        Типичный размер объекта, см. calc_typical_object_size
+        """
+        return calc_typical_object_size(self.images, quantile=quantile, lrms=lrms)
+
+    def get_images_snapshot(self):
+        """
+        Копия вклада изображений для расчетов в другом потоке: ImageStats не меняются, копируется только словарь
+        """
+        return dict(self.images)
+
+    def summary(self):
+        return {"images": len(self.images), "shapes": self.shapes, "vertices": self.vertices,
+                "class_counts": self.class_counts(), "class_areas": self.class_areas()}
@@ -111,25 +111,38 @@ def predict_and_return_masks(model, source, conf=0.25, iou=0.7, save_txt=False):
     mask_results = []
     for res in results:  # res for each image
         if res.masks:
-            masks_mass = res.masks.cpu().numpy()
+            mask_results.append(get_mask_result(res))
 
-            boxes_mass = res.boxes.cpu().numpy()
-            cls_nums = []
-            confs = []
-            for box in boxes_mass:
-                cls = int(box.cls[0])
-                cls_nums.append(cls)
-                confs.append(box.conf[0])
+    return mask_results
 
-            masks = []
-            for i, mask in enumerate(masks_mass):
-                mask = mask.data
-                mask[mask == 1] = 255
-                masks.append(mask)
 
-            mask_results.append({'masks': masks, 'confs': confs, 'classes': cls_nums})
+def get_mask_result(res):
+    masks_mass = res.masks.cpu().numpy()
 
-    return mask_results
+    boxes_mass = res.boxes.cpu().numpy()
+    cls_nums = []
+    confs = []
+    for box in boxes_mass:
+        cls = int(box.cls[0])
+        cls_nums.append(cls)
+        confs.append(box.conf[0])
+
+    masks = []
+    for i, mask in enumerate(masks_mass):
+        mask = mask.data
+        mask[mask == 1] = 255
+        masks.append(mask)
+
+    return {'masks': masks, 'confs': confs, 'classes': cls_nums}
+
+
+def predict_masks_batch(model, images, conf=0.25, iou=0.7):
+    """
+    Один проход сети по списку изображений (батч размера len(images)).
+    Результат - по элементу на изображение, в том же порядке; без масок - None
+    """
+    results = model.predict(source=list(images), save_conf=True, conf=float(conf), iou=float(iou), save_txt=False)
+    return [get_mask_result(res) if res.masks else None for res in results]
 
 
 if __name__ == '__main__':
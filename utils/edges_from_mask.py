@@ -6,7 +6,10 @@ import rasterio
 from rasterio import features
 import shapely
 from shapely.geometry import Point, Polygon
-from PIL import Image
+
+from utils import image_meta
+from utils import mask_export
+from utils.mask_polygons import masks_to_polygons, polygons_to_points, METHOD_RASTERIO
 
 # from skimage.draw import line, polygon, ellipse
 
@@ -120,35 +123,25 @@ def seg_res_from_yolo_label(yolo_label_path, image_width, image_height):
 
 
 def create_png_from_yolo(yolo_label_path, image_path, save_path, background_cls=0):
-    img = Image.open(image_path)
-
-    img_width, img_height = img.size
+    img_width, img_height = image_meta.get_image_size(image_path)
 
     seg_reults = seg_res_from_yolo_label(yolo_label_path, img_width, img_height)
 
-    final_mask = np.zeros((img_height, img_width))
-    final_mask[:, :] = 0
-
+    coords = []
+    offsets = [0]
+    values = []
     for seg in seg_reults:
         cls = seg['cls']
         if background_cls == 0:
             cls += 1
 
-        x_mass = seg['seg']['x']
-        y_mass = seg['seg']['y']
-
-        pol = []
-        for x, y in zip(x_mass, y_mass):
-            pol.append((x, y))
-
-        pol = Polygon(pol)
-
-        mask_image = features.rasterize([pol], out_shape=(img_height, img_width),
-                                        fill=background_cls,
-                                        default_value=cls)
+        coords.extend(zip(seg['seg']['x'], seg['seg']['y']))
+        offsets.append(len(coords))
+        values.append(cls)
 
-        final_mask[mask_image == cls] = cls
-    cv2.imwrite(save_path, final_mask)
+    # все полигоны изображения - одним вызовом rasterize
+    mask_export.write_mask(save_path, np.array(coords, dtype=np.float64).reshape(-1, 2), offsets, values,
+                           img_width, img_height, background=background_cls)
 
 
 def create_seg_annotations_from_yolo_seg(images_folder, yolo_seg_folder, png_save_folder, img_suffix='jpg'):
@@ -233,30 +226,29 @@ def segmentation_to_points(mm_seg_predicitons, cls_num):
 
 
 def yolo8masks2points(yolo_mask, simplify_factor=3, width=1280, height=1280):
-    points = []
-    img_data = yolo_mask[0] > 128
-    shape = img_data.shape
-
-    mask_width = shape[1]
-    mask_height = shape[0]
+    return yolo8masks2points_batch([yolo_mask], simplify_factor=simplify_factor, width=width, height=height)[0]
 
-    img_data = np.asarray(img_data[:, :], dtype=np.double)
 
-    polygons = mask_to_polygons_layer(img_data)
+def yolo8masks2points_batch(yolo_masks, simplify_factor=3, width=1280, height=1280, method=METHOD_RASTERIO):
+    """
+    Вершины первого полигона каждой маски YOLOv8 (1 x h x w), пересчитанные к размеру width x height.
+    Все маски векторизуются и упрощаются за один вызов. Если полигон получить не удалось - None
+    """
+    if not len(yolo_masks):
+        return []
+    img_data = np.stack([mask[0] for mask in yolo_masks]) > 128
+    mask_height, mask_width = img_data.shape[1:]
 
-    polygon = polygons[0].simplify(simplify_factor, preserve_topology=False)
-
-    try:
-        xy = np.asarray(polygon.boundary.xy, dtype="float")
-        x_mass = xy[0].tolist()
-        y_mass = xy[1].tolist()
-        for x, y in zip(x_mass, y_mass):
-            points.append([x * width / mask_width, y * height / mask_height])
-        return points
+    polygons = masks_to_polygons(img_data, simplify_factor=simplify_factor, method=method)
+    first_polygons = [mask_polygons[0] if mask_polygons else shapely.Polygon() for mask_polygons in polygons]
 
-    except:
-
-        return None
+    results = []
+    for xy in polygons_to_points(first_polygons):
+        if xy is None:
+            results.append(None)
+            continue
+        results.append((xy * np.array([width, height]) / np.array([mask_width, mask_height])).tolist())
+    return results
 
 
 def mask2seg(mask_filename, simpify_factor=3, cls_num=None):
@@ -292,12 +284,8 @@ def mask2seg(mask_filename, simpify_factor=3, cls_num=None):
 
 
 def mask_to_polygons_layer(mask):
-    shapes = []
-    for shape, value in features.shapes(mask.astype(np.int16), mask=(mask > 0),
-                                        transform=rasterio.Affine(1.0, 0, 0, 0, 1.0, 0)):
-        shapes.append(shapely.geometry.shape(shape))
-
-    return shapes
+    # векторизация только в пределах рамки ненулевых пикселей
+    return masks_to_polygons(mask)[0]
 
 
 def mask_folder2seg_results(folder, simpify_factor=3):
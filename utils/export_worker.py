@@ -0,0 +1,22 @@
+from PySide2 import QtCore
+from ui.signals_and_slots import LoadPercentConnection
+
+
+class ExportWorker(QtCore.QThread):
+    """
+    Экспорт проекта в фоне. export_func вызывается с аргументами args и progress_callback
+    """
+
+    def __init__(self, export_func, *args):
+        super(ExportWorker, self).__init__()
+        self.percent_conn = LoadPercentConnection()
+        self.export_func = export_func
+        self.args = args
+        self.result = None
+
+    def run(self):
+        self.percent_conn.percent.emit(0)
+        self.result = self.export_func(*self.args, progress_callback=self.percent_conn.percent.emit)
+
+    def get_result(self):
+        return self.result
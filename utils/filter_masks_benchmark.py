@@ -0,0 +1,141 @@
+import time
+
+import numpy as np
+from shapely import Polygon
+
+from utils.help_functions import filter_masks
+
+
+def filter_masks_pairwise(masks_results, conf_thres=0.2, iou_filter=0.3):
+    """
+    Прежняя реализация filter_masks попарным сравнением - эталон для проверки результатов
+    """
+    unique_results = []
+    skip_nums = []
+    for i in range(len(masks_results)):
+        if float(masks_results[i]['conf']) < conf_thres:
+            continue
+
+        biggest_mask = None
+
+        if i in skip_nums:
+            continue
+
+        for j in range(i + 1, len(masks_results)):
+
+            if j in skip_nums:
+                continue
+
+            if masks_results[i]['cls_num'] != masks_results[j]['cls_num']:
+                continue
+
+            if biggest_mask:
+                pol1 = Polygon(biggest_mask['points'])
+            else:
+                pol1 = Polygon(masks_results[i]['points'])
+
+            pol2 = Polygon(masks_results[j]['points'])
+
+            un = pol1.union(pol2)
+            inter = pol1.intersection(pol2)
+
+            if inter and un:
+                iou = inter.area / un.area
+
+                if iou > iou_filter:
+
+                    if pol1.area < pol2.area:
+                        biggest_mask = masks_results[j]
+
+                    skip_nums.append(j)
+
+        if biggest_mask:
+            unique_results.append(biggest_mask)
+        else:
+            unique_results.append(masks_results[i])
+
+    return unique_results
+
+
+def make_scanning_results(count, cls_count=5, seed=0):
+    """
+    Результаты сканирования по фрагментам: объекты на большом снимке, каждый найден в 1-3 соседних
+    фрагментах со сдвигом и разным масштабом
+    """
+    rng = np.random.default_rng(seed)
+    side = 40 * np.sqrt(count)
+    results = []
+    while len(results) < count:
+        cx, cy = rng.uniform(0, side, 2)
+        r = rng.uniform(5, 20)
+        cls_num = int(rng.integers(cls_count))
+        for _ in range(int(rng.integers(1, 4))):
+            angles = (np.arange(8) + rng.uniform(0, 0.9, 8)) * np.pi / 4
+            radius = r * rng.uniform(0.8, 1.2, 8)
+            dx, dy = rng.normal(0, r * 0.2, 2)
+            points = np.stack([cx + dx + radius * np.cos(angles), cy + dy + radius * np.sin(angles)], axis=1)
+            results.append({'cls_num': cls_num, 'points': points.tolist(), 'conf': float(rng.uniform(0.1, 1))})
+    return results[:count]
+
+
+def add_degenerate_masks(masks_results, count, first_cls=None, seed=0):
+    """
+    Вставка count масок меньше чем из 3 вершин на случайные места. Если задан first_cls - у каждой свой класс
+    начиная с него, иначе - случайный из уже имеющихся
+    """
+    rng = np.random.default_rng(seed)
+    results = list(masks_results)
+    cls_nums = sorted({res['cls_num'] for res in masks_results})
+    for k in range(count):
+        points = rng.uniform(0, 100, (int(rng.integers(0, 3)), 2)).tolist()
+        cls_num = first_cls + k if first_cls is not None else int(rng.choice(cls_nums))
+        res = {'cls_num': cls_num, 'points': points, 'conf': float(rng.uniform(0.1, 1)), 'degenerate': True}
+        results.insert(int(rng.integers(len(results) + 1)), res)
+    return results
+
+
+def check_degenerate(count=500, iou_filter=0.05):
+    """
+    Маски меньше чем из 3 вершин проходят фильтр без изменений и не влияют на остальные.
+    Каждая своим классом - прежняя реализация их ни с чем не сравнивает, результат должен совпасть полностью.
+    Вперемешку с другими классами прежняя реализация падает, сравнивается результат без них
+    """
+    masks_results = make_scanning_results(count)
+    cls_count = len({res['cls_num'] for res in masks_results})
+
+    own_cls = add_degenerate_masks(masks_results, count // 10, first_cls=cls_count)
+    same_own = filter_masks(own_cls, iou_filter=iou_filter) == filter_masks_pairwise(own_cls, iou_filter=iou_filter)
+
+    mixed = add_degenerate_masks(masks_results, count // 10, seed=1)
+    unique_results = filter_masks(mixed, iou_filter=iou_filter)
+    expected_degenerate = [res for res in mixed if res.get('degenerate') and res['conf'] >= 0.2]
+    same_mixed = [res for res in unique_results if not res.get('degenerate')] == \
+                 filter_masks_pairwise(masks_results, iou_filter=iou_filter) and \
+                 [res for res in unique_results if res.get('degenerate')] == expected_degenerate
+
+    print(f"degenerate masks: own class same: {same_own}, mixed same: {same_mixed}")
+
+
+def run(counts=(1000, 3000, 10000, 30000, 100000), pairwise_limit=1000, iou_filter=0.05):
+    """
+    Время filter_masks от числа масок. До pairwise_limit масок - сравнение с прежней реализацией
+    """
+    for count in counts:
+        masks_results = make_scanning_results(count)
+
+        start = time.perf_counter()
+        unique_results = filter_masks(masks_results, iou_filter=iou_filter)
+        elapsed = time.perf_counter() - start
+
+        line = f"{count:>7} masks: {elapsed:8.3f} s, {len(unique_results)} unique"
+        if count <= pairwise_limit:
+            start = time.perf_counter()
+            expected = filter_masks_pairwise(masks_results, iou_filter=iou_filter)
+            line += f", pairwise {time.perf_counter() - start:8.3f} s, same: {unique_results == expected}"
+        print(line)
+
+    check_degenerate(iou_filter=iou_filter)
+
+
+if __name__ == '__main__':
+    run()
@@ -1,12 +1,12 @@
 from PyQt5 import QtCore
 
-from shapely import Polygon
-
-from PIL import Image
+import shapely
+from shapely import Polygon, STRtree
 
 from utils import coords_calc
 from utils import cls_settings
 from utils import config
+from utils import image_meta
 from utils.gdal_translate import get_data
 
 import math
@@ -25,10 +25,7 @@ def try_read_lrm(image_name):
         map_name = name_without_ext + map_ext
         if os.path.exists(map_name):
             coords_net = coords_calc.load_coords(map_name)
-            Image.MAX_IMAGE_PIXELS = None
-            img = Image.open(image_name)
-
-            img_width, img_height = img.size
+            img_width, img_height = image_meta.get_image_size(image_name)
 
             return coords_calc.get_lrm(coords_net, img_height)
 
@@ -79,9 +76,7 @@ def get_extension(filename):
 
 
 def convert_point_coords_to_geo(point_x, point_y, image_name):
-    img = Image.open(image_name)
-
-    img_width, img_height = img.size
+    img_width, img_height = image_meta.get_image_size(image_name)
 
     geo_extent = coords_calc.get_geo_extent(image_name)
 
@@ -97,9 +92,7 @@ def is_dicts_equals(dict1, dict2):
 
 
 def convert_shapes_to_esri(shapes, image_name, crs='epsg:4326', out_shapefile='esri_shapefile.shp'):
-    img = Image.open(image_name)
-
-    img_width, img_height = img.size
+    img_width, img_height = image_meta.get_image_size(image_name)
 
     geo_extent = coords_calc.get_geo_extent(image_name)
 
@@ -381,55 +374,73 @@ def convert_text_name_to_image_name(text_name):
     return img_name + ".txt"
 
 
+def calc_ious(pol1, candidates):
+    """
+    IoU полигона pol1 с массивом полигонов, векторно. Без пересечения - 0
+    """
+    inter = shapely.intersection(pol1, candidates)
+    ious = np.zeros(len(candidates))
+    has_inter = ~shapely.is_empty(inter)
+    if has_inter.any():
+        union_areas = shapely.area(shapely.union(pol1, candidates[has_inter]))
+        inter_areas = shapely.area(inter[has_inter])
+        ious[has_inter] = np.divide(inter_areas, union_areas, out=np.zeros(len(inter_areas)),
+                                    where=union_areas > 0)
+    return ious
+
+
 def filter_masks(masks_results, conf_thres=0.2, iou_filter=0.3):
     """
     Фильтрация боксов
     conf_tresh - убираем все боксы с вероятностями ниже заданной
     iou_filter - убираем дубликаты боксов, дубликатами считаются те, значение IoU которых выше этого порога
+
+    Маска i сравнивается с последующими масками того же класса, еще не признанными дубликатами.
+    Дубликат с большей площадью заменяет маску i и дальше сравнивается уже он.
+    Кандидаты на пересечение ищутся в R-дереве (STRtree) по классу, IoU считается векторно.
+    Маски меньше чем из 3 вершин ни с чем не пересекаются и проходят фильтр без изменений
     """
+    polygons = np.array([Polygon(res['points']) if len(res['points']) >= 3 else Polygon() for res in masks_results],
+                        dtype=object)
+    areas = shapely.area(polygons) if len(polygons) else np.zeros(0)
+
+    cls_indexes = {}
+    for i, res in enumerate(masks_results):
+        cls_indexes.setdefault(res['cls_num'], []).append(i)
+    trees = {cls_num: (STRtree(polygons[indexes]), np.array(indexes)) for cls_num, indexes in cls_indexes.items()}
+
     unique_results = []
-    skip_nums = []
+    skip_nums = set()
     for i in range(len(masks_results)):
         if float(masks_results[i]['conf']) < conf_thres:
             continue
 
-        biggest_mask = None
-
         if i in skip_nums:
             continue
 
-        for j in range(i + 1, len(masks_results)):
-
-            if j in skip_nums:
-                continue
-
-            if masks_results[i]['cls_num'] != masks_results[j]['cls_num']:
-                continue
-
-            if biggest_mask:
-                pol1 = Polygon(biggest_mask['points'])
-            else:
-                pol1 = Polygon(masks_results[i]['points'])
-
-            pol2 = Polygon(masks_results[j]['points'])
-
-            un = pol1.union(pol2)
-            inter = pol1.intersection(pol2)
-
-            if inter and un:
-                iou = inter.area / un.area
-
-                if iou > iou_filter:
+        tree, indexes = trees[masks_results[i]['cls_num']]
+        biggest = i
+        tek = i
+        while True:
+            # кандидаты после текущей позиции, чьи рамки пересекаются с текущей маской
+            candidates = indexes[tree.query(polygons[biggest])]
+            candidates = np.sort(candidates[candidates > tek])
+            candidates = np.array([j for j in candidates.tolist() if j not in skip_nums], dtype=np.int64)
+            if not len(candidates):
+                break
 
-                    if pol1.area < pol2.area:
-                        biggest_mask = masks_results[j]
+            is_dup = calc_ious(polygons[biggest], polygons[candidates]) > iou_filter
+            is_bigger = is_dup & (areas[candidates] > areas[biggest])
+            if not is_bigger.any():
+                skip_nums.update(candidates[is_dup].tolist())
+                break
 
-                    skip_nums.append(j)
+            # до первого большего дубликата маска не меняется, после - сравнение с ним заново
+            k = int(np.argmax(is_bigger))
+            skip_nums.update(candidates[:k + 1][is_dup[:k + 1]].tolist())
+            biggest = tek = int(candidates[k])
 
-        if biggest_mask:
-            unique_results.append(biggest_mask)
-        else:
-            unique_results.append(masks_results[i])
+        unique_results.append(masks_results[biggest])
 
     return unique_results
 
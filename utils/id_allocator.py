@@ -0,0 +1,80 @@
+import heapq
+
+import numpy as np
+
+from utils.shape_columns import NO_ID, iter_columns
+
+# поле проекта, в котором хранится следующий свободный id полигона
+NEXT_ID_FIELD = "next_label_id"
+
+
+class IdAllocator:
+    """
+    Выдача уникальных id полигонов за O(1) (O(log n) при повторном использовании):
+    занятые id - во множестве, освобожденные - в куче (выдается наименьший),
+    новые - с монотонно растущей верхней границы high_water
+    """
+
+    def __init__(self, high_water=0):
+        self.reset(high_water)
+
+    def reset(self, high_water=0):
+        self.used = set()
+        self.free = []
+        self.high_water = high_water
+
+    def allocate(self):
+        while self.free:
+            id_tek = heapq.heappop(self.free)
+            # в куче могут остаться id, занятые повторно через reserve
+            if id_tek not in self.used:
+                self.used.add(id_tek)
+                return id_tek
+
+        id_tek = self.high_water
+        self.high_water += 1
+        self.used.add(id_tek)
+        return id_tek
+
+    def reserve(self, id_tek):
+        """
+        Отметка id, пришедшего извне (из проекта, с импортом) как занятого
+        """
+        if id_tek is None or id_tek == NO_ID:
+            return
+        self.used.add(id_tek)
+        if id_tek >= self.high_water:
+            self.high_water = id_tek + 1
+
+    def reserve_many(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[ids != NO_ID]
+        if not len(ids):
+            return
+        self.used.update(ids.tolist())
+        self.high_water = max(self.high_water, int(ids.max()) + 1)
+
+    def release(self, id_tek):
+        if id_tek in self.used:
+            self.used.remove(id_tek)
+            heapq.heappush(self.free, id_tek)
+
+    def is_used(self, id_tek):
+        return id_tek in self.used
+
+
+def calc_next_id(images):
+    """
+    Следующий свободный id по всем полигонам проекта - для проектов, сохраненных без NEXT_ID_FIELD
+    """
+    next_id = 0
+    for _, shapes in iter_columns(images):
+        if len(shapes):
+            next_id = max(next_id, int(shapes.ids.max()) + 1)
+    return next_id
+
+
+def ensure_next_id(data):
+    if NEXT_ID_FIELD not in data:
+        data[NEXT_ID_FIELD] = calc_next_id(data["images"])
+    return data[NEXT_ID_FIELD]
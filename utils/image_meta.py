@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+
+from PIL import Image
+
+# сколько байт с начала и с конца файла участвует в быстром хэше
+HASH_CHUNK = 64 * 1024
+
+
+def get_meta_name(project_path):
+    return project_path + '.imgmeta'
+
+
+def read_png(f, head):
+    if head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', head[16:24])
+    # тип цвета: 0 - gray, 2 - RGB, 3 - палитра, 4 - gray + alpha, 6 - RGBA
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(head[25], 3)
+    return width, height, channels
+
+
+def read_gif(f, head):
+    if head[:6] not in (b'GIF87a', b'GIF89a'):
+        return None
+    width, height = struct.unpack('<HH', head[6:10])
+    return width, height, 3
+
+
+def read_bmp(f, head):
+    if head[:2] != b'BM':
+        return None
+    width, height, _, bpp = struct.unpack('<iiHH', head[18:30])
+    return width, abs(height), max(bpp // 8, 1)
+
+
+def read_webp(f, head):
+    if head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        return None
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff, 3
+    if chunk == b'VP8L':
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1, 4
+    if chunk == b'VP8X':
+        has_alpha = head[20] & 0x10
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height, 4 if has_alpha else 3
+    return None
+
+
+def read_jpeg(f, head):
+    if head[:2] != b'\xff\xd8':
+        return None
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        if code == 0xff:
+            # заполняющие байты перед маркером
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        # SOF0..SOF15, кроме DHT (c4), JPG (c8) и DAC (cc)
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            _, height, width, channels = struct.unpack('>BHHB', f.read(6))
+            return width, height, channels
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_tiff(f, head):
+    if head[:4] == b'II*\x00':
+        endian = '<'
+    elif head[:4] == b'MM\x00*':
+        endian = '>'
+    else:
+        return None
+
+    f.seek(struct.unpack(endian + 'I', head[4:8])[0])
+    count = struct.unpack(endian + 'H', f.read(2))[0]
+    tags = {}
+    for _ in range(count):
+        tag, tag_type, _, value = struct.unpack(endian + 'HHI4s', f.read(12))
+        if tag in (256, 257, 277):
+            # SHORT или LONG, значение лежит прямо в записи
+            fmt = 'H' if tag_type == 3 else 'I'
+            tags[tag] = struct.unpack(endian + fmt, value[:struct.calcsize(fmt)])[0]
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257], tags.get(277, 1)
+
+
+HEADER_READERS = (read_png, read_jpeg, read_gif, read_bmp, read_webp, read_tiff)
+
+
+def read_image_header(path):
+    """
+    Ширина, высота и число каналов по заголовку файла, без декодирования изображения.
+    Для неизвестных форматов - через PIL (он тоже читает только заголовок)
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        for reader in HEADER_READERS:
+            try:
+                f.seek(0)
+                size = reader(f, head)
+            except (struct.error, OSError):
+                size = None
+            if size:
+                return size
+
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(path) as img:
+        width, height = img.size
+        return width, height, len(img.getbands())
+
+
+def calc_fast_hash(path, file_size):
+    """
+    Быстрый хэш содержимого: размер файла + начало и конец файла.
+    Для обнаружения подмены изображения, не для криптографии
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(file_size).encode('utf8'))
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_CHUNK))
+        if file_size > 2 * HASH_CHUNK:
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            h.update(f.read(HASH_CHUNK))
+        elif file_size > HASH_CHUNK:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class ImageMetaCache:
+    """
+    Метаданные изображений: путь -> {"width", "height", "channels", "mtime", "size", "hash"}.
+    Заполняется лениво по заголовкам файлов, запись устаревает при смене mtime или размера файла.
+    Сохраняется рядом с проектом, поэтому экспорт не открывает изображения повторно
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.is_changed = False
+
+    def clear(self):
+        with self.lock:
+            self.records = {}
+            self.is_changed = False
+
+    def get(self, path):
+        if path not in self.records:
+            path = os.path.abspath(path)
+        st = os.stat(path)
+        record = self.records.get(path)
+        if record and record["mtime"] == st.st_mtime_ns and record["size"] == st.st_size:
+            return record
+
+        width, height, channels = read_image_header(path)
+        record = {"width": width, "height": height, "channels": channels,
+                  "mtime": st.st_mtime_ns, "size": st.st_size, "hash": None}
+        with self.lock:
+            self.records[path] = record
+            self.is_changed = True
+        return record
+
+    def get_size(self, path):
+        """
+        (ширина, высота) изображения
+        """
+        record = self.get(path)
+        return record["width"], record["height"]
+
+    def get_hash(self, path):
+        record = self.get(path)
+        if record["hash"] is None:
+            with self.lock:
+                record["hash"] = calc_fast_hash(os.path.abspath(path), record["size"])
+                self.is_changed = True
+        return record["hash"]
+
+    def load(self, meta_path):
+        records = {}
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf8') as f:
+                    records = json.load(f)
+            except (OSError, ValueError):
+                # кэш можно потерять - он заполнится заново
+                records = {}
+        with self.lock:
+            self.records = records
+            self.is_changed = False
+
+    def save(self, meta_path):
+        with self.lock:
+            if not self.is_changed:
+                return
+            data = json.dumps(self.records)
+            self.is_changed = False
+
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            f.write(data)
+        os.replace(tmp_path, meta_path)
+
+
+# общий кэш процесса: его используют экспорт, импорт и геопривязка
+cache = ImageMetaCache()
+
+
+def get_image_size(path):
+    return cache.get_size(path)
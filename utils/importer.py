@@ -1,16 +1,23 @@
 from PySide2 import QtCore
 from ui.signals_and_slots import LoadPercentConnection, ErrorConnection, InfoConnection
 from utils import help_functions as hf
+from utils import image_meta
+from utils import json_stream
+from utils import copy_engine
+from utils import rle
+from utils.shape_columns import ShapeColumns
 
 import os
-import shutil
-from PIL import Image
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 
 class Importer(QtCore.QThread):
 
     def __init__(self, coco_data=None, alpha=120, yaml_data=None, is_seg=False, copy_images_path=None, label_names=None,
-                 is_coco=True, dataset="train", coco_name=None):
+                 is_coco=True, dataset="train", coco_name=None, copy_mode='auto'):
         super(Importer, self).__init__()
 
         # SIGNALS
@@ -28,6 +35,8 @@ class Importer(QtCore.QThread):
         self.is_seg = is_seg
         self.copy_images_path = copy_images_path
         self.coco_name = coco_name
+        # способ копирования изображений, см. copy_engine.COPY_MODES
+        self.copy_mode = copy_mode
 
     def get_project(self):
         return self.project
@@ -38,6 +47,15 @@ class Importer(QtCore.QThread):
     def set_copy_images_path(self, path):
         self.copy_images_path = path
 
+    def set_copy_mode(self, copy_mode):
+        self.copy_mode = copy_mode
+
+    def copy_images(self, pairs):
+        counts = copy_engine.copy_files(pairs, self.copy_mode, progress_callback=self.load_percent_conn.percent.emit)
+        if counts:
+            self.info_conn.info_message.emit(
+                "Images: " + ", ".join(f"{method} {count}" for method, count in sorted(counts.items())))
+
     def set_yaml_path(self, path):
         self.yaml_path = path
 
@@ -53,76 +71,109 @@ class Importer(QtCore.QThread):
     def set_dataset_type(self, dataset_type):
         self.dataset = dataset_type
 
-    def filter_data_annotations_by_cls_size(self, data_annotations, cls_size):
+    def iter_coco_items(self):
         """
-        Delete shapes from data if cls_num >= cls_size
+        (ключ, элемент) COCO: из переданного словаря или потоком из файла coco_name.
+        При чтении файла прогресс - по прочитанным кускам файла
         """
-        data_annotations_new = []
+        if self.coco_data:
+            for key, value in self.coco_data.items():
+                if isinstance(value, list):
+                    for item in value:
+                        yield key, item
+                else:
+                    yield key, value
+            return
+
+        reader = json_stream.ObjectStreamReader(self.coco_name, progress_callback=self.load_percent_conn.percent.emit)
+        yield from reader.iter_items()
+
+    def read_coco(self):
         """
-        seg = {"segmentation": all_points, "area": int(area), "bbox": bbox, "iscrowd": 0, "id": seg_id,
-                           "image_id": id_map[filename], "category_id": cls_num + 1}
-                    export_json["annotations"].append(seg)
+        Один проход по COCO: изображения, категории и индекс image_id -> [(номер класса, вершины, RLE)].
+        Маска в RLE сохраняется у полигона как есть, вершины для показа - контур маски
         """
-        for seg in data_annotations:
-            if seg["category_id"] < cls_size:
-                data_annotations_new.append(seg)
-            else:
-                self.info_conn.info_message.emit(f'Filtered seg with category_id {seg["category_id"]}')
+        keys = set()
+        images = []
+        categories = []
+        annotations_index = defaultdict(list)
+        for key, item in self.iter_coco_items():
+            keys.add(key)
+            if key == "images":
+                images.append(item)
+            elif key == "categories":
+                categories.append(item)
+            elif key == "annotations":
+                segmentation = item.get("segmentation")
+                mask_rle = None
+                if isinstance(segmentation, dict):
+                    # несжатые counts переводятся в сжатую строку
+                    mask_rle = {"size": segmentation["size"],
+                                "counts": rle.counts_to_string(rle.get_counts(segmentation))}
+                    points = rle.to_polygon(mask_rle)
+                elif segmentation:
+                    points = np.asarray(segmentation[0], dtype=np.float32).reshape(-1, 2)
+                else:
+                    continue
+                annotations_index[item["image_id"]].append((item["category_id"] - 1, points, mask_rle))
 
-        return data_annotations_new
+        return keys, images, categories, annotations_index
 
     def import_from_coco(self):
 
         self.info_conn.info_message.emit(f"Start import data from {self.coco_name}")
-        data = self.coco_data
         alpha = self.alpha
         label_names = self.label_names
 
+        keys, images, categories, annotations_index = self.read_coco()
+        if not {"images", "annotations", "categories"} <= keys or not images:
+            self.project = {}
+            self.err_conn.error_message.emit(f"{self.coco_name} is not a COCO file")
+            return
+
         if not label_names:
-            label_names = [d["name"] for d in data["categories"]]
+            label_names = []
             id_name = 0
-            label_names_new = []
-            for name in label_names:
-                if name == "":
-                    label_names_new.append(f'label {id_name}')
+            for d in categories:
+                if d["name"] == "":
+                    label_names.append(f'label {id_name}')
                     id_name += 1
-            label_names = label_names_new
-
-        data["annotations"] = self.filter_data_annotations_by_cls_size(data["annotations"], len(label_names))
+                else:
+                    label_names.append(d["name"])
 
         label_colors = hf.get_label_colors(label_names, alpha=alpha)
 
         if self.copy_images_path:
-            # change paths
-            images = []
-
-            for i, im in enumerate(data["images"]):
-                im_copy = im
-                # make sense copy from real folder, not from flickr_url
-                save_images_folder = self.copy_images_path
-                if os.path.exists(im['flickr_url']):
-                    shutil.copy(im['flickr_url'], os.path.join(save_images_folder, im["file_name"]))
-
-                elif os.path.exists(os.path.join(os.path.dirname(self.coco_name), im["file_name"])):
-                    shutil.copy(os.path.join(os.path.dirname(self.coco_name), im["file_name"]),
-                                os.path.join(save_images_folder, im["file_name"]))
-                else:
-                    continue
-
-                im_copy['flickr_url'] = os.path.join(save_images_folder, im["file_name"])
-                im_copy['coco_url'] = os.path.join(save_images_folder, im["file_name"])
-                images.append(im_copy)
-
-                self.load_percent_conn.percent.emit(int(i * 100.0 / len(data["images"])))
-
-            data["images"] = images
+            # make sense copy from real folder, not from flickr_url
+            pairs = []
+            copied_images = []
+            for im in images:
+                src = im['flickr_url']
+                if not os.path.exists(src):
+                    src = os.path.join(os.path.dirname(self.coco_name), im["file_name"])
+                    if not os.path.exists(src):
+                        continue
+
+                dst = os.path.join(self.copy_images_path, im["file_name"])
+                pairs.append((src, dst))
+                im['flickr_url'] = dst
+                im['coco_url'] = dst
+                copied_images.append(im)
+
+            self.copy_images(pairs)
+
+            images = copied_images
+            if not images:
+                self.project = {}
+                self.err_conn.error_message.emit(f"Can't find images for {self.coco_name}")
+                return
 
-        project_path = os.path.dirname(data["images"][0]["coco_url"])
+        project_path = os.path.dirname(images[0]["coco_url"])
         if not os.path.exists(project_path):
             self.info_conn.info_message.emit(
                 f"Can't find images in {project_path} Try to find images in {os.path.dirname(self.coco_name)} ")
             project_path = os.path.dirname(self.coco_name)
-            first_im_name = os.path.basename(data["images"][0]["coco_url"])
+            first_im_name = os.path.basename(images[0]["coco_url"])
             if not os.path.exists(os.path.join(project_path, first_im_name)):
                 self.project = {}
                 self.err_conn.error_message.emit(
@@ -133,21 +184,19 @@ class Importer(QtCore.QThread):
                    "images": [], 'labels': label_names, 'labels_color': label_colors}
 
         id_num = 0
-        for i, im in enumerate(data["images"]):
-            im_id = im["id"]
-            proj_im = {'filename': im["file_name"], 'shapes': []}
-            for seg in data["annotations"]:
-                if seg["image_id"] == im_id:
-                    cls = seg["category_id"] - 1
-                    points = [[seg["segmentation"][0][i], seg["segmentation"][0][i + 1]] for i in
-                              range(0, len(seg["segmentation"][0]), 2)]
-                    shape = {"id": id_num, "cls_num": cls, 'points': points}
-                    id_num += 1
-                    proj_im["shapes"].append(shape)
-
-            project['images'].append(proj_im)
-
-            self.load_percent_conn.percent.emit(int(i * 100.0 / len(data["images"])))
+        filtered_count = 0
+        for im in images:
+            annotations = annotations_index.pop(im["id"], [])
+            # полигоны классов, которых нет в списке имен, отбрасываются
+            kept = [annotation for annotation in annotations if 0 <= annotation[0] < len(label_names)]
+            filtered_count += len(annotations) - len(kept)
+
+            shapes = make_shape_columns(kept, id_num)
+            id_num += len(kept)
+            project['images'].append({'filename': im["file_name"], 'shapes': shapes})
+
+        if filtered_count:
+            self.info_conn.info_message.emit(f'Filtered {filtered_count} segs with unknown category_id')
 
         self.project = project
 
@@ -164,10 +213,7 @@ class Importer(QtCore.QThread):
             path_to_images = os.path.join(yaml_data["path"], "images", dataset)
             images = [im for im in os.listdir(path_to_images) if hf.is_im_path(im)]
 
-            # copy images
-            for i, im in enumerate(images):
-                shutil.copy(os.path.join(path_to_images, im), os.path.join(copy_images_path, im))
-                self.load_percent_conn.percent.emit(int(i * 100.0 / len(images)))
+            self.copy_images([(os.path.join(path_to_images, im), os.path.join(copy_images_path, im)) for im in images])
 
             path_to_images = copy_images_path
 
@@ -183,77 +229,47 @@ class Importer(QtCore.QThread):
             self.import_from_yolo_box(path_to_labels, path_to_images, labels_names, label_colors)
 
     def import_from_yolo_box(self, path_to_labels, path_to_images, labels_names, labels_color):
-        project = {'path_to_images': path_to_images, 'images': [], "labels": labels_names, "labels_color": labels_color}
-        images = [im for im in os.listdir(path_to_images) if hf.is_im_path(im)]
-        id_num = 0
-        for i, im in enumerate(images):
-            # im_shape = cv2.imread(os.path.join(path_to_images, im)).shape
-            width, height = Image.open(os.path.join(path_to_images, im)).size
-            im_shape = [height, width]
-
-            txt_name = hf.convert_image_name_to_txt_name(im)
-            image_data = {"filename": im, 'shapes': []}
-
-            if not os.path.exists(os.path.join(path_to_labels, txt_name)):
-                self.load_percent_conn.percent.emit(int(i * 100.0 / len(images)))
-                continue
-
-            with open(os.path.join(path_to_labels, txt_name), 'r') as f:
-                for line in f:
-                    shape = {}
-                    cls_data = line.strip().split(' ')
-
-                    shape["cls_num"] = int(cls_data[0])
-                    shape["id"] = int(id_num)
-                    id_num += 1
-
-                    x = int(float(cls_data[1]) * im_shape[1])
-                    y = int(float(cls_data[2]) * im_shape[0])
-                    w = int(float(cls_data[3]) * im_shape[1])
-                    h = int(float(cls_data[4]) * im_shape[0])
-
-                    shape["points"] = [[x - w / 2, y - h / 2], [x + w / 2, y - h / 2], [x + w / 2, y + h / 2],
-                                       [x - w / 2, y + h / 2]]
-                    image_data["shapes"].append(shape)
-
-            project['images'].append(image_data)
-            self.load_percent_conn.percent.emit(int(i * 100.0 / len(images)))
-
-        self.project = project
+        self.import_from_yolo(path_to_labels, path_to_images, labels_names, labels_color, is_seg=False)
 
     def import_from_yolo_seg(self, path_to_labels, path_to_images, labels_names, labels_color):
+        self.import_from_yolo(path_to_labels, path_to_images, labels_names, labels_color, is_seg=True)
+
+    def import_from_yolo(self, path_to_labels, path_to_images, labels_names, labels_color, is_seg,
+                         max_workers=None):
+        """
+        Импорт YOLO: txt-файлы читаются и разбираются в пуле потоков, каждый файл - одним разбором в NumPy,
+        размеры изображений - по заголовкам файлов. Изображения без txt-файла не попадают в проект
+        """
         project = {'path_to_images': path_to_images, 'images': [], "labels": labels_names, "labels_color": labels_color}
         images = [im for im in os.listdir(path_to_images) if hf.is_im_path(im)]
-        id_num = 0
-        for i, im in enumerate(images):
-            # im_shape = cv2.imread(os.path.join(path_to_images, im)).shape
-            width, height = Image.open(os.path.join(path_to_images, im)).size
-            im_shape = [height, width]
-
-            txt_name = hf.convert_image_name_to_txt_name(im)
-            image_data = {"filename": im, 'shapes': []}
-
-            if not os.path.exists(os.path.join(path_to_labels, txt_name)):
-                self.load_percent_conn.percent.emit(int(i * 100.0 / len(images)))
-                self.info_conn.info_message.emit(f"Can't find labels for {im}")
-                continue
+        parse_labels = parse_yolo_seg if is_seg else parse_yolo_box
 
-            with open(os.path.join(path_to_labels, txt_name), 'r') as f:
-                for line in f:
-                    shape = {}
-                    cls_data = line.strip().split(' ')
+        def read_image(im):
+            txt_path = os.path.join(path_to_labels, hf.convert_image_name_to_txt_name(im))
+            if not os.path.exists(txt_path):
+                return None
+            width, height = image_meta.get_image_size(os.path.join(path_to_images, im))
+            with open(txt_path, 'r') as f:
+                return parse_labels(f.read(), width, height)
 
-                    shape["cls_num"] = int(cls_data[0])
-                    shape["id"] = int(id_num)
-                    id_num += 1
-
-                    shape["points"] = [
-                        [int(float(cls_data[i]) * im_shape[1]), int(float(cls_data[i + 1]) * im_shape[0])] for i in
-                        range(1, len(cls_data), 2)]
-                    image_data["shapes"].append(shape)
+        id_num = 0
+        last_percent = -1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, (im, parsed) in enumerate(zip(images, executor.map(read_image, images))):
+                percent = int(i * 100.0 / len(images))
+                if percent != last_percent:
+                    self.load_percent_conn.percent.emit(percent)
+                    last_percent = percent
+
+                if parsed is None:
+                    if is_seg:
+                        self.info_conn.info_message.emit(f"Can't find labels for {im}")
+                    continue
 
-            project['images'].append(image_data)
-            self.load_percent_conn.percent.emit(int(i * 100.0 / len(images)))
+                coords, offsets, cls_nums = parsed
+                ids = np.arange(id_num, id_num + len(cls_nums), dtype=np.int64)
+                id_num += len(cls_nums)
+                project['images'].append({"filename": im, 'shapes': ShapeColumns(coords, offsets, cls_nums, ids)})
 
         self.project = project
 
@@ -262,3 +278,69 @@ class Importer(QtCore.QThread):
             self.import_from_coco()
         else:
             self.import_from_yolo_yaml()
+
+
+def make_shape_columns(annotations, first_id):
+    """
+    Колонки полигонов изображения из списка (номер класса, вершины N x 2, RLE или None), id - подряд с first_id
+    """
+    offsets = np.zeros(len(annotations) + 1, dtype=np.int64)
+    np.cumsum([len(points) for _, points, _ in annotations], out=offsets[1:])
+    coords = np.concatenate([points for _, points, _ in annotations]) if annotations else np.zeros((0, 2),
+                                                                                                  dtype=np.float32)
+    cls_nums = np.array([cls_num for cls_num, _, _ in annotations], dtype=np.int32)
+    ids = np.arange(first_id, first_id + len(annotations), dtype=np.int64)
+    extras = {i: {rle.RLE_FIELD: mask_rle} for i, (_, _, mask_rle) in enumerate(annotations) if mask_rle}
+    return ShapeColumns(coords, offsets, cls_nums, ids, extras=extras or None)
+
+
+def parse_yolo_txt(text):
+    """
+    Разбор txt-файла YOLO целиком: все числа файла одним вызовом NumPy,
+    начало и число значений каждой строки
+    """
+    counts = np.array([len(line.split()) for line in text.splitlines()], dtype=np.int64)
+    counts = counts[counts > 0]
+    values = np.fromstring(text, sep=' ')
+    if len(values) != counts.sum():
+        # fromstring останавливается на первом нечисловом значении
+        values = np.array(text.split(), dtype=np.float64)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return values, starts, counts
+
+
+def parse_yolo_box(text, width, height):
+    """
+    Строки "cls xc yc w h" (нормированные) -> прямоугольники в пикселях: вершины, границы полигонов, классы
+    """
+    values, starts, counts = parse_yolo_txt(text)
+    starts = starts[counts >= 5]
+    size = np.array([width, height], dtype=np.float64)
+    # как и раньше, центр и размер округляются до целых пикселей
+    centers = np.trunc(np.stack([values[starts + 1], values[starts + 2]], axis=1) * size)
+    half = np.trunc(np.stack([values[starts + 3], values[starts + 4]], axis=1) * size) / 2
+
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64)
+    coords = (centers[:, None, :] + corners[None, :, :] * half[:, None, :]).reshape(-1, 2).astype(np.float32)
+    offsets = np.arange(0, 4 * len(starts) + 1, 4, dtype=np.int64)
+    return coords, offsets, values[starts].astype(np.int32)
+
+
+def parse_yolo_seg(text, width, height):
+    """
+    Строки "cls x1 y1 x2 y2 ..." (нормированные) -> вершины в пикселях, границы полигонов, классы
+    """
+    values, starts, counts = parse_yolo_txt(text)
+    is_coord = np.ones(len(values), dtype=bool)
+    is_coord[starts] = False
+    # непарная последняя координата строки отбрасывается
+    points_counts = (counts - 1) // 2
+    odd = (counts - 1) % 2 == 1
+    is_coord[(starts + counts - 1)[odd]] = False
+
+    size = np.array([width, height], dtype=np.float64)
+    coords = np.trunc(values[is_coord].reshape(-1, 2) * size).astype(np.float32)
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(points_counts, out=offsets[1:])
+    return coords, offsets, values[starts].astype(np.int32)
@@ -0,0 +1,119 @@
+import json
+import os
+import re
+
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JsonStreamError(Exception):
+    pass
+
+
+class ObjectStreamReader:
+    """
+    Потоковое чтение JSON-файла с объектом верхнего уровня (как COCO): файл читается кусками по chunk_size,
+    элементы массивов верхнего уровня разбираются по одному, прочие значения - целиком.
+    В памяти - текущий кусок файла и один элемент
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, progress_callback=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.file_size = os.path.getsize(path)
+        self.read_size = 0
+        self.decoder = json.JSONDecoder()
+        self.f = None
+        self.buf = ''
+        self.pos = 0
+        self.is_eof = False
+
+    def read_chunk(self):
+        if self.is_eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.is_eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.read_size += len(chunk.encode('utf8'))
+        if self.progress_callback and self.file_size:
+            self.progress_callback(min(int(self.read_size * 100 / self.file_size), 100))
+        return True
+
+    def peek(self):
+        """
+        Следующий непробельный символ (позиция встает на него), '' - конец файла
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_chunk():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise JsonStreamError(f"{self.path}: expected '{char}' at offset {self.read_size - len(self.buf) + self.pos}")
+        self.pos += 1
+
+    def decode_value(self):
+        """
+        Разбор одного значения. Если значение упирается в конец куска - дочитываем и разбираем заново:
+        число или строка могли оборваться на границе куска
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_chunk():
+                    raise
+                continue
+            if end == len(self.buf) and self.read_chunk():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise JsonStreamError(f"{self.path}: expected ',' or ']' in array")
+
+    def iter_items(self):
+        """
+        (ключ, элемент) для элементов массивов верхнего уровня и (ключ, значение) для остальных ключей
+        """
+        with open(self.path, 'r', encoding='utf8') as f:
+            self.f = f
+            self.expect('{')
+            if self.peek() == '}':
+                return
+            while True:
+                key = self.decode_value()
+                self.expect(':')
+                if self.peek() == '[':
+                    for item in self.iter_array():
+                        yield key, item
+                else:
+                    yield key, self.decode_value()
+
+                char = self.peek()
+                self.pos += 1
+                if char == '}':
+                    return
+                if char != ',':
+                    raise JsonStreamError(f"{self.path}: expected ',' or '}}' in object")
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+from rasterio import features
+
+from utils import image_meta
+from utils import rle
+from utils.shape_columns import iter_columns
+
+# сколько изображений на процесс держим в очереди - полигоны остальных не копируются в процессы заранее
+TASKS_PER_WORKER = 4
+
+
+def get_mask_dtype(max_value):
+    return np.uint8 if max_value < 256 else np.uint16
+
+
+def render_mask(coords, offsets, values, width, height, background=0, rles=None):
+    """
+    Семантическая маска H x W: все полигоны изображения растеризуются одним вызовом rasterize,
+    каждый со своим значением (values). Полигоны перекрываются в порядке следования.
+    rles - {номер полигона: маска RLE}: такие полигоны берутся из маски, а не из вершин, и рисуются поверх
+    """
+    rles = rles or {}
+    dtype = get_mask_dtype(max([background] + list(values)))
+    coords = coords.tolist()
+    geometries = []
+    for i, value in enumerate(values):
+        ring = coords[offsets[i]:offsets[i + 1]]
+        if i in rles or len(ring) < 3:
+            continue
+        geometries.append(({"type": "Polygon", "coordinates": [ring + ring[:1]]}, value))
+
+    if geometries:
+        mask = features.rasterize(geometries, out_shape=(height, width), fill=background, dtype=dtype)
+    else:
+        mask = np.full((height, width), background, dtype=dtype)
+
+    for i, mask_rle in rles.items():
+        if tuple(mask_rle["size"]) == (height, width):
+            mask[rle.decode(mask_rle)] = values[i]
+    return mask
+
+
+def write_mask(mask_path, coords, offsets, values, width, height, background=0, rles=None):
+    mask = render_mask(coords, offsets, values, width, height, background=background, rles=rles)
+    tmp_path = mask_path + '.tmp.png'
+    if not cv2.imwrite(tmp_path, mask):
+        raise OSError(f"Can't write mask {mask_path}")
+    os.replace(tmp_path, mask_path)
+
+
+def get_mask_name(filename):
+    return os.path.splitext(filename)[0] + '.png'
+
+
+def export_masks(images, path_to_images, export_dir, background_cls=0, progress_callback=None, max_workers=None):
+    """
+    Экспорт семантических масок PNG: по маске на изображение, значение пикселя - номер класса.
+    Если background_cls == 0, фон - 0, а классы нумеруются с 1, как в create_png_from_yolo.
+    Полигоны читаются из проекта, маски рисуются в пуле процессов.
+    Возвращает число записанных масок
+    """
+    images_dir = os.path.join(os.path.abspath(path_to_images), '')
+    shift = 1 if background_cls == 0 else 0
+    count = len(images)
+    last_percent = -1
+    done = 0
+
+    def on_done(finished):
+        nonlocal done, last_percent
+        for future in finished:
+            future.result()
+            done += 1
+        percent = int(done * 100 / count)
+        if progress_callback and percent != last_percent:
+            progress_callback(percent)
+            last_percent = percent
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_workers * TASKS_PER_WORKER
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for filename, shapes in iter_columns(images):
+            try:
+                width, height = image_meta.get_image_size(images_dir + filename)
+            except FileNotFoundError:
+                count -= 1
+                continue
+
+            rles = {pos: extra[rle.RLE_FIELD] for pos, extra in (shapes.extras or {}).items() if
+                    extra.get(rle.RLE_FIELD)}
+            values = (shapes.cls_nums.astype(np.int64) + shift).tolist()
+            pending.add(executor.submit(write_mask, os.path.join(export_dir, get_mask_name(filename)),
+                                        shapes.coords, shapes.offsets.tolist(), values, width, height,
+                                        background_cls, rles))
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                on_done(finished)
+
+        if pending:
+            on_done(wait(pending)[0])
+
+    if progress_callback and last_percent != 100:
+        progress_callback(100)
+    return done
@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+import rasterio
+import shapely
+from rasterio import features
+
+# rasterio.features.shapes - контуры по границам пикселей, с дырами, отдельно для каждого значения маски
+METHOD_RASTERIO = 'rasterio'
+# cv2.findContours - быстрее, только внешние контуры по центрам граничных пикселей, все значения > 0 - одна маска
+METHOD_CV2 = 'cv2'
+
+
+def to_mask_stack(masks):
+    """
+    Маски (H x W) или их список одного размера -> массив N x H x W
+    """
+    masks = np.asarray(masks)
+    if masks.ndim == 2:
+        masks = masks[None]
+    return masks
+
+
+def calc_bboxes(masks):
+    """
+    Рамки [x_min, y_min, x_max, y_max) ненулевых пикселей всех масок разом и признак непустой маски
+    """
+    filled = masks > 0
+    rows = filled.any(axis=2)
+    cols = filled.any(axis=1)
+    is_filled = rows.any(axis=1)
+    height, width = masks.shape[1:]
+    bboxes = np.stack([cols.argmax(axis=1), rows.argmax(axis=1),
+                       width - cols[:, ::-1].argmax(axis=1), height - rows[:, ::-1].argmax(axis=1)], axis=1)
+    return bboxes, is_filled
+
+
+def crop_polygons_rasterio(crop, x_min, y_min):
+    values = crop.astype(np.uint8) if crop.dtype == bool else crop.astype(np.int16)
+    return [shapely.geometry.shape(shape) for shape, value in
+            features.shapes(values, mask=(values > 0), transform=rasterio.Affine(1.0, 0, x_min, 0, 1.0, y_min))]
+
+
+def crop_polygons_cv2(crop, x_min, y_min):
+    # рамка в 1 пиксель, чтобы контуры у края обрезки замыкались так же, как на полной маске
+    binary = np.pad((crop > 0).astype(np.uint8), 1)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                   offset=(int(x_min) - 1, int(y_min) - 1))
+    return [shapely.Polygon(contour.reshape(-1, 2)) for contour in contours if len(contour) >= 3]
+
+
+def masks_to_polygons(masks, simplify_factor=None, method=METHOD_RASTERIO):
+    """
+    Полигоны (shapely) для стека масок N x H x W: по списку на маску.
+    Каждая маска векторизуется только в пределах рамки своих пикселей, координаты - в пикселях полной маски.
+    Если задан simplify_factor - все полигоны всех масок упрощаются одним вызовом shapely.simplify
+    """
+    masks = to_mask_stack(masks)
+    crop_polygons = crop_polygons_cv2 if method == METHOD_CV2 else crop_polygons_rasterio
+    bboxes, is_filled = calc_bboxes(masks)
+
+    results = []
+    for mask, (x_min, y_min, x_max, y_max), filled in zip(masks, bboxes.tolist(), is_filled.tolist()):
+        results.append(crop_polygons(mask[y_min:y_max, x_min:x_max], x_min, y_min) if filled else [])
+
+    if simplify_factor:
+        counts = [len(polygons) for polygons in results]
+        simplified = shapely.simplify(np.array([pol for polygons in results for pol in polygons], dtype=object),
+                                      simplify_factor, preserve_topology=False).tolist()
+        ends = np.cumsum(counts).tolist()
+        results = [simplified[end - count:end] for end, count in zip(ends, counts)]
+    return results
+
+
+def polygons_to_points(polygons, dtype=np.float64):
+    """
+    Вершины внешнего контура (с замыкающей точкой) каждого полигона - массивы K x 2 типа dtype.
+    Для пустых, составных и полигонов с дырами - None, как при ошибке boundary.xy
+    """
+    if not len(polygons):
+        return []
+    polygons = np.array(polygons, dtype=object)
+    is_simple = (shapely.get_type_id(polygons) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(polygons) & \
+                (shapely.get_num_interior_rings(polygons) == 0)
+
+    results = [None] * len(polygons)
+    simple_nums = np.flatnonzero(is_simple)
+    if not len(simple_nums):
+        return results
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(polygons[simple_nums]), return_index=True)
+    coords = coords.astype(dtype)
+    ends = np.cumsum(np.bincount(index, minlength=len(simple_nums))).tolist()
+    start = 0
+    for num, end in zip(simple_nums.tolist(), ends):
+        results[num] = coords[start:end]
+        start = end
+    return results
@@ -1,14 +1,27 @@
 import utils.config as config
-import datetime
 import utils.help_functions as hf
 import json
 import numpy as np
 import os
+from collections import namedtuple
 
-from PIL import Image
-
-from shapely import Polygon
+from utils.dataset_stats import DatasetStats
+from utils.id_allocator import IdAllocator, ensure_next_id, NEXT_ID_FIELD
+from utils.project_history import ProjectHistory, HISTORY_FIELD
 from utils.saver_worker import SaverLoaderWorker
+from utils import project_journal as journal
+from utils import project_stream
+from utils import project_history
+from utils import image_meta
+from utils import yolo_export
+from utils import coco_export
+from utils import mask_export
+from utils import shard_export
+from utils import project_sqlite
+from utils import shape_columns
+
+# результат расчета перенумерации классов: имя изображения -> (исходные полигоны, перенумерованные)
+ClsRemapResult = namedtuple('ClsRemapResult', ('cls_remap', 'shapes'))
 
 
 class ProjectHandler:
@@ -43,17 +56,91 @@ class ProjectHandler:
         self.saver_mode = None
         self.save_callback = None
         self.load_callback = None
+        self.stats = DatasetStats()
+        self.id_allocator = IdAllocator()
+        self.history = ProjectHistory()
+        self.init_ids()
+        self.reindex()
+        self.reset_changes(saved_path=None)
+        self.is_full_save_needed = True
+
+    def reset_changes(self, saved_path):
+        """
+        Сброс учета изменений после сохранения/загрузки.
+        Следующее сохранение в тот же файл допишет в журнал только измененные изображения
+        """
+        self.dirty_images = set()
+        self.deleted_images = set()
+        self.cls_remaps = []
+        self.saved_path = saved_path
+        self.is_full_save_needed = False
+
+    def mark_image_changed(self, image_name):
+        self.dirty_images.add(image_name)
+        self.deleted_images.discard(image_name)
+
+    def mark_image_deleted(self, image_name):
+        self.deleted_images.add(image_name)
+        self.dirty_images.discard(image_name)
+
+    def reindex(self):
+        """
+        Перестроение индексов filename -> позиция, id -> (image, номер полигона), label -> index
+        Вызывается после полной замены данных проекта. Полигоны переводятся в колоночный вид.
+        Для лениво загруженного проекта индексируются полигоны только уже разобранных изображений
+        """
+        self.images_pos = {}
+        self.shapes_index = {}
+
+        for pos, filename in enumerate(project_stream.iter_filenames(self.data["images"])):
+            self.images_pos.setdefault(filename, pos)
+
+        for im in project_stream.iter_loaded(self.data["images"]):
+            shape_columns.compact(im)
+            self.index_shapes(im)
+
+        self.reindex_labels()
+
+    def reindex_labels(self):
+        self.labels_index = {}
+        for i, label in enumerate(self.data["labels"]):
+            self.labels_index.setdefault(label, i)
+
+    def init_ids(self):
+        """
+        Аллокатор id полигонов продолжает нумерацию с сохраненной в проекте границы
+        """
+        self.id_allocator.reset(ensure_next_id(self.data))
+
+    def get_id_allocator(self):
+        return self.id_allocator
+
+    def index_shapes(self, image):
+        ids = shape_columns.get_ids(image["shapes"])
+        for pos, shape_id in enumerate(ids):
+            if shape_id != shape_columns.NO_ID:
+                self.shapes_index[shape_id] = (image, pos)
+        self.id_allocator.reserve_many(ids)
+
+    def unindex_shapes(self, image, is_release_ids=True):
+        for shape_id in shape_columns.get_ids(image["shapes"]):
+            indexed = self.shapes_index.get(shape_id)
+            if indexed and indexed[0] is image:
+                del self.shapes_index[shape_id]
+                if is_release_ids:
+                    self.id_allocator.release(shape_id)
+
+    def get_stats(self):
+        """
+        Статистика разметки (DatasetStats). Строится при первом обращении, дальше обновляется
+        при каждом изменении проекта
+        """
+        if not self.stats.is_built:
+            self.stats.build(self.data["images"])
+        return self.stats
 
     def calc_dataset_balance(self):
-        cls_nums = {}
-        for im in self.data['images']:
-            for shape in im['shapes']:
-                cls_num = shape['cls_num']
-                if cls_num not in cls_nums:
-                    cls_nums[cls_num] = 1
-                else:
-                    cls_nums[cls_num] += 1
-        return cls_nums
+        return self.get_stats().class_counts()
 
     def load(self, json_path, on_load_callback=None):
         self.saver_loader.enqueue_load(json_path)
@@ -76,13 +163,33 @@ class ProjectHandler:
 
     def on_load_end(self):
         self.data = self.saver_loader.last_version.json_data
+        self.history.load(self.data.get(HISTORY_FIELD))
+        image_meta.cache.load(image_meta.get_meta_name(self.saver_loader.last_version.filename))
+        self.stats.clear()
+        self.init_ids()
+        self.reindex()
+        self.reset_changes(saved_path=self.saver_loader.last_version.filename)
         self.is_loaded = True
         if self.load_callback:
             self.load_callback()
 
     def save(self, json_path, on_save_callback=None):
+        self.data[NEXT_ID_FIELD] = self.id_allocator.high_water
+        self.data[HISTORY_FIELD] = self.history.to_data()
 
-        self.saver_loader.enqueue_save(json_path, self.data)
+        # SQLite перенумеровывает классы одним UPDATE, JSON-проект после перенумерации пишется целиком
+        is_remap_in_json = self.cls_remaps and not project_sqlite.is_sqlite_path(json_path)
+        if self.is_full_save_needed or json_path != self.saved_path or is_remap_in_json:
+            journal_record = None
+        else:
+            changed_images = [self.get_image_data(name) for name in self.dirty_images if name in self.images_pos]
+            journal_record = journal.create_record(self.data, changed_images, self.deleted_images, self.cls_remaps,
+                                                   self.history.get_changes())
+
+        self.saver_loader.enqueue_save(json_path, self.data, journal_record)
+        image_meta.cache.save(image_meta.get_meta_name(json_path))
+        self.reset_changes(saved_path=json_path)
+        self.history.mark_saved()
 
         self.save_callback = on_save_callback
 
@@ -103,20 +210,18 @@ class ProjectHandler:
     def restart(self):
         if not self.saver_loader.isRunning():
             if self.save_callback:
-                self.saver_loader.on_save.on_finished.connect(save_callback)
+                self.saver_loader.on_save.on_finished.connect(self.save_callback)
             if self.load_callback:
-                self.saver_loader.on_load.on_finished.connect(load_callback)
+                self.saver_loader.on_load.on_finished.connect(self.load_callback)
             self.saver_loader.start()
 
-    def update_ids(self):
-        id_num = 0
-        for im in self.data['images']:
-            for shape in im['shapes']:
-                shape['id'] = id_num
-                id_num += 1
-
     def set_data(self, data):
         self.data = data
+        self.history.load(self.data.get(HISTORY_FIELD))
+        self.stats.clear()
+        self.init_ids()
+        self.reindex()
+        self.is_full_save_needed = True
         self.is_loaded = True
 
     def get_data(self):
@@ -129,20 +234,24 @@ class ProjectHandler:
         return None
 
     def get_label_num(self, label_name):
-        for i, label in enumerate(self.data["labels"]):
-            if label == label_name:
-                return i
-        return -1
+        return self.labels_index.get(label_name, -1)
 
     def get_colors(self):
         return [tuple(self.data["labels_color"][key]) for key in
                 self.data["labels_color"]]
 
     def get_image_data(self, image_name):
-        for im in self.data["images"]:
-            if image_name == im["filename"]:
-                return im
-        return None
+        pos = self.images_pos.get(image_name)
+        if pos is None:
+            return None
+
+        images = self.data["images"]
+        is_loaded = project_stream.is_loaded(images, pos)
+        image = images[pos]
+        if not is_loaded:
+            shape_columns.compact(image)
+            self.index_shapes(image)
+        return image
 
     def get_labels(self):
         return self.data["labels"]
@@ -152,22 +261,20 @@ class ProjectHandler:
             return self.data["labels"][cls_num]
 
     def change_cls_num_by_id(self, lbl_id, new_cls_num):
-        new_images = []
-        for im in self.data['images']:
-            new_im = im
-            new_shapes = []
-            for shape in im['shapes']:
-                if lbl_id == shape['id']:
-                    new_shape = shape
-                    new_shape["cls_num"] = new_cls_num
-                    new_im['shapes']
-                    new_shapes.append(new_shape)
-                else:
-                    new_shapes.append(shape)
-            new_im['shapes'] = new_shapes
-            new_images.append(new_im)
-
-        self.data['images'] = new_images
+        indexed = self.shapes_index.get(lbl_id)
+        if indexed:
+            image, pos = indexed
+            old_cls_num = int(image["shapes"].cls_nums[pos])
+            if old_cls_num == new_cls_num:
+                return
+            self.set_shape_cls_num(image, pos, new_cls_num)
+            self.history.push({"op": "cls_num", "filename": image["filename"], "pos": pos,
+                               "old": old_cls_num, "new": new_cls_num})
+
+    def set_shape_cls_num(self, image, pos, cls_num):
+        image["shapes"] = shape_columns.set_cls_num(image["shapes"], pos, cls_num)
+        self.stats.set_image(image["filename"], image["shapes"])
+        self.mark_image_changed(image["filename"])
 
     def get_image_path(self):
         return self.data["path_to_images"]
@@ -179,6 +286,10 @@ class ProjectHandler:
             del self.data["labels_color"][old_name]
 
     def change_name(self, old_name, new_name):
+        self.rename_label(old_name, new_name)
+        self.history.push({"op": "rename", "old": old_name, "new": new_name})
+
+    def rename_label(self, old_name, new_name):
         self.rename_color(old_name, new_name)
         labels = []
         for i, label in enumerate(self.data["labels"]):
@@ -186,10 +297,11 @@ class ProjectHandler:
                 labels.append(new_name)
             else:
                 labels.append(label)
-        self.data["labels"] = labels
+        self.set_labels(labels)
 
     def set_labels(self, labels):
         self.data["labels"] = labels
+        self.reindex_labels()
 
     def set_path_to_images(self, path):
         self.data["path_to_images"] = path
@@ -233,26 +345,51 @@ class ProjectHandler:
                 self.set_label_color(label_name)
 
     def set_labels_names(self, labels):
-        self.data["labels"] = labels
+        self.set_labels(labels)
 
     def set_all_images(self, images_new):
         self.data["images"] = images_new
+        self.history.clear()
+        self.stats.clear()
+        self.init_ids()
+        self.reindex()
+        self.is_full_save_needed = True
 
     def set_image_data(self, image_data):
+        """
+        Запись изображения в проект. Изменение полигонов попадает в историю как дельта
+        """
+        old_image = self.get_image_data(image_data["filename"])
+        old_shapes = old_image["shapes"] if old_image else []
+        image_data["shapes"] = shape_columns.carry_extras(old_shapes, image_data["shapes"])
+        delta = project_history.diff_shapes(image_data["filename"], old_shapes, image_data["shapes"])
+        if delta:
+            self.history.push(delta)
+
+        self.put_image(image_data)
+
+    def put_image(self, image_data):
         image_name = image_data["filename"]
-        is_found = False
-        images_new = []
-        for im in self.data["images"]:
-            if image_name == im["filename"]:
-                is_found = True
-                images_new.append(image_data)
-            else:
-                images_new.append(im)
+        pos = self.images_pos.get(image_name)
 
-        if not is_found:
-            images_new.append(image_data)
-
-        self.data["images"] = images_new
+        images = self.data["images"]
+        old_ids = set()
+        if pos is None:
+            self.images_pos[image_name] = len(images)
+            images.append(image_data)
+        else:
+            if project_stream.is_loaded(images, pos):
+                old_ids = set(shape_columns.get_ids(images[pos]["shapes"]))
+                self.unindex_shapes(images[pos], is_release_ids=False)
+            images[pos] = image_data
+
+        shape_columns.compact(image_data)
+        self.index_shapes(image_data)
+        # освобождаются только id полигонов, которых больше нет на изображении
+        for shape_id in old_ids.difference(shape_columns.get_ids(image_data["shapes"])):
+            self.id_allocator.release(shape_id)
+        self.stats.set_image(image_name, image_data["shapes"])
+        self.mark_image_changed(image_name)
 
     def delete_label_color(self, label_name):
         if label_name in self.data["labels_color"]:
@@ -266,265 +403,336 @@ class ProjectHandler:
         self.set_labels(labels)
 
     def del_image(self, image_name):
-
-        images = []
-        for image in self.data["images"]:
-            if image_name != image["filename"]:
-                images.append(image)
-
-        self.data["images"] = images
-
-    def delete_data_by_class_name(self, cls_name):
-        for i, label in enumerate(self.data["labels"]):
-            if label == cls_name:
-                self.delete_data_by_class_number(i)
-                self.delete_label_color(label)
-                self.delete_label(label)
-                return
-
-    def delete_data_by_class_number(self, cls_num):
-
-        images = []
-        for image in self.data["images"]:
-            new_shapes = []
-            for shape in image["shapes"]:
-                if shape["cls_num"] < cls_num:
-                    new_shapes.append(shape)
-                elif shape["cls_num"] > cls_num:
-                    shape_new = {}
-                    shape_new["cls_num"] = shape["cls_num"] - 1
-
-                    shape_new["points"] = shape["points"]
-                    shape_new["id"] = shape["id"]
-                    new_shapes.append(shape_new)
-
-            new_image = {}
-            new_image["filename"] = image["filename"]
-            new_image["shapes"] = new_shapes
-
-            images.append(new_image)
-
-        self.data["images"] = images
-
-    def change_data_class_from_to(self, from_cls_name, to_cls_name):
-        # Two stage:
-        # 1) change
+        image = self.get_image_data(image_name)
+        if image is None:
+            return
+
+        self.history.push({"op": "del_image", "pos": self.images_pos[image_name], "image": image})
+        self.remove_image(image_name)
+
+    def remove_image(self, image_name):
+        pos = self.images_pos.pop(image_name, None)
+        if pos is None:
+            return
+
+        images = self.data["images"]
+        if project_stream.is_loaded(images, pos):
+            self.unindex_shapes(images[pos])
+        self.mark_image_deleted(image_name)
+        self.stats.remove_image(image_name)
+
+        del images[pos]
+        self.update_positions(pos)
+
+    def insert_image(self, pos, image_data):
+        images = self.data["images"]
+        pos = min(pos, len(images))
+        images.insert(pos, image_data)
+        self.update_positions(pos)
+
+        shape_columns.compact(image_data)
+        self.index_shapes(image_data)
+        self.stats.set_image(image_data["filename"], image_data["shapes"])
+        self.mark_image_changed(image_data["filename"])
+
+    def update_positions(self, start):
+        # позиции изображений начиная со start сдвинулись
+        images = self.data["images"]
+        for i in range(start, len(images)):
+            self.images_pos[project_stream.get_filename(images, i)] = i
+
+    def delete_data_by_class_name(self, cls_name, remap_result=None):
+        cls_num = self.get_label_num(cls_name)
+        if cls_num == -1:
+            return
+
+        labels = [label for label in self.data["labels"] if label != cls_name]
+        self.apply_cls_remap(self.get_delete_cls_remap(cls_num), remap_result, labels=labels,
+                             deleted_color=cls_name)
+
+    def get_delete_cls_remap(self, cls_num):
+        # старый номер класса -> новый, None - полигоны класса удаляются
+        cls_remap = {}
+        for label_num in range(len(self.data["labels"])):
+            if label_num < cls_num:
+                cls_remap[label_num] = label_num
+            elif label_num > cls_num:
+                cls_remap[label_num] = label_num - 1
+            else:
+                cls_remap[label_num] = None
+        return cls_remap
+
+    def get_change_cls_remap(self, from_cls_num, to_cls_num):
+        # класс from_cls_num сливается с to_cls_num, все номера старше from уменьшаются на 1
+        cls_remap = {}
+        for label_num in range(len(self.data["labels"])):
+            if label_num < from_cls_num:
+                cls_remap[label_num] = label_num
+            elif label_num > from_cls_num:
+                cls_remap[label_num] = label_num - 1
+        cls_remap[from_cls_num] = cls_remap[to_cls_num]
+        return cls_remap
+
+    def delete_data_by_class_number(self, cls_num, remap_result=None):
+        self.apply_cls_remap(self.get_delete_cls_remap(cls_num), remap_result)
+
+    def change_data_class_from_to(self, from_cls_name, to_cls_name, remap_result=None):
         from_cls_num = self.get_label_num(from_cls_name)
         to_cls_num = self.get_label_num(to_cls_name)
+        if from_cls_num == -1 or to_cls_num == -1 or from_cls_num == to_cls_num:
+            return
+
+        labels = [label for label in self.data["labels"] if label != from_cls_name]
+        self.apply_cls_remap(self.get_change_cls_remap(from_cls_num, to_cls_num), remap_result, labels=labels,
+                             deleted_color=from_cls_name)
+
+    def calc_cls_remap(self, cls_remap, progress_callback=None):
+        """
+        Расчет перенумерации классов без изменения проекта - выполняется в рабочем потоке.
+        Возвращает ClsRemapResult: для каждого изображения исходные и перенумерованные колонки полигонов
+        """
+        lut = shape_columns.make_lut(cls_remap)
+        images = self.data["images"]
+        count = len(images)
+        shapes = {}
+        for pos in range(count):
+            if pos >= len(images):
+                # изображения удалены во время расчета - остальные перенумеруются при применении
+                break
+            image = images[pos]
+            old = image["shapes"]
+            shapes[image["filename"]] = (old, shape_columns.ShapeColumns.from_shapes(old).remap(lut))
+            if progress_callback and pos % 100 == 0:
+                progress_callback(int(100 * pos / count))
+
+        if progress_callback:
+            progress_callback(100)
+        return ClsRemapResult(cls_remap, shapes)
+
+    def get_labels_state(self):
+        return {"labels": list(self.data["labels"]), "labels_color": dict(self.data["labels_color"])}
+
+    def set_labels_state(self, state):
+        self.data["labels_color"] = dict(state["labels_color"])
+        self.set_labels(list(state["labels"]))
+
+    def apply_cls_remap(self, cls_remap, remap_result=None, labels=None, deleted_color=None):
+        """
+        Применение перенумерации, рассчитанной calc_cls_remap. Изображения, измененные во время расчета,
+        перенумеровываются заново. Поля полигонов (conf и др.) сохраняются.
+        labels - новый список классов, deleted_color - класс, цвет которого удаляется
+        """
+        if remap_result is None or remap_result.cls_remap != cls_remap:
+            remap_result = self.calc_cls_remap(cls_remap)
+
+        lut = shape_columns.make_lut(cls_remap)
+        before = self.get_labels_state()
+        images_entry = []
+
+        images = self.data["images"]
+        for pos in range(len(images)):
+            if not project_stream.is_loaded(images, pos):
+                continue
+            image = images[pos]
+            old, new = remap_result.shapes.get(image["filename"], (None, None))
+            if image["shapes"] is not old:
+                old = image["shapes"]
+                new = shape_columns.ShapeColumns.from_shapes(old).remap(lut)
+            if new is not old:
+                old = shape_columns.ShapeColumns.from_shapes(old)
+                deleted = np.flatnonzero(~old.map_cls_nums(lut)[1]).tolist()
+                images_entry.append([image["filename"], old.cls_nums, deleted, old.select(deleted)])
+
+                image["shapes"] = new
+                self.stats.set_image(image["filename"], new)
+
+        if labels is not None:
+            self.set_labels(labels)
+        if deleted_color is not None:
+            self.delete_label_color(deleted_color)
+
+        self.reindex()
+        self.cls_remaps.append(cls_remap)
+        self.history.push(project_history.make_remap_entry(cls_remap, before, self.get_labels_state(),
+                                                           images_entry))
+
+    def apply_remap_entry(self, entry, is_undo):
+        """
+        Отмена/повтор перенумерации классов. При отмене удаленные полигоны возвращаются на свои места
+        и получают прежние номера классов. Если полигоны изображения не совпадают с записью -
+        номера возвращаются обратной таблицей
+        """
+        cls_remap = project_history.get_cls_remap(entry)
+        before, after = (entry["after"], entry["before"]) if is_undo else (entry["before"], entry["after"])
+
+        if is_undo:
+            inverse = {}
+            for old, new in cls_remap.items():
+                if new is not None and new < len(before["labels"]) \
+                        and after["labels"][old] == before["labels"][new]:
+                    inverse[new] = old
+            lut = shape_columns.make_lut(inverse)
+        else:
+            lut = shape_columns.make_lut(cls_remap)
+
+        for filename, old_cls_nums, deleted, deleted_shapes in entry["images"]:
+            image = self.get_image_data(filename)
+            if not image:
+                continue
+            shapes = shape_columns.ShapeColumns.from_shapes(image["shapes"])
+            if is_undo and len(shapes) + len(deleted) == len(old_cls_nums):
+                deleted_shapes = shape_columns.ShapeColumns.from_shapes(deleted_shapes)
+                shapes = shapes.insert_at(deleted, deleted_shapes).with_cls_nums(old_cls_nums)
+            else:
+                shapes = shapes.remap(lut)
+            image["shapes"] = shapes
+            self.stats.set_image(filename, shapes)
+            self.mark_image_changed(filename)
+
+        self.set_labels_state(after)
+
+        # отменяется еще не сохраненная перенумерация - убираем ее и из сохраняемых изменений
+        if is_undo and self.cls_remaps and self.cls_remaps[-1] == cls_remap:
+            self.cls_remaps.pop()
+
+        self.reindex()
+
+    def apply_history_entry(self, entry, is_undo):
+        op = entry["op"]
+        if op == "shapes":
+            image = self.get_image_data(entry["filename"])
+            new_image = dict(image) if image else {"filename": entry["filename"]}
+            new_image["shapes"] = project_history.apply_shapes_delta(image["shapes"] if image else [], entry,
+                                                                     is_undo)
+            self.put_image(new_image)
+
+        elif op == "cls_num":
+            image = self.get_image_data(entry["filename"])
+            if image:
+                self.set_shape_cls_num(image, entry["pos"], entry["old"] if is_undo else entry["new"])
+
+        elif op == "rename":
+            if is_undo:
+                self.rename_label(entry["new"], entry["old"])
+            else:
+                self.rename_label(entry["old"], entry["new"])
 
-        images = []
-        for image in self.data["images"]:
-            new_shapes = []
-            for shape in image["shapes"]:
-
-                if shape["cls_num"] < from_cls_num:
-                    # save without change
-                    new_shapes.append(shape)
-
-                else:
-
-                    shape_new = {}
-
-                    if shape["cls_num"] == from_cls_num:
-                        shape_new["cls_num"] = to_cls_num
-                    else:
-                        # Все номера от from старше должны уменьшиться на 1
-                        shape_new["cls_num"] = shape["cls_num"] - 1
-
-                    shape_new["points"] = shape["points"]
-                    shape_new["id"] = shape["id"]
-                    new_shapes.append(shape_new)
-
-            new_image = {}
-            new_image["filename"] = image["filename"]
-            new_image["shapes"] = new_shapes
-
-            images.append(new_image)
-
-        self.data["images"] = images
-
-        # labels
-        labels = []
-
-        for label in self.data["labels"]:
-            if label != from_cls_name:
-                labels.append(label)
-        self.set_labels(labels)
-
-        self.delete_label_color(from_cls_name)
-
-    def exportToYOLOSeg(self, export_dir):
+        elif op == "del_image":
+            if is_undo:
+                self.insert_image(entry["pos"], dict(entry["image"]))
+            else:
+                self.remove_image(entry["image"]["filename"])
+
+        elif op == "remap":
+            self.apply_remap_entry(entry, is_undo)
+
+    def undo(self):
+        """
+        Отмена последнего изменения проекта. Возвращает отмененную запись истории или None
+        """
+        if not self.history.can_undo():
+            return None
+        entry = self.history.step_back()
+        self.apply_history_entry(entry, is_undo=True)
+        return entry
+
+    def redo(self):
+        if not self.history.can_redo():
+            return None
+        entry = self.history.step_forward()
+        self.apply_history_entry(entry, is_undo=False)
+        return entry
+
+    def export_yolo(self, export_dir, is_seg, progress_callback=None):
+        """
+        Экспорт в YOLO без проверки наличия изображений - можно вызывать из потока экспорта
+        """
+        if not os.path.isdir(export_dir):
+            return False
+        yolo_export.export_yolo(self.data["images"], self.data["path_to_images"], export_dir, is_seg,
+                                progress_callback=progress_callback)
+        return True
 
+    def exportToYOLOSeg(self, export_dir, progress_callback=None):
         self.clear_not_existing_images()
-
-        if os.path.isdir(export_dir):
-            for image in self.data["images"]:
-                if len(image["shapes"]):  # чтобы не создавать пустых файлов
-                    filename = image["filename"]
-                    fullname = os.path.join(self.data["path_to_images"], filename)
-                    # im = cv2.imread(fullname)  # height, width
-                    txt_yolo_name = hf.convert_image_name_to_txt_name(filename)
-                    # im_shape = im.shape
-                    if not os.path.exists(fullname):
-                        continue
-
-                    width, height = Image.open(fullname).size
-                    im_shape = [height, width]
-
-                    with open(os.path.join(export_dir, txt_yolo_name), 'w') as f:
-                        for shape in image["shapes"]:
-                            cls_num = shape["cls_num"]
-                            points = shape["points"]
-                            line = f"{cls_num}"
-                            for point in points:
-                                line += f" {point[0] / im_shape[1]} {point[1] / im_shape[0]}"
-
-                            f.write(f"{line}\n")
-            return True
-        return False
+        return self.export_yolo(export_dir, is_seg=True, progress_callback=progress_callback)
 
     def clear_not_existing_images(self):
-        images = []
         im_path = self.get_image_path()
-        for im in self.data['images']:
-            if os.path.exists(os.path.join(im_path, im['filename'])):
-                images.append(im)
-            else:
-                print(f"Checking files: image {im['filename']} doesn't exist")
-
-        self.data['images'] = images
-
-    def exportToCOCO(self, export_сoco_name):
+        missing = [filename for filename in project_stream.iter_filenames(self.data['images']) if
+                   not os.path.exists(os.path.join(im_path, filename))]
+        self.remove_missing_images(missing)
+
+    def remove_missing_images(self, filenames):
+        """
+        Удаление из проекта изображений, которых нет на диске (их нашла проверка или экспорт)
+        """
+        missing = set(filenames)
+        if not missing:
+            return
+        images = self.data['images']
+        not_existing_pos = []
+        for pos, filename in enumerate(project_stream.iter_filenames(images)):
+            if filename in missing:
+                print(f"Checking files: image {filename} doesn't exist")
+                self.mark_image_deleted(filename)
+                self.stats.remove_image(filename)
+                not_existing_pos.append(pos)
+
+        if not_existing_pos:
+            for pos in reversed(not_existing_pos):
+                del images[pos]
+            self.reindex()
+
+    def export_coco(self, export_сoco_name, progress_callback=None):
+        """
+        Экспорт в COCO без проверки наличия изображений - можно вызывать из потока экспорта
+        """
+        if not os.path.isdir(os.path.dirname(export_сoco_name)):
+            return False
+        coco_export.export_coco(self.data["images"], self.data["path_to_images"], self.data["labels"],
+                                export_сoco_name, progress_callback=progress_callback)
+        return True
 
+    def exportToCOCO(self, export_сoco_name, progress_callback=None):
         self.clear_not_existing_images()
+        return self.export_coco(export_сoco_name, progress_callback=progress_callback)
 
-        if os.path.isdir(os.path.dirname(export_сoco_name)):
-            export_json = {}
-            export_json["info"] = {"year": datetime.date.today().year, "version": "1.0",
-                                   "description": "exported to COCO format using AI Annotator", "contributor": "",
-                                   "url": "", "date_created": datetime.date.today().strftime("%c")}
-
-            export_json["images"] = []
-
-            id_tek = 1
-            id_map = {}
-
-            for image in self.data["images"]:
-                filename = image["filename"]
-                id_map[filename] = id_tek
-                im_full_path = os.path.join(self.data["path_to_images"], filename)
-                # im = cv2.imread(im_full_path)
-                # im_shape = im.shape
-
-                if not os.path.exists(im_full_path):
-                    continue
-
-                width, height = Image.open(im_full_path).size
-                im_shape = [height, width]
-
-                width = im_shape[1]
-                height = im_shape[0]
-                im_dict = {"id": id_tek, "width": width, "height": height, "file_name": filename, "license": 0,
-                           "flickr_url": im_full_path, "coco_url": im_full_path, "date_captured": ""}
-                export_json["images"].append(im_dict)
-
-                id_tek += 1
-
-            export_json["annotations"] = []
-
-            seg_id = 1
-            for image in self.data["images"]:
-                filename = image["filename"]
-                for shape in image["shapes"]:
-
-                    cls_num = shape["cls_num"]
-                    points = shape["points"]
-                    xs = []
-                    ys = []
-                    all_points = [[]]
-                    for point in points:
-                        xs.append(point[0])
-                        ys.append(point[1])
-                        all_points[0].append(int(point[0]))
-                        all_points[0].append(int(point[1]))
-
-                    seg = np.array(all_points[0])
-
-                    poly = np.reshape(seg, (seg.size // 2, 2))
-                    poly = Polygon(poly)
-                    area = poly.area
-
-                    min_x = min(xs)
-                    max_x = max(xs)
-                    min_y = min(ys)
-                    max_y = max(ys)
-                    w = abs(max_x - min_x)
-                    h = abs(max_y - min_y)
-
-                    x_center = min_x + w / 2
-                    y_center = min_y + h / 2
-
-                    bbox = [int(x_center), int(y_center), int(width), int(height)]
-
-                    seg = {"segmentation": all_points, "area": int(area), "bbox": bbox, "iscrowd": 0, "id": seg_id,
-                           "image_id": id_map[filename], "category_id": cls_num + 1}
-                    export_json["annotations"].append(seg)
-                    seg_id += 1
-
-            export_json["licenses"] = [{"id": 0, "name": "Unknown License", "url": ""}]
-            export_json["categories"] = []
-
-            for i, label in enumerate(self.data["labels"]):
-                category = {"supercategory": "type", "id": i + 1, "name": label}
-                export_json["categories"].append(category)
-
-            with open(export_сoco_name, 'w') as f:
-                json.dump(export_json, f)
-
-            return True
-
-        return False
+    def exportToYOLOBox(self, export_dir, progress_callback=None):
+        self.clear_not_existing_images()
+        return self.export_yolo(export_dir, is_seg=False, progress_callback=progress_callback)
+
+    def export_shards(self, export_dir, progress_callback=None):
+        """
+        Экспорт в архивы tar (WebDataset) - можно вызывать из потока экспорта: проект не меняется.
+        Наличие изображений проверяется самим экспортом, возвращает имена отсутствующих изображений
+        (удалить их из проекта - remove_missing_images в потоке GUI). Если папки нет - None
+        """
+        if not os.path.isdir(export_dir):
+            return None
+        return shard_export.export_shards(self.data["images"], self.data["path_to_images"], self.data["labels"],
+                                          export_dir, progress_callback=progress_callback)
+
+    def exportToShards(self, export_dir, progress_callback=None):
+        missing = self.export_shards(export_dir, progress_callback=progress_callback)
+        if missing is None:
+            return False
+        self.remove_missing_images(missing)
+        return True
 
-    def exportToYOLOBox(self, export_dir):
+    def export_masks(self, export_dir, progress_callback=None):
+        """
+        Экспорт семантических масок PNG без проверки наличия изображений - можно вызывать из потока экспорта
+        """
+        if not os.path.isdir(export_dir):
+            return False
+        mask_export.export_masks(self.data["images"], self.data["path_to_images"], export_dir,
+                                 progress_callback=progress_callback)
+        return True
 
+    def exportToPNGMasks(self, export_dir, progress_callback=None):
         self.clear_not_existing_images()
-
-        if os.path.isdir(export_dir):
-            for image in self.data["images"]:
-                if len(image["shapes"]):  # чтобы не создавать пустых файлов
-                    filename = image["filename"]
-                    fullname = os.path.join(self.data["path_to_images"], filename)
-                    # im = cv2.imread(fullname)  # height, width
-                    txt_yolo_name = hf.convert_image_name_to_txt_name(filename)
-                    # im_shape = im.shape
-
-                    width, height = Image.open(fullname).size
-                    im_shape = [height, width]
-
-                    with open(os.path.join(export_dir, txt_yolo_name), 'w') as f:
-                        for shape in image["shapes"]:
-                            cls_num = shape["cls_num"]
-                            points = shape["points"]
-                            xs = []
-                            ys = []
-                            for point in points:
-                                xs.append(point[0])
-                                ys.append(point[1])
-                            min_x = min(xs)
-                            max_x = max(xs)
-                            min_y = min(ys)
-                            max_y = max(ys)
-                            w = abs(max_x - min_x)
-                            h = abs(max_y - min_y)
-
-                            x_center = min_x + w / 2
-                            y_center = min_y + h / 2
-
-                            f.write(
-                                f"{cls_num} {x_center / im_shape[1]} {y_center / im_shape[0]} {w / im_shape[1]} {h / im_shape[0]}\n")
-
-            return True
-        return False
+        return self.export_masks(export_dir, progress_callback=progress_callback)
 
 
 if __name__ == '__main__':
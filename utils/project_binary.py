@@ -0,0 +1,249 @@
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from utils import project_stream
+from utils.shape_columns import ShapeColumns, json_default
+
+BINARY_EXTENSIONS = ('.aiproj',)
+
+# Файл: MAGIC, смещение заголовка (uint64 LE), массивы с выравниванием ALIGN, JSON-заголовок в конце.
+# Заголовок пишется последним - размеры массивов известны только после прохода по изображениям
+MAGIC = b'AIPROJ\x00\x01'
+PREFIX = struct.Struct('<8sQ')
+ALIGN = 64
+
+# массивы по всему проекту: вершины всех полигонов подряд, границы полигонов в coords,
+# границы изображений в списке полигонов и колонки полигонов
+ARRAY_DTYPES = {
+    "coords": np.float32,
+    "shape_offsets": np.int64,
+    "image_offsets": np.int64,
+    "cls_nums": np.int32,
+    "ids": np.int64,
+    "confs": np.float64,
+}
+
+
+class BinaryFormatError(Exception):
+    pass
+
+
+def is_binary_path(path):
+    return path.lower().endswith(BINARY_EXTENSIONS)
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, header_offset = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise BinaryFormatError(f"{path} is not a binary project")
+        f.seek(header_offset)
+        return json.loads(f.read().decode('utf8'))
+
+
+class BinaryImageSource:
+    """
+    Источник изображений ленивого списка - массивы бинарного файла, отображенные в память.
+    Режим copy-on-write: страницы общие для всех процессов, открывших файл, пока их не изменят.
+    Изображение - словарь с ShapeColumns, колонки которого - срезы отображенных массивов, без копирования
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.header = read_header(path)
+        self.arrays = {}
+        for name, desc in self.header["arrays"].items():
+            shape = tuple(desc["shape"])
+            if np.prod(shape) == 0:
+                self.arrays[name] = np.zeros(shape, dtype=desc["dtype"])
+            else:
+                self.arrays[name] = np.memmap(path, dtype=desc["dtype"], mode='c', offset=desc["offset"],
+                                              shape=shape)
+
+        self.image_fields = self.header.get("image_fields", {})
+        self.shape_extras = self.header.get("shape_extras", {})
+
+    def load(self, key):
+        image_offsets = self.arrays["image_offsets"]
+        first, last = int(image_offsets[key]), int(image_offsets[key + 1])
+
+        shape_offsets = self.arrays["shape_offsets"][first:last + 1]
+        start = int(shape_offsets[0])
+        confs = self.arrays.get("confs")
+
+        extras = {}
+        if self.shape_extras:
+            for i in range(first, last):
+                extra = self.shape_extras.get(str(i))
+                if extra:
+                    extras[i - first] = extra
+
+        shapes = ShapeColumns(self.arrays["coords"][start:int(shape_offsets[-1])],
+                              shape_offsets - start,
+                              self.arrays["cls_nums"][first:last],
+                              self.arrays["ids"][first:last],
+                              confs[first:last] if confs is not None else None,
+                              extras or None)
+
+        image = {"filename": self.header["filenames"][key], "shapes": shapes}
+        image.update(self.image_fields.get(str(key), {}))
+        return image
+
+    def raw(self, key):
+        return json.dumps(self.load(key), default=json_default).encode('utf8')
+
+    def close(self):
+        # отображение освобождается, когда пропадают все срезы массивов
+        self.arrays = {}
+
+
+def align(f):
+    pad = -f.tell() % ALIGN
+    if pad:
+        f.write(b'\0' * pad)
+
+
+def write_array(f, arr, arrays_desc, name):
+    align(f)
+    arr = np.ascontiguousarray(arr, dtype=ARRAY_DTYPES[name])
+    arrays_desc[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": f.tell()}
+    f.write(arr.tobytes())
+
+
+def write_project(f, data):
+    """
+    Запись проекта: вершины пишутся потоком по мере прохода по изображениям,
+    колонки полигонов (десятки байт на полигон) собираются в памяти и пишутся следом
+    """
+    f.write(PREFIX.pack(MAGIC, 0))
+    align(f)
+    coords_offset = f.tell()
+    coords_count = 0
+
+    filenames = []
+    image_fields = {}
+    shape_extras = {}
+    image_sizes = []
+    shapes_count = 0
+    lengths, cls_nums, ids, confs = [], [], [], []
+    is_conf = False
+
+    for i, image in enumerate(data["images"]):
+        shapes = ShapeColumns.from_shapes(image["shapes"])
+        filenames.append(image["filename"])
+        fields = {key: value for key, value in image.items() if key not in ("filename", "shapes")}
+        if fields:
+            image_fields[str(i)] = fields
+
+        if shapes.extras:
+            for pos, extra in shapes.extras.items():
+                shape_extras[str(shapes_count + pos)] = extra
+
+        image_sizes.append(len(shapes))
+        shapes_count += len(shapes)
+        lengths.append(shapes.lengths())
+        cls_nums.append(shapes.cls_nums)
+        ids.append(shapes.ids)
+        if shapes.confs is not None:
+            is_conf = True
+            confs.append(shapes.confs)
+        else:
+            confs.append(np.full(len(shapes), np.nan))
+
+        f.write(np.ascontiguousarray(shapes.coords, dtype=np.float32).tobytes())
+        coords_count += len(shapes.coords)
+
+    arrays_desc = {"coords": {"dtype": np.dtype(np.float32).str, "shape": [coords_count, 2],
+                              "offset": coords_offset}}
+
+    shape_offsets = np.zeros(shapes_count + 1, dtype=np.int64)
+    if lengths:
+        np.cumsum(np.concatenate(lengths), out=shape_offsets[1:])
+    image_offsets = np.zeros(len(image_sizes) + 1, dtype=np.int64)
+    np.cumsum(image_sizes, out=image_offsets[1:])
+
+    write_array(f, shape_offsets, arrays_desc, "shape_offsets")
+    write_array(f, image_offsets, arrays_desc, "image_offsets")
+    write_array(f, np.concatenate(cls_nums) if cls_nums else [], arrays_desc, "cls_nums")
+    write_array(f, np.concatenate(ids) if ids else [], arrays_desc, "ids")
+    if is_conf:
+        write_array(f, np.concatenate(confs), arrays_desc, "confs")
+
+    header = {"project": {key: value for key, value in data.items() if key != "images"},
+              "filenames": filenames,
+              "image_fields": image_fields,
+              "shape_extras": shape_extras,
+              "arrays": arrays_desc}
+
+    header_offset = f.tell()
+    f.write(json.dumps(header, default=json_default).encode('utf8'))
+    f.seek(0)
+    f.write(PREFIX.pack(MAGIC, header_offset))
+
+
+def is_source_path(images, path):
+    return isinstance(images, project_stream.LazyImageList) and isinstance(images.source, BinaryImageSource) \
+           and images.source.path == os.path.abspath(path)
+
+
+def save_project(path, data):
+    """
+    Атомарная запись: временный файл, fsync и rename поверх path.
+    Если проект загружен из этого же файла - разобранные изображения отвязываются от отображения,
+    а ленивый список переходит на новый файл (на Windows отображенный файл нельзя заменить)
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write_project(f, data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    images = data["images"]
+    if not is_source_path(images, path):
+        os.replace(tmp_path, path)
+        project_stream.fsync_dir(path)
+        return
+
+    with images.lock:
+        for entry in images.entries:
+            if not isinstance(entry, int):
+                entry["shapes"] = ShapeColumns.from_shapes(entry["shapes"]).detach()
+        images.source.close()
+        os.replace(tmp_path, path)
+
+        # изображения записаны в порядке списка - ключ неразобранного изображения равен его позиции
+        for i, entry in enumerate(images.entries):
+            if isinstance(entry, int):
+                images.entries[i] = i
+        images.source = BinaryImageSource(path)
+    project_stream.fsync_dir(path)
+
+
+def load_project(path):
+    """
+    Загрузка проекта: заголовок сразу, массивы отображаются в память, изображения собираются по требованию
+    """
+    source = BinaryImageSource(path)
+    data = dict(source.header["project"])
+    filenames = source.header["filenames"]
+    data["images"] = project_stream.LazyImageList(source, range(len(filenames)), filenames)
+    return data
+
+
+def convert(src, dst):
+    from utils.project_journal import load_with_journal
+    data = load_with_journal(src)
+    if is_binary_path(dst):
+        save_project(dst, data)
+    else:
+        project_stream.save_project(dst, data)
+
+
+if __name__ == '__main__':
+    # python -m utils.project_binary project.json project.aiproj
+    # python -m utils.project_binary project.aiproj project.json
+    convert(sys.argv[1], sys.argv[2])
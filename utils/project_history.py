@@ -0,0 +1,151 @@
+import numpy as np
+
+from utils import config
+from utils.shape_columns import ShapeColumns, NO_ID
+
+# поле проекта, в котором сохраняется история изменений
+HISTORY_FIELD = "history"
+
+
+class ProjectHistory:
+    """
+    История изменений проекта для undo/redo. Каждая запись - обратимая дельта (словарь "op": ...),
+    а не копия проекта: для полигонов хранятся только измененные полигоны,
+    поэтому память растет с числом правок, а не с размером датасета.
+    Записи пишутся в проект вместе с остальными данными и переживают сохранение и загрузку.
+    Хранится не больше max_entries записей: при переполнении старые удаляются сразу на trim_entries,
+    чтобы журнал переписывал историю целиком не на каждой правке
+    """
+
+    def __init__(self, max_entries=config.HISTORY_MAX_ENTRIES, trim_entries=config.HISTORY_TRIM_ENTRIES):
+        self.max_entries = max_entries
+        self.trim_entries = max(trim_entries, 1)
+        self.clear()
+
+    def clear(self):
+        self.entries = []
+        # число примененных записей: entries[:pos] можно отменить, entries[pos:] - повторить
+        self.pos = 0
+        # с какой записи история изменилась после последнего сохранения
+        self.dirty_from = 0
+
+    def push(self, entry):
+        del self.entries[self.pos:]
+        self.entries.append(entry)
+        self.dirty_from = min(self.dirty_from, self.pos)
+        self.pos += 1
+        if len(self.entries) > self.max_entries:
+            self.trim(len(self.entries) - self.max_entries + self.trim_entries)
+
+    def trim(self, count):
+        """
+        Удаление count самых старых записей. Номера остальных сдвигаются - в журнал история пишется целиком
+        """
+        count = min(count, len(self.entries))
+        del self.entries[:count]
+        self.pos = max(self.pos - count, 0)
+        self.dirty_from = 0
+
+    def can_undo(self):
+        return self.pos > 0
+
+    def can_redo(self):
+        return self.pos < len(self.entries)
+
+    def step_back(self):
+        self.pos -= 1
+        return self.entries[self.pos]
+
+    def step_forward(self):
+        self.pos += 1
+        return self.entries[self.pos - 1]
+
+    def to_data(self):
+        return {"entries": list(self.entries), "pos": self.pos}
+
+    def get_changes(self):
+        """
+        Часть истории для записи журнала: замена entries[start:] и текущая позиция
+        """
+        return {"start": self.dirty_from, "entries": self.entries[self.dirty_from:], "pos": self.pos}
+
+    def mark_saved(self):
+        self.dirty_from = len(self.entries)
+
+    def load(self, data):
+        self.clear()
+        if data:
+            self.entries = list(data.get("entries", []))
+            self.pos = min(data.get("pos", len(self.entries)), len(self.entries))
+        self.mark_saved()
+        if len(self.entries) > self.max_entries:
+            # проект сохранен без ограничения или с большим
+            self.trim(len(self.entries) - self.max_entries)
+
+
+def apply_changes(data, changes):
+    """
+    Применение части истории из записи журнала к словарю проекта
+    """
+    history = data.setdefault(HISTORY_FIELD, {"entries": [], "pos": 0})
+    history["entries"][changes["start"]:] = changes["entries"]
+    history["pos"] = changes["pos"]
+
+
+def shape_keys(shapes):
+    # полигон без id не сопоставить между версиями - такие считаются всегда измененными
+    return [shape_id if shape_id != NO_ID else None for shape_id in shapes.ids.tolist()]
+
+
+def diff_shapes(filename, old, new):
+    """
+    Дельта между версиями полигонов изображения: полигоны, которых нет в новой версии
+    (с позициями в старой) и новые или измененные полигоны (с позициями в новой).
+    None - если версии совпадают
+    """
+    old = ShapeColumns.from_shapes(old)
+    new = ShapeColumns.from_shapes(new)
+    if old.is_equal(new):
+        return None
+
+    old_pos = {key: i for i, key in enumerate(shape_keys(old)) if key is not None}
+
+    removed = np.ones(len(old), dtype=bool)
+    added = []
+    old_lengths = old.lengths()
+    new_lengths = new.lengths()
+    for i, key in enumerate(shape_keys(new)):
+        j = old_pos.get(key)
+        if j is not None and old.cls_nums[j] == new.cls_nums[i] and old_lengths[j] == new_lengths[i] \
+                and np.array_equal(old.points(j), new.points(i)):
+            removed[j] = False
+        else:
+            added.append(i)
+
+    removed = np.flatnonzero(removed).tolist()
+    return {"op": "shapes", "filename": filename,
+            "removed": removed, "removed_shapes": old.select(removed),
+            "added": added, "added_shapes": new.select(added)}
+
+
+def apply_shapes_delta(shapes, delta, is_undo):
+    """
+    Переход между версиями полигонов: при отмене удаляются добавленные и возвращаются удаленные
+    """
+    shapes = ShapeColumns.from_shapes(shapes)
+    drop, insert = ("added", "removed") if is_undo else ("removed", "added")
+    insert_shapes = ShapeColumns.from_shapes(delta[insert + "_shapes"])
+    return shapes.delete_at(delta[drop]).insert_at(delta[insert], insert_shapes)
+
+
+def make_remap_entry(cls_remap, before, after, images):
+    """
+    Запись перенумерации классов. Для каждого изображения - прежние номера классов всех полигонов
+    и удаленные полигоны: перенумерацию с удалением или слиянием классов нельзя обратить по таблице
+    """
+    return {"op": "remap", "cls_remap": [[old, new] for old, new in cls_remap.items()],
+            "before": before, "after": after, "images": images}
+
+
+def get_cls_remap(entry):
+    return {old: new for old, new in entry["cls_remap"]}
@@ -0,0 +1,123 @@
+import json
+import os
+
+from utils import project_binary
+from utils import project_history
+from utils import project_stream
+from utils.id_allocator import NEXT_ID_FIELD
+from utils.shape_columns import json_default
+
+HEADER_FIELDS = ("path_to_images", "labels", "labels_color", NEXT_ID_FIELD)
+
+
+def get_journal_name(json_path):
+    return json_path + '.journal'
+
+
+def create_record(data, images, deleted, cls_remaps=None, history=None):
+    """
+    Запись журнала: заголовок проекта целиком (он мал) + только измененные изображения,
+    перенумерации классов (старый номер -> новый, None - удаление) и новые записи истории изменений.
+    Сериализуется сразу, чтобы поток сохранения не читал данные, которые меняет GUI
+    """
+    record = {field: data[field] for field in HEADER_FIELDS if field in data}
+    record["images"] = images
+    record["deleted"] = list(deleted)
+    if cls_remaps:
+        record["cls_remaps"] = cls_remaps
+    if history:
+        record["history"] = history
+    return json.dumps(record, default=json_default)
+
+
+def is_ends_with_newline(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def append_record(journal_path, record_line):
+    # после прерванной записи в конце журнала может остаться оборванная строка - начинаем с новой
+    prefix = '' if is_ends_with_newline(journal_path) else '\n'
+    with open(journal_path, 'a', encoding='utf8') as f:
+        f.write(prefix + record_line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_records(journal_path):
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, 'r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # оборванная запись - сохранение было прервано, пропускаем ее
+                continue
+
+
+def replay(data, records):
+    """
+    Применение записей журнала к загруженному словарю проекта.
+    Изображения заменяются по позиции, поэтому ленивый список не разбирается целиком
+    """
+    images = data["images"]
+    images_pos = {name: i for i, name in enumerate(project_stream.iter_filenames(images))}
+    is_changed = False
+
+    for record in records:
+        is_changed = True
+        for field in HEADER_FIELDS:
+            if field in record:
+                data[field] = record[field]
+        if "history" in record:
+            project_history.apply_changes(data, record["history"])
+
+        deleted_pos = [images_pos[name] for name in record.get("deleted", []) if name in images_pos]
+        if deleted_pos:
+            for pos in sorted(deleted_pos, reverse=True):
+                del images[pos]
+            images_pos = {name: i for i, name in enumerate(project_stream.iter_filenames(images))}
+
+        for im in record.get("images", []):
+            pos = images_pos.get(im["filename"])
+            if pos is None:
+                images_pos[im["filename"]] = len(images)
+                images.append(im)
+            else:
+                images[pos] = im
+
+    return is_changed
+
+
+def load_with_journal(json_path, lazy_min_bytes=0, progress_callback=None):
+    if project_binary.is_binary_path(json_path):
+        data = project_binary.load_project(json_path)
+    else:
+        data = project_stream.load_project(json_path, lazy_min_bytes=lazy_min_bytes,
+                                           progress_callback=progress_callback)
+
+    replay(data, read_records(get_journal_name(json_path)))
+    return data
+
+
+def is_compaction_needed(json_path, min_bytes, ratio):
+    journal_path = get_journal_name(json_path)
+    if not os.path.exists(journal_path):
+        return False
+
+    journal_size = os.path.getsize(journal_path)
+    return journal_size > max(min_bytes, ratio * os.path.getsize(json_path))
+
+
+def remove_journal(json_path):
+    journal_path = get_journal_name(json_path)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
@@ -0,0 +1,357 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+
+from utils import project_stream
+from utils.project_history import HISTORY_FIELD, apply_changes
+from utils.project_journal import HEADER_FIELDS
+from utils.shape_columns import json_default
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    num INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    color TEXT
+);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    pos INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    pos INTEGER NOT NULL,
+    shape_id INTEGER,
+    cls_num INTEGER NOT NULL,
+    conf REAL,
+    points_type TEXT NOT NULL,
+    points BLOB NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS shapes_image ON shapes(image_id);
+CREATE INDEX IF NOT EXISTS shapes_cls ON shapes(cls_num);
+"""
+
+SHAPE_FIELDS = ('id', 'cls_num', 'conf', 'points')
+
+# открытые базы: ленивый список изображений и поток сохранения работают через одно соединение
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def is_sqlite_path(path):
+    return path.lower().endswith(SQLITE_EXTENSIONS)
+
+
+def pack_points(points):
+    """
+    Упаковка вершин в blob. По умолчанию float32; если координаты в нем не представимы
+    без потерь - float64, для целых координат - int32. Тип хранится рядом, чтобы восстановить точно
+    """
+    flat = [c for point in points for c in point]
+
+    if all(type(c) is int for c in flat):
+        typecode = 'i' if all(-2 ** 31 <= c < 2 ** 31 for c in flat) else 'q'
+        packed = array(typecode, flat)
+    else:
+        packed = array('f', flat)
+        if packed.tolist() != [float(c) for c in flat]:
+            packed = array('d', flat)
+
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.typecode, packed.tobytes()
+
+
+def unpack_points(typecode, blob):
+    flat = array(typecode)
+    flat.frombytes(blob)
+    if sys.byteorder != 'little':
+        flat.byteswap()
+    flat = flat.tolist()
+    return [[flat[i], flat[i + 1]] for i in range(0, len(flat), 2)]
+
+
+def shape_to_row(image_id, pos, shape):
+    typecode, blob = pack_points(shape["points"])
+    extra = {key: value for key, value in shape.items() if key not in SHAPE_FIELDS}
+    conf = shape.get("conf")
+    return (image_id, pos, shape.get("id"), shape["cls_num"], None if conf is None else float(conf),
+            typecode, blob, json.dumps(extra) if extra else None)
+
+
+def row_to_shape(row):
+    shape_id, cls_num, conf, typecode, blob, extra = row
+    shape = {"cls_num": cls_num}
+    if shape_id is not None:
+        shape["id"] = shape_id
+    if conf is not None:
+        shape["conf"] = conf
+    shape["points"] = unpack_points(typecode, blob)
+    if extra:
+        shape.update(json.loads(extra))
+    return shape
+
+
+class SQLiteProjectStore:
+    """
+    Хранение проекта в SQLite: заголовок, метки, изображения и полигоны отдельными таблицами.
+    Сохранение одного изображения - одна транзакция, перенумерация классов - один UPDATE
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with _stores_lock:
+            if _stores.get(self.path) is self:
+                del _stores[self.path]
+        with self.lock:
+            self.conn.close()
+
+    def transaction(self, func, *args):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    # --- чтение ---
+
+    def read_header(self):
+        with self.lock:
+            header = {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+            header["labels"] = []
+            header["labels_color"] = {}
+            for name, color in self.conn.execute("SELECT name, color FROM labels ORDER BY num"):
+                header["labels"].append(name)
+                if color is not None:
+                    header["labels_color"][name] = json.loads(color)
+            # цвета меток, которых уже нет в списке, тоже часть проекта
+            extra_colors = header.pop("labels_color_extra", {})
+            header["labels_color"].update(extra_colors)
+            return header
+
+    def read_images_index(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, filename FROM images ORDER BY pos").fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def load(self, image_id):
+        with self.lock:
+            filename = self.conn.execute("SELECT filename FROM images WHERE id = ?", (image_id,)).fetchone()[0]
+            rows = self.conn.execute("SELECT shape_id, cls_num, conf, points_type, points, extra FROM shapes "
+                                     "WHERE image_id = ? ORDER BY pos", (image_id,)).fetchall()
+        return {"filename": filename, "shapes": [row_to_shape(row) for row in rows]}
+
+    def raw(self, image_id):
+        return json.dumps(self.load(image_id)).encode('utf8')
+
+    # --- запись, вызывается внутри transaction ---
+
+    def write_header(self, data):
+        self.conn.execute("DELETE FROM meta WHERE key = 'labels_color_extra'")
+        self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              [(key, json.dumps(value, default=json_default)) for key, value in data.items()
+                               if key not in ('images', 'labels', 'labels_color')])
+
+        labels = data.get("labels", [])
+        colors = data.get("labels_color", {})
+        self.conn.execute("DELETE FROM labels")
+        self.conn.executemany("INSERT INTO labels (num, name, color) VALUES (?, ?, ?)",
+                              [(i, name, json.dumps(colors[name]) if name in colors else None)
+                               for i, name in enumerate(labels)])
+
+        extra_colors = {name: color for name, color in colors.items() if name not in labels}
+        if extra_colors:
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('labels_color_extra', ?)",
+                              (json.dumps(extra_colors),))
+
+    def write_history(self, changes):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (HISTORY_FIELD,)).fetchone()
+        data = {HISTORY_FIELD: json.loads(row[0])} if row else {}
+        apply_changes(data, changes)
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                          (HISTORY_FIELD, json.dumps(data[HISTORY_FIELD], default=json_default)))
+
+    def write_image(self, image, pos=None):
+        row = self.conn.execute("SELECT id FROM images WHERE filename = ?", (image["filename"],)).fetchone()
+        if row:
+            image_id = row[0]
+            self.conn.execute("DELETE FROM shapes WHERE image_id = ?", (image_id,))
+            if pos is not None:
+                self.conn.execute("UPDATE images SET pos = ? WHERE id = ?", (pos, image_id))
+        else:
+            if pos is None:
+                pos = self.conn.execute("SELECT COALESCE(MAX(pos), -1) + 1 FROM images").fetchone()[0]
+            image_id = self.conn.execute("INSERT INTO images (filename, pos) VALUES (?, ?)",
+                                         (image["filename"], pos)).lastrowid
+
+        self.conn.executemany("INSERT INTO shapes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              [shape_to_row(image_id, i, shape) for i, shape in enumerate(image["shapes"])])
+
+    def delete_images(self, filenames):
+        for filename in filenames:
+            self.conn.execute("DELETE FROM shapes WHERE image_id IN (SELECT id FROM images WHERE filename = ?)",
+                              (filename,))
+            self.conn.execute("DELETE FROM images WHERE filename = ?", (filename,))
+
+    def remap_classes(self, cls_remap):
+        """
+        cls_remap - старый номер класса -> новый номер, None - удалить полигоны класса
+        """
+        deleted = [int(cls_num) for cls_num, new_cls_num in cls_remap.items() if new_cls_num is None]
+        if deleted:
+            self.conn.execute(f"DELETE FROM shapes WHERE cls_num IN ({','.join('?' * len(deleted))})", deleted)
+
+        changed = [(int(cls_num), new_cls_num) for cls_num, new_cls_num in cls_remap.items()
+                   if new_cls_num is not None and int(cls_num) != new_cls_num]
+        if changed:
+            cases = ' '.join('WHEN ? THEN ?' for _ in changed)
+            params = [value for pair in changed for value in pair]
+            self.conn.execute(f"UPDATE shapes SET cls_num = CASE cls_num {cases} END "
+                              f"WHERE cls_num IN ({','.join('?' * len(changed))})",
+                              params + [cls_num for cls_num, _ in changed])
+
+    def apply_record(self, record):
+        """
+        Применение записи изменений (того же формата, что и журнал JSON-проекта) одной транзакцией.
+        Перенумерация классов - до записи изображений: изображения в записи уже в итоговом состоянии
+        """
+
+        def apply():
+            self.write_header({field: record[field] for field in HEADER_FIELDS if field in record})
+            if "history" in record:
+                self.write_history(record["history"])
+            for cls_remap in record.get("cls_remaps", []):
+                self.remap_classes(cls_remap)
+            self.delete_images(record.get("deleted", []))
+            for image in record.get("images", []):
+                self.write_image(image)
+
+        self.transaction(apply)
+
+    def write_project(self, data):
+        """
+        Полная запись проекта. Неразобранные изображения этой же базы не переписываются - только их позиция
+        """
+        images = data["images"]
+        is_same_source = isinstance(images, project_stream.LazyImageList) and images.source is self
+        entries = list(images.entries) if is_same_source else images
+
+        def write():
+            self.write_header(data)
+            kept_ids = set()
+            for pos, entry in enumerate(entries):
+                if isinstance(entry, int):
+                    self.conn.execute("UPDATE images SET pos = ? WHERE id = ?", (pos, entry))
+                    kept_ids.add(entry)
+                else:
+                    self.write_image(entry, pos)
+                    kept_ids.add(self.conn.execute("SELECT id FROM images WHERE filename = ?",
+                                                   (entry["filename"],)).fetchone()[0])
+
+            all_ids = [row[0] for row in self.conn.execute("SELECT id FROM images")]
+            removed = [(image_id,) for image_id in all_ids if image_id not in kept_ids]
+            self.conn.executemany("DELETE FROM shapes WHERE image_id = ?", removed)
+            self.conn.executemany("DELETE FROM images WHERE id = ?", removed)
+
+        self.transaction(write)
+
+
+def get_store(path):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SQLiteProjectStore(path)
+        return _stores[path]
+
+
+def close_store(path):
+    with _stores_lock:
+        store = _stores.get(os.path.abspath(path))
+    if store:
+        store.close()
+
+
+def load_project(path):
+    """
+    Загрузка проекта из базы: заголовок сразу, изображения - лениво, по id строки
+    """
+    store = get_store(path)
+    data = store.read_header()
+    image_ids, names = store.read_images_index()
+    data["images"] = project_stream.LazyImageList(store, image_ids, names)
+    return data
+
+
+def save_project(path, data):
+    """
+    Полная запись проекта в базу. Для проекта, загруженного из этой же базы - синхронизация
+    одной транзакцией, иначе - новая база во временном файле и rename поверх path
+    """
+    images = data["images"]
+    if isinstance(images, project_stream.LazyImageList) and isinstance(images.source, SQLiteProjectStore) \
+            and images.source.path == os.path.abspath(path):
+        images.source.write_project(data)
+        return
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    tmp_store = SQLiteProjectStore(tmp_path)
+    tmp_store.write_project(data)
+    tmp_store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    tmp_store.conn.execute("PRAGMA journal_mode=DELETE")
+    tmp_store.close()
+
+    close_store(path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(tmp_path, path)
+    project_stream.fsync_dir(path)
+
+
+def apply_record(path, journal_record):
+    get_store(path).apply_record(json.loads(journal_record))
+
+
+def convert_json_to_sqlite(json_path, sqlite_path):
+    """
+    Перенос JSON-проекта (вместе с журналом изменений) в SQLite без потерь
+    """
+    from utils.project_journal import load_with_journal
+    save_project(sqlite_path, load_with_journal(json_path))
+
+
+def convert_sqlite_to_json(sqlite_path, json_path):
+    project_stream.save_project(json_path, load_project(sqlite_path))
+
+
+if __name__ == '__main__':
+    # python -m utils.project_sqlite project.json project.sqlite
+    # python -m utils.project_sqlite project.sqlite project.json
+    src, dst = sys.argv[1], sys.argv[2]
+    if is_sqlite_path(dst):
+        convert_json_to_sqlite(src, dst)
+    else:
+        convert_sqlite_to_json(src, dst)
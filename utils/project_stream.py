@@ -0,0 +1,391 @@
+import json
+import os
+import re
+import threading
+from collections.abc import MutableSequence
+
+from utils.shape_columns import json_default
+
+CHUNK_SIZE = 16 * 1024 * 1024
+# перекрытие соседних кусков файла - чтобы не потерять начало элемента на границе куска
+CHUNK_OVERLAP = 64 * 1024
+WHITESPACE = b' \t\r\n'
+
+# Каждое изображение проекта записывается как {"filename": "...", "shapes": [...]}.
+# Кавычка внутри JSON-строки всегда экранирована, поэтому такая последовательность байт
+# встречается только в начале словаря изображения
+IMAGE_START_PATTERN = re.compile(rb'\{\s*"filename"\s*:\s*"((?:[^"\\]|\\.)*)"')
+FILENAME_KEY_PATTERN = re.compile(rb'"filename"\s*:')
+
+_decoder = json.JSONDecoder()
+
+
+class StreamFormatError(Exception):
+    """
+    Файл нельзя прочитать потоково (например, "filename" не первый ключ изображения)
+    """
+    pass
+
+
+def fsync_dir(path):
+    """
+    fsync папки, чтобы rename гарантированно попал на диск. На Windows папку открыть нельзя - пропускаем
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def decode_utf8_prefix(raw):
+    """
+    Декодирование с отбрасыванием символа, разрезанного концом окна чтения
+    """
+    try:
+        return raw.decode('utf8')
+    except UnicodeDecodeError as e:
+        if e.reason == 'unexpected end of data':
+            return raw[:e.start].decode('utf8')
+        raise
+
+
+class ProjectReader:
+    """
+    Чтение фрагментов JSON-файла проекта по смещениям. Файл держится открытым,
+    чтение защищено блокировкой - к нему обращаются и GUI, и поток сохранения
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.f = open(path, 'rb')
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.f.close()
+
+    def read(self, offset, size):
+        with self.lock:
+            self.f.seek(offset)
+            return self.f.read(size)
+
+    def skip_ws(self, offset):
+        while offset < self.size:
+            raw = self.read(offset, 4096)
+            stripped = raw.lstrip(WHITESPACE)
+            offset += len(raw) - len(stripped)
+            if stripped:
+                break
+        return offset
+
+    def expect(self, offset, char):
+        if self.read(offset, 1) != char:
+            raise StreamFormatError(f"Expected {char} at {offset} in {self.path}")
+
+    def decode_value_at(self, offset, limit=None):
+        """
+        Разбор одного JSON-значения, начинающегося с offset.
+        Возвращает значение и смещение байта сразу за ним
+        """
+        size = limit - offset if limit else 64 * 1024
+        while True:
+            raw = self.read(offset, size)
+            text = decode_utf8_prefix(raw)
+            try:
+                value, end = _decoder.raw_decode(text)
+                return value, offset + len(text[:end].encode('utf8'))
+            except json.JSONDecodeError:
+                if limit or offset + len(raw) >= self.size:
+                    raise
+                size *= 2
+
+    def find_images(self, start, progress_callback=None):
+        """
+        Построение индекса смещений изображений регулярным выражением по кускам файла
+        """
+        offsets = []
+        names = []
+        keys_count = 0
+        last_image_offset = -1
+        last_key_offset = -1
+
+        pos = start
+        carry = b''
+        while True:
+            chunk = self.read(pos, CHUNK_SIZE)
+            buf = carry + chunk
+            base = pos - len(carry)
+
+            for m in IMAGE_START_PATTERN.finditer(buf):
+                offset = base + m.start()
+                if offset > last_image_offset:
+                    offsets.append(offset)
+                    names.append(json.loads(b'"' + m.group(1) + b'"'))
+                    last_image_offset = offset
+
+            for m in FILENAME_KEY_PATTERN.finditer(buf):
+                offset = base + m.start()
+                if offset > last_key_offset:
+                    keys_count += 1
+                    last_key_offset = offset
+
+            pos += len(chunk)
+            if progress_callback:
+                progress_callback(int(100 * pos / max(self.size, 1)))
+
+            if not chunk:
+                break
+            carry = buf[-CHUNK_OVERLAP:]
+
+        if keys_count != len(offsets):
+            raise StreamFormatError(f"Not all images in {self.path} start with 'filename' key")
+
+        return offsets, names
+
+    def parse(self, progress_callback=None):
+        """
+        Разбор верхнего уровня проекта: заголовок читается целиком, для images - только смещения
+        """
+        header = {}
+        offsets, names, images_end = None, [], None
+
+        pos = self.skip_ws(0)
+        self.expect(pos, b'{')
+        pos += 1
+        while True:
+            pos = self.skip_ws(pos)
+            char = self.read(pos, 1)
+            if char == b'}':
+                break
+            if char == b',':
+                pos += 1
+                continue
+            if not char:
+                raise StreamFormatError(f"Unexpected end of {self.path}")
+
+            key, pos = self.decode_value_at(pos)
+            pos = self.skip_ws(pos)
+            self.expect(pos, b':')
+            pos = self.skip_ws(pos + 1)
+
+            if key != 'images':
+                header[key], pos = self.decode_value_at(pos)
+                continue
+
+            self.expect(pos, b'[')
+            offsets, names = self.find_images(pos + 1, progress_callback)
+            if offsets:
+                # по последнему изображению находим конец массива
+                _, pos = self.decode_value_at(offsets[-1])
+            else:
+                pos += 1
+            images_end = self.skip_ws(pos)
+            self.expect(images_end, b']')
+            pos = images_end + 1
+
+        if offsets is None:
+            raise StreamFormatError(f"No images in {self.path}")
+
+        return header, offsets, names, images_end
+
+
+class JsonImageSource:
+    """
+    Источник изображений ленивого списка - JSON-файл проекта и смещения элементов в нем
+    """
+
+    def __init__(self, reader, limits):
+        self.reader = reader
+        # граница каждого элемента в файле - начало следующего или конец массива
+        self.limits = limits
+
+    def load(self, offset):
+        image, _ = self.reader.decode_value_at(offset, self.limits[offset])
+        return image
+
+    def raw(self, offset):
+        raw = self.reader.read(offset, self.limits[offset] - offset)
+        return raw.rstrip(WHITESPACE + b',')
+
+    def close(self):
+        self.reader.close()
+
+
+class LazyImageList(MutableSequence):
+    """
+    Список изображений проекта, разбираемых из источника (файла, базы) только по требованию.
+    Элемент - либо словарь изображения, либо ключ изображения в источнике.
+    Индексация кэширует разобранное изображение, итерация - нет,
+    поэтому проход по всему проекту (экспорт, статистика) не держит все полигоны в памяти
+    """
+
+    def __init__(self, source, keys, names):
+        self.source = source
+        self.entries = list(keys)
+        self.names = list(names)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        with self.lock:
+            entry = self.entries[i]
+            if isinstance(entry, int):
+                entry = self.source.load(entry)
+                self.entries[i] = entry
+            return entry
+
+    def __setitem__(self, i, image):
+        self.entries[i] = image
+        self.names[i] = image["filename"]
+
+    def __delitem__(self, i):
+        del self.entries[i]
+        del self.names[i]
+
+    def insert(self, i, image):
+        self.entries.insert(i, image)
+        self.names.insert(i, image["filename"])
+
+    def __iter__(self):
+        for entry in list(self.entries):
+            if isinstance(entry, int):
+                yield self.load(entry)
+            else:
+                yield entry
+
+    def is_loaded(self, i):
+        return not isinstance(self.entries[i], int)
+
+    def load(self, key):
+        with self.lock:
+            return self.source.load(key)
+
+    def raw(self, key):
+        with self.lock:
+            return self.source.raw(key)
+
+    def replace_source(self, tmp_path, path, new_offsets):
+        """
+        Переход на новый JSON-файл проекта после полного сохранения.
+        new_offsets - старый ключ -> (новое смещение, длина) для всех неразобранных элементов
+        """
+        with self.lock:
+            self.source.close()
+            os.replace(tmp_path, path)
+
+            limits = {}
+            for i, entry in enumerate(self.entries):
+                if isinstance(entry, int):
+                    new_offset, length = new_offsets[entry]
+                    self.entries[i] = new_offset
+                    limits[new_offset] = new_offset + length
+            self.source = JsonImageSource(ProjectReader(path), limits)
+
+
+def is_loaded(images, i):
+    if isinstance(images, LazyImageList):
+        return images.is_loaded(i)
+    return True
+
+
+def iter_filenames(images):
+    if isinstance(images, LazyImageList):
+        return iter(list(images.names))
+    return (im["filename"] for im in images)
+
+
+def get_filename(images, i):
+    if isinstance(images, LazyImageList):
+        return images.names[i]
+    return images[i]["filename"]
+
+
+def iter_loaded(images):
+    """
+    Только уже разобранные изображения - без чтения файла
+    """
+    for i in range(len(images)):
+        if is_loaded(images, i):
+            yield images[i]
+
+
+def write_project(f, data):
+    """
+    Запись проекта в бинарный файл: сначала заголовок, затем изображения.
+    Неразобранные изображения ленивого списка копируются байтами из источника.
+    Возвращает старый ключ -> (новое смещение, длина) для скопированных элементов
+    """
+    new_offsets = {}
+    f.write(b'{')
+    for key, value in data.items():
+        if key != 'images':
+            f.write(f'{json.dumps(key)}: {json.dumps(value, default=json_default)}, '.encode('utf8'))
+
+    f.write(b'"images": [')
+    images = data["images"]
+    entries = list(images.entries) if isinstance(images, LazyImageList) else images
+    for i, entry in enumerate(entries):
+        if i:
+            f.write(b', ')
+        if isinstance(entry, int):
+            raw = images.raw(entry)
+            new_offsets[entry] = (f.tell(), len(raw))
+            f.write(raw)
+        else:
+            f.write(json.dumps(entry, default=json_default).encode('utf8'))
+    f.write(b']}')
+
+    return new_offsets
+
+
+def save_project(path, data):
+    """
+    Атомарная запись: временный файл, fsync и rename поверх path.
+    Падение в процессе записи оставляет старую версию файла нетронутой
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        new_offsets = write_project(f, data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    images = data["images"]
+    if isinstance(images, LazyImageList):
+        images.replace_source(tmp_path, path, new_offsets)
+    else:
+        os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def load_project(path, lazy_min_bytes=0, progress_callback=None):
+    """
+    Загрузка проекта. Файлы больше lazy_min_bytes читаются лениво - сразу только заголовок
+    и индекс смещений изображений. Если структура файла не позволяет - обычный json.load
+    """
+    if os.path.getsize(path) >= lazy_min_bytes:
+        reader = ProjectReader(path)
+        try:
+            header, offsets, names, images_end = reader.parse(progress_callback)
+            limits = dict(zip(offsets, offsets[1:] + [images_end]))
+            header["images"] = LazyImageList(JsonImageSource(reader, limits), offsets, names)
+            return header
+        except (StreamFormatError, json.JSONDecodeError, UnicodeDecodeError):
+            reader.close()
+
+    with open(path, 'r', encoding='utf8') as f:
+        data = json.load(f)
+
+    if progress_callback:
+        progress_callback(100)
+    return data
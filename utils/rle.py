@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+
+# поле полигона, в котором хранится маска в RLE COCO: {"size": [h, w], "counts": str}
+RLE_FIELD = "rle"
+
+
+def encode_counts(mask):
+    """
+    Длины серий маски в порядке COCO (по столбцам), первая серия - нули (может быть нулевой длины)
+    """
+    flat = np.asarray(mask, dtype=bool).ravel(order='F')
+    if not len(flat):
+        return np.zeros(0, dtype=np.int64)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [len(flat)]])
+    counts = np.diff(bounds)
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts
+
+
+def counts_to_string(counts):
+    """
+    Сжатая запись длин серий, как в pycocotools: начиная с четвертой серии - разность с сериями через одну,
+    по 5 бит на символ
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    deltas = counts.copy()
+    deltas[3:] -= counts[1:-2]
+
+    chars = []
+    for x in deltas.tolist():
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def string_to_counts(s):
+    deltas = []
+    x = 0
+    k = 0
+    for ch in s:
+        c = ord(ch) - 48
+        x |= (c & 0x1f) << (5 * k)
+        k += 1
+        if not c & 0x20:
+            if c & 0x10:
+                x |= -1 << (5 * k)
+            deltas.append(x)
+            x = 0
+            k = 0
+
+    counts = np.array(deltas, dtype=np.int64)
+    # обратно к разности с сериями через одну: накопление отдельно по нечетным и по четным, начиная со второй
+    counts[1::2] = np.cumsum(counts[1::2])
+    counts[2::2] = np.cumsum(counts[2::2])
+    return counts
+
+
+def get_counts(rle):
+    counts = rle["counts"]
+    if isinstance(counts, str):
+        return string_to_counts(counts)
+    if isinstance(counts, bytes):
+        return string_to_counts(counts.decode('ascii'))
+    return np.asarray(counts, dtype=np.int64)
+
+
+def encode(mask):
+    """
+    RLE COCO маски (H x W) со сжатой строкой counts
+    """
+    mask = np.asarray(mask)
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts_to_string(encode_counts(mask))}
+
+
+def encode_crop(mask, x_min, y_min, img_height, img_width):
+    """
+    RLE COCO маски фрагмента (h x w) с левым верхним углом (x_min, y_min) на изображении img_height x img_width.
+    Маска всего изображения не строится: столбцы левее и правее фрагмента - одна серия нулей
+    """
+    mask = np.asarray(mask, dtype=bool)
+    x_min, y_min = int(x_min), int(y_min)
+    mask = mask[:max(img_height - y_min, 0), :max(img_width - x_min, 0)]
+    height, width = mask.shape
+    columns = np.zeros((img_height, width), dtype=bool)
+    columns[y_min:y_min + height] = mask
+
+    counts = encode_counts(columns)
+    if not len(counts):
+        counts = np.zeros(1, dtype=np.int64)
+    counts[0] += x_min * img_height
+    tail = (img_width - x_min - width) * img_height
+    if len(counts) % 2:
+        # последняя серия - нули
+        counts[-1] += tail
+    elif tail:
+        counts = np.concatenate([counts, [tail]])
+    return {"size": [int(img_height), int(img_width)], "counts": counts_to_string(counts)}
+
+
+def encode_parts(mask, points_mass):
+    """
+    RLE для каждого полигона маски: связные области маски, которые накрывает полигон.
+    Полигон остается для показа, RLE - точные пиксели его области
+    """
+    mask = np.asarray(mask)
+    if mask.ndim == 3:
+        mask = mask[0]
+    mask = (mask > 0).astype(np.uint8)
+    # связность 4, как у контуров rasterio
+    _, labels = cv2.connectedComponents(mask, connectivity=4)
+
+    results = []
+    for points in points_mass:
+        fill = np.zeros(mask.shape, dtype=np.uint8)
+        cv2.fillPoly(fill, [np.round(np.asarray(points)).astype(np.int32)], 1)
+        covered = np.unique(labels[(fill > 0) & (mask > 0)])
+        results.append(encode(np.isin(labels, covered[covered > 0])))
+    return results
+
+
+def decode(rle):
+    height, width = rle["size"]
+    counts = get_counts(rle)
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape((height, width), order='F')
+
+
+def area(rle):
+    return int(get_counts(rle)[1::2].sum())
+
+
+def bbox(rle):
+    """
+    [x, y, w, h] по сериям единиц, без декодирования маски
+    """
+    height = rle["size"][0]
+    counts = get_counts(rle)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    starts, ends = starts[1::2], ends[1::2]
+    filled = ends > starts
+    if not filled.any():
+        return [0, 0, 0, 0]
+    starts, last = starts[filled], ends[filled] - 1
+
+    first_col, last_col = starts // height, last // height
+    # серия, которая переходит в следующий столбец, покрывает все строки между ними
+    is_wrapped = first_col != last_col
+    y_min = np.where(is_wrapped, 0, starts % height).min()
+    y_max = np.where(is_wrapped, height - 1, last % height).max()
+    x_min, x_max = first_col.min(), last_col.max()
+    return [int(x_min), int(y_min), int(x_max - x_min + 1), int(y_max - y_min + 1)]
+
+
+def to_polygon(rle):
+    """
+    Контур самой большой связной области маски - вершины полигона для показа на сцене
+    """
+    mask = decode(rle).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros((0, 2), dtype=np.float32)
+    contour = max(contours, key=cv2.contourArea)
+    return contour.reshape(-1, 2).astype(np.float32)
@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from segment_anything import SamPredictor, build_sam, build_sam_hq
 
-from utils.edges_from_mask import mask_to_polygons_layer
+from utils.mask_polygons import masks_to_polygons, polygons_to_points
 
 
 def show_mask(mask, ax, random_color=False):
@@ -67,28 +67,9 @@ def predict_by_points(predictor, input_point, input_label, multi=True):
 
 
 def mask_to_seg(mask, simplify_factor=2):
-    img_data = np.asarray(mask[:, :], dtype=np.double)
-    polygons = mask_to_polygons_layer(img_data)
-
-    results = []
-    for pol in polygons:
-        pol_simplified = pol.simplify(simplify_factor, preserve_topology=False)
-
-        try:
-            xy = np.asarray(pol_simplified.boundary.xy, dtype="int32")
-            points = []
-
-            xs = xy[0].tolist()
-            ys = xy[1].tolist()
-            for x, y in zip(xs, ys):
-                points.append([x, y])
-
-            results.append(points)
-
-        except:
-            pass
-
-    return results
+    polygons = masks_to_polygons(np.asarray(mask, dtype=np.double), simplify_factor=simplify_factor)[0]
+    # полигоны с дырами и распавшиеся при упрощении пропускаются
+    return [xy.tolist() for xy in polygons_to_points(polygons, dtype=np.int32) if xy is not None]
 
 
 def predict_by_box(predictor, input_box, is_best=True):
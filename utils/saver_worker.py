@@ -1,11 +1,17 @@
 from PySide2 import QtCore
-import json
 
+import os
 from collections import namedtuple
-from utils.help_functions import is_dicts_equals
 
-SavedData = namedtuple('SavedData', ('filename', 'json_data'))
-from ui.signals_and_slots import ProjectSaveLoadConn
+from utils import config
+from utils import project_binary
+from utils import project_journal as journal
+from utils import project_stream
+from utils import project_sqlite
+from utils.id_allocator import ensure_next_id
+
+SavedData = namedtuple('SavedData', ('filename', 'json_data', 'journal_record'), defaults=(None,))
+from ui.signals_and_slots import ProjectSaveLoadConn, LoadPercentConnection
 
 
 class SaverLoaderWorker(QtCore.QThread):
@@ -18,9 +24,14 @@ class SaverLoaderWorker(QtCore.QThread):
         self.mode = 'save'
         self.on_save = ProjectSaveLoadConn()
         self.on_load = ProjectSaveLoadConn()
+        self.load_percent_conn = LoadPercentConnection()
 
-    def enqueue_save(self, save_name, json_data):
-        s = SavedData(filename=save_name, json_data=json_data)
+    def enqueue_save(self, save_name, json_data, journal_record=None):
+        """
+        journal_record - сериализованная запись журнала с измененными изображениями.
+        Если None - проект записывается целиком
+        """
+        s = SavedData(filename=save_name, json_data=json_data, journal_record=journal_record)
         self.queue_save.append(s)
 
     def enqueue_load(self, json_name):
@@ -30,15 +41,56 @@ class SaverLoaderWorker(QtCore.QThread):
         # 'save' or 'load'
         self.mode = mode
 
+    def save_full(self, save_data):
+        if project_sqlite.is_sqlite_path(save_data.filename):
+            project_sqlite.save_project(save_data.filename, save_data.json_data)
+            return
+
+        if project_binary.is_binary_path(save_data.filename):
+            project_binary.save_project(save_data.filename, save_data.json_data)
+        else:
+            project_stream.save_project(save_data.filename, save_data.json_data)
+        journal.remove_journal(save_data.filename)
+
+    def save_incremental(self, queue):
+        # Все записи очереди применяются по порядку - каждая содержит только свои изменения
+        filename = queue[-1].filename
+        if project_sqlite.is_sqlite_path(filename):
+            # в базе каждая запись - одна транзакция по измененным строкам
+            for save_data in queue:
+                project_sqlite.apply_record(filename, save_data.journal_record)
+            return
+
+        for save_data in queue:
+            journal.append_record(journal.get_journal_name(filename), save_data.journal_record)
+
+        if journal.is_compaction_needed(filename, config.JOURNAL_COMPACT_MIN_BYTES,
+                                        config.JOURNAL_COMPACT_RATIO):
+            # данные в памяти содержат все записи журнала - записываем их целиком и журнал больше не нужен
+            self.save_full(queue[-1])
+
     def run(self):
         if self.mode == 'save':
             if len(self.queue_save) > 0:
-                last_data = self.queue_save[-1]
+                queue = list(self.queue_save)
                 self.queue_save.clear()
 
+                last_data = queue[-1]
                 self.last_version = last_data
-                with open(last_data.filename, 'w', encoding='utf8') as f:
-                    json.dump(last_data.json_data, f)
+
+                # с последнего полного сохранения: журнал допустим, если все записи - журнальные и в тот же файл
+                full_pos = -1
+                for i, save_data in enumerate(queue):
+                    if save_data.journal_record is None or save_data.filename != last_data.filename:
+                        full_pos = i
+
+                if full_pos == len(queue) - 1 or not os.path.exists(last_data.filename):
+                    self.save_full(last_data)
+                else:
+                    if full_pos >= 0:
+                        self.save_full(queue[full_pos])
+                    self.save_incremental(queue[full_pos + 1:])
+
                 self.on_save.on_finished.emit(True)
 
         else:
@@ -46,7 +98,13 @@ class SaverLoaderWorker(QtCore.QThread):
                 last_json = self.queue_load[-1]
                 self.queue_load.clear()
 
-                with open(last_json, 'r', encoding='utf8') as f:
-                    self.last_version = SavedData(filename=last_json, json_data=json.load(f))
+                if project_sqlite.is_sqlite_path(last_json):
+                    json_data = project_sqlite.load_project(last_json)
+                else:
+                    json_data = journal.load_with_journal(last_json, lazy_min_bytes=config.LAZY_LOAD_MIN_BYTES,
+                                                          progress_callback=self.load_percent_conn.percent.emit)
+                # для проектов без сохраненной границы id - один проход по полигонам здесь, а не в GUI
+                ensure_next_id(json_data)
+                self.last_version = SavedData(filename=last_json, json_data=json_data)
 
                 self.on_load.on_finished.emit(True)
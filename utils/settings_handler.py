@@ -89,6 +89,20 @@ class AppSettings:
     def read_conf_thres(self):
         return self.qt_settings.value("cnn/conf_thres", 0.5)
 
+    def write_scan_batch(self, scan_batch):
+        self.qt_settings.setValue("cnn/scan_batch", scan_batch)
+
+    def read_scan_batch(self):
+        # фрагментов в одном проходе сети при сканировании
+        return self.qt_settings.value("cnn/scan_batch", 8)
+
+    def write_keep_rle(self, keep_rle):
+        self.qt_settings.setValue("cnn/keep_rle", keep_rle)
+
+    def read_keep_rle(self):
+        # хранить ли маски SAM и детекторов в RLE вместе с полигонами
+        return self.qt_settings.value("cnn/keep_rle", 0)
+
     def write_iou_thres(self, iou_thres):
         self.qt_settings.setValue("cnn/iou_thres", iou_thres)
 
@@ -0,0 +1,364 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+# у полигона может не быть id или conf - в колонках это отмечается значением-заглушкой
+NO_ID = -1
+NO_CONF = np.nan
+
+SHAPE_FIELDS = ('id', 'cls_num', 'conf', 'points')
+
+# сколько знаков после запятой перебирает round_coords; мельче - вершина записывается как есть
+COORD_MAX_DECIMALS = 9
+
+
+def round_coords(coords):
+    """
+    Вершины float32 -> float64 с самой короткой десятичной записью, которая дает то же float32
+    (0.1, а не 0.10000000149011612): в JSON не попадает шум float32, и значения не меняются от сохранения
+    к сохранению. Знаки после запятой перебираются векторно, только для еще не подобранных вершин
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    result = coords.astype(np.float64)
+    flat_coords, flat = coords.ravel(), result.ravel()
+    todo = np.arange(flat.size)
+    for decimals in range(COORD_MAX_DECIMALS + 1):
+        if not len(todo):
+            break
+        rounded = np.round(flat[todo], decimals)
+        is_same = rounded.astype(np.float32) == flat_coords[todo]
+        flat[todo[is_same]] = rounded[is_same]
+        todo = todo[~is_same]
+    return result
+
+
+class ShapeColumns(Sequence):
+    """
+    Колоночное хранение полигонов одного изображения:
+    coords - все вершины подряд (float32, N x 2), offsets - границы полигонов в coords,
+    cls_nums, ids, confs (float64) - по значению на полигон.
+    Около 8 байт на вершину вместо 100+ у списков Python.
+    Индексация и итерация возвращают обычные словари {"cls_num", "id", "points", ...} -
+    для кода, который работает со словарями полигонов
+    """
+
+    __slots__ = ('coords', 'offsets', 'cls_nums', 'ids', 'confs', 'extras')
+
+    def __init__(self, coords, offsets, cls_nums, ids, confs=None, extras=None):
+        self.coords = coords
+        self.offsets = offsets
+        self.cls_nums = cls_nums
+        self.ids = ids
+        # conf есть только у результатов детекторов
+        self.confs = confs
+        # прочие поля полигонов, редкие - номер полигона -> словарь
+        self.extras = extras
+
+    @classmethod
+    def from_shapes(cls, shapes):
+        if isinstance(shapes, ShapeColumns):
+            return shapes
+
+        count = len(shapes)
+        lengths = np.fromiter((len(shape["points"]) for shape in shapes), dtype=np.int64, count=count)
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        coords = np.empty((offsets[-1], 2), dtype=np.float32)
+        for shape, start, end in zip(shapes, offsets[:-1], offsets[1:]):
+            if end > start:
+                coords[start:end] = shape["points"]
+
+        cls_nums = np.fromiter((shape["cls_num"] for shape in shapes), dtype=np.int32, count=count)
+        ids = np.fromiter((shape.get("id", NO_ID) for shape in shapes), dtype=np.int64, count=count)
+
+        confs = None
+        if any("conf" in shape for shape in shapes):
+            confs = np.fromiter((float(shape.get("conf", NO_CONF)) for shape in shapes), dtype=np.float64,
+                                count=count)
+
+        extras = {}
+        for i, shape in enumerate(shapes):
+            extra = {key: value for key, value in shape.items() if key not in SHAPE_FIELDS}
+            if extra:
+                extras[i] = extra
+
+        return cls(coords, offsets, cls_nums, ids, confs, extras or None)
+
+    def __len__(self):
+        return len(self.cls_nums)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.get_shape(i, round_coords(self.points(i)))
+
+    def get_shape(self, i, points):
+        """
+        Словарь полигона i с вершинами points (уже округленными round_coords)
+        """
+        shape = {"cls_num": int(self.cls_nums[i])}
+        if self.ids[i] != NO_ID:
+            shape["id"] = int(self.ids[i])
+        if self.confs is not None and not np.isnan(self.confs[i]):
+            shape["conf"] = float(self.confs[i])
+        shape["points"] = points.tolist()
+        if self.extras and i in self.extras:
+            shape.update(self.extras[i])
+        return shape
+
+    def points(self, i):
+        """
+        Вершины полигона i без копирования
+        """
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def areas(self):
+        """
+        Площади всех полигонов по формуле шнурования, одним проходом по массиву вершин
+        """
+        areas = np.zeros(len(self), dtype=np.float64)
+        lengths = self.lengths()
+        filled = lengths > 0
+        if not filled.any():
+            return areas
+
+        x = self.coords[:, 0].astype(np.float64)
+        y = self.coords[:, 1].astype(np.float64)
+        # следующая вершина в пределах своего полигона: у последней - первая
+        next_idx = np.arange(1, len(x) + 1)
+        starts = self.offsets[:-1][filled]
+        next_idx[self.offsets[1:][filled] - 1] = starts
+
+        cross = x * y[next_idx] - x[next_idx] * y
+        areas[filled] = np.abs(np.add.reduceat(cross, starts)) / 2
+        return areas
+
+    def bounds(self):
+        """
+        Описывающие прямоугольники полигонов с вершинами, одним reduceat по массиву вершин:
+        маска таких полигонов, минимумы и максимумы (float64, M x 2)
+        """
+        filled = self.lengths() > 0
+        if not filled.any():
+            empty = np.zeros((0, 2), dtype=np.float64)
+            return filled, empty, empty
+
+        coords = self.coords.astype(np.float64)
+        starts = self.offsets[:-1][filled]
+        return filled, np.minimum.reduceat(coords, starts, axis=0), np.maximum.reduceat(coords, starts, axis=0)
+
+    def to_shapes(self):
+        coords = round_coords(self.coords)
+        offsets = self.offsets.tolist()
+        return [self.get_shape(i, coords[offsets[i]:offsets[i + 1]]) for i in range(len(self))]
+
+    def map_cls_nums(self, lut):
+        """
+        Номера классов после перенумерации по lut и маска сохраняемых полигонов
+        """
+        cls_nums = self.cls_nums.astype(np.int32)
+        inside = (cls_nums >= 0) & (cls_nums < len(lut))
+        cls_nums[inside] = lut[cls_nums[inside]]
+        keep = ~inside | (cls_nums >= 0)
+        return cls_nums, keep
+
+    def remap(self, lut):
+        """
+        Перенумерация классов по таблице lut (старый номер -> новый, -1 - удалить полигон).
+        Номера вне таблицы не меняются. Возвращает новые колонки, все поля полигонов сохраняются;
+        если ничего не изменилось - возвращает self
+        """
+        cls_nums, keep = self.map_cls_nums(lut)
+
+        if keep.all():
+            if np.array_equal(cls_nums, self.cls_nums):
+                return self
+            return ShapeColumns(self.coords, self.offsets, cls_nums, self.ids, self.confs, self.extras)
+
+        lengths = self.lengths()
+        offsets = np.zeros(np.count_nonzero(keep) + 1, dtype=np.int64)
+        np.cumsum(lengths[keep], out=offsets[1:])
+
+        extras = None
+        if self.extras:
+            new_pos = np.cumsum(keep) - 1
+            extras = {int(new_pos[i]): extra for i, extra in self.extras.items() if keep[i]} or None
+
+        return ShapeColumns(self.coords[np.repeat(keep, lengths)], offsets, cls_nums[keep], self.ids[keep],
+                            self.confs[keep] if self.confs is not None else None, extras)
+
+    def select(self, idx):
+        """
+        Новые колонки из полигонов с номерами idx (в указанном порядке)
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        lengths = self.lengths()[idx]
+        offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # номера вершин выбранных полигонов: начало полигона + сдвиг внутри него
+        starts = np.repeat(self.offsets[:-1][idx] - offsets[:-1], lengths)
+        coords = self.coords[starts + np.arange(offsets[-1])]
+
+        extras = None
+        if self.extras:
+            extras = {new: self.extras[old] for new, old in enumerate(idx.tolist()) if old in self.extras} or None
+
+        return ShapeColumns(coords, offsets, self.cls_nums[idx], self.ids[idx],
+                            self.confs[idx] if self.confs is not None else None, extras)
+
+    def delete_at(self, positions):
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(positions, dtype=np.int64)] = False
+        return self.select(np.flatnonzero(keep))
+
+    def insert_at(self, positions, other):
+        """
+        Вставка полигонов other так, чтобы в результате они стояли на местах positions
+        """
+        count = len(self) + len(other)
+        is_other = np.zeros(count, dtype=bool)
+        is_other[np.asarray(positions, dtype=np.int64)] = True
+
+        order = np.empty(count, dtype=np.int64)
+        order[~is_other] = np.arange(len(self))
+        order[is_other] = len(self) + np.arange(len(other))
+        return concat(self, other).select(order)
+
+    def with_cls_nums(self, cls_nums):
+        """
+        Копия с другими номерами классов. Колонки не меняются на месте -
+        на них могут ссылаться история изменений и статистика
+        """
+        return ShapeColumns(self.coords, self.offsets, np.asarray(cls_nums, dtype=np.int32), self.ids, self.confs,
+                            self.extras)
+
+    def is_equal(self, other):
+        if self is other:
+            return True
+        return len(self) == len(other) and np.array_equal(self.cls_nums, other.cls_nums) \
+               and np.array_equal(self.ids, other.ids) and np.array_equal(self.offsets, other.offsets) \
+               and np.array_equal(self.coords, other.coords)
+
+    def detach(self):
+        """
+        Копирование колонок в память - для колонок-срезов отображенного в память файла
+        """
+        for name in ('coords', 'offsets', 'cls_nums', 'ids', 'confs'):
+            column = getattr(self, name)
+            if isinstance(column, np.memmap):
+                setattr(self, name, np.array(column))
+        return self
+
+    def nbytes(self):
+        size = self.coords.nbytes + self.offsets.nbytes + self.cls_nums.nbytes + self.ids.nbytes
+        if self.confs is not None:
+            size += self.confs.nbytes
+        return size
+
+
+def concat(first, second):
+    offsets = np.concatenate([first.offsets, second.offsets[1:] + first.offsets[-1]])
+    confs = None
+    if first.confs is not None or second.confs is not None:
+        confs = np.concatenate([column.confs if column.confs is not None else np.full(len(column), NO_CONF)
+                                for column in (first, second)])
+    extras = dict(first.extras or {})
+    for pos, extra in (second.extras or {}).items():
+        extras[len(first) + pos] = extra
+
+    return ShapeColumns(np.concatenate([first.coords, second.coords]).astype(np.float32), offsets,
+                        np.concatenate([first.cls_nums, second.cls_nums]).astype(np.int32),
+                        np.concatenate([first.ids, second.ids]).astype(np.int64), confs, extras or None)
+
+
+def compact(image):
+    """
+    Перевод полигонов изображения в колоночный вид. Словарь изображения меняется на месте
+    """
+    if not isinstance(image["shapes"], ShapeColumns):
+        image["shapes"] = ShapeColumns.from_shapes(image["shapes"])
+    return image
+
+
+def iter_columns(images):
+    """
+    Проход по проекту без сборки словарей полигонов: (имя изображения, ShapeColumns).
+    Для бинарного проекта колонки - срезы отображенных в память массивов
+    """
+    for image in images:
+        yield image["filename"], ShapeColumns.from_shapes(image["shapes"])
+
+
+def make_lut(cls_remap):
+    """
+    Таблица перенумерации из словаря старый номер -> новый (None - удаление)
+    """
+    lut = np.arange(max(cls_remap, default=-1) + 1, dtype=np.int32)
+    for old, new in cls_remap.items():
+        lut[old] = -1 if new is None else new
+    return lut
+
+
+def set_cls_num(shapes, pos, cls_num):
+    """
+    Смена класса полигона pos. Возвращает новые колонки, исходные не меняются
+    """
+    shapes = ShapeColumns.from_shapes(shapes)
+    cls_nums = shapes.cls_nums.copy()
+    cls_nums[pos] = cls_num
+    return shapes.with_cls_nums(cls_nums)
+
+
+def carry_extras(old, new):
+    """
+    Перенос прочих полей (например, маски RLE) из old в new для полигонов, которые не изменились:
+    тот же id и те же вершины. Сцена возвращает только класс, id и вершины.
+    Возвращает new или новые колонки с перенесенными полями
+    """
+    old = ShapeColumns.from_shapes(old)
+    if not old.extras:
+        return new
+    new = ShapeColumns.from_shapes(new)
+
+    old_pos = {int(old.ids[pos]): pos for pos in old.extras if old.ids[pos] != NO_ID}
+    extras = dict(new.extras or {})
+    for i, shape_id in enumerate(new.ids.tolist()):
+        pos = old_pos.get(shape_id)
+        if pos is not None and i not in extras and np.array_equal(old.points(pos), new.points(i)):
+            extras[i] = old.extras[pos]
+
+    if len(extras) == len(new.extras or {}):
+        return new
+    return ShapeColumns(new.coords, new.offsets, new.cls_nums, new.ids, new.confs, extras)
+
+
+def get_ids(shapes):
+    if isinstance(shapes, ShapeColumns):
+        return shapes.ids.tolist()
+    return [shape.get("id", NO_ID) for shape in shapes]
+
+
+def json_default(obj):
+    """
+    default для json.dump: колонки записываются обычным списком словарей, формат файла не меняется
+    """
+    if isinstance(obj, ShapeColumns):
+        return obj.to_shapes()
+    if isinstance(obj, np.ndarray) and obj.dtype == np.float32:
+        return round_coords(obj).tolist()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.float32):
+        return round_coords(obj).item()
+    if isinstance(obj, np.floating):
+        return float(obj)
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
@@ -0,0 +1,161 @@
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import coco_export
+from utils import image_meta
+from utils.shape_columns import iter_columns
+
+MANIFEST_NAME = 'manifest.json'
+
+SHARD_PATTERN = 'shard-{:06d}.tar'
+
+# целевой размер архива
+SHARD_SIZE = 512 * 1024 * 1024
+
+# заголовок tar и выравнивание на блок - на каждый файл архива
+TAR_MEMBER_OVERHEAD = 2 * tarfile.BLOCKSIZE
+
+# оценка размера json аннотации: на вершину и на изображение
+JSON_VERTEX_SIZE = 24
+JSON_BASE_SIZE = 256
+
+
+def make_sample_json(filename, width, height, shapes, image_id):
+    """
+    Аннотация одного изображения: полигоны как в экспорте COCO (category_id - номер класса + 1)
+    """
+    return {"file_name": filename, "width": width, "height": height, "image_id": image_id,
+            "annotations": coco_export.make_annotations(shapes, image_id, 1)}
+
+
+def plan_shards(images, path_to_images, shard_size=SHARD_SIZE):
+    """
+    Раскладка изображений по архивам целевого размера. Размер файла и изображения берется из кэша
+    метаданных за один stat; отсутствующие изображения пропускаются.
+    Возвращает (архивы, имена отсутствующих изображений). Архив - список образцов
+    (ключ, путь к изображению, mtime, аннотация). Размер json аннотации оценивается по числу вершин,
+    сам json собирается при записи архива
+    """
+    images_dir = os.path.join(os.path.abspath(path_to_images), '')
+    shards = []
+    missing = []
+    shard = []
+    tek_size = 0
+
+    for pos, (filename, shapes) in enumerate(iter_columns(images)):
+        im_full_path = images_dir + filename
+        try:
+            record = image_meta.cache.get(im_full_path)
+        except FileNotFoundError:
+            missing.append(filename)
+            continue
+
+        sample_size = record["size"] + JSON_BASE_SIZE + JSON_VERTEX_SIZE * len(shapes.coords) + \
+                      2 * TAR_MEMBER_OVERHEAD
+        if shard and tek_size + sample_size > shard_size:
+            shards.append(shard)
+            shard = []
+            tek_size = 0
+
+        # ключ без точек: WebDataset отделяет расширение по первой точке
+        key = f"{pos:09d}"
+        shard.append((key, im_full_path, record["mtime"] // 1_000_000_000,
+                      (filename, record["width"], record["height"], shapes, pos + 1)))
+        tek_size += sample_size
+
+    if shard:
+        shards.append(shard)
+    return shards, missing
+
+
+def write_shard(shard_path, samples, on_sample=None):
+    """
+    Запись архива: для каждого образца <ключ>.<расширение изображения> и <ключ>.json подряд,
+    чтобы читатель получал образец целиком при последовательном чтении
+    """
+    tmp_path = shard_path + '.tmp'
+    now = int(time.time())
+    with tarfile.open(tmp_path, 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for key, im_full_path, mtime, sample in samples:
+            ext = os.path.splitext(im_full_path)[1].lower().lstrip('.') or 'img'
+            with open(im_full_path, 'rb') as f:
+                info = tarfile.TarInfo(f"{key}.{ext}")
+                info.size = os.fstat(f.fileno()).st_size
+                info.mtime = mtime
+                tar.addfile(info, f)
+
+            data = json.dumps(make_sample_json(*sample)).encode('utf8')
+            info = tarfile.TarInfo(f"{key}.json")
+            info.size = len(data)
+            info.mtime = now
+            tar.addfile(info, io.BytesIO(data))
+
+            if on_sample:
+                on_sample()
+
+    os.replace(tmp_path, shard_path)
+    return os.path.getsize(shard_path)
+
+
+def load_manifest_shards(export_dir):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            return [shard["name"] for shard in json.load(f).get("shards", [])]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+def export_shards(images, path_to_images, labels, export_dir, shard_size=SHARD_SIZE, progress_callback=None,
+                  max_workers=None):
+    """
+    Экспорт в архивы tar в стиле WebDataset: изображение и json аннотации на образец, архивы примерно
+    по shard_size байт пишутся параллельно. manifest.json - список архивов по порядку с числом образцов
+    и классы, архивы прошлого экспорта в эту папку, которых больше нет, удаляются.
+    Возвращает имена отсутствующих изображений - они в экспорт не попали
+    """
+    shards, missing = plan_shards(images, path_to_images, shard_size=shard_size)
+    total = sum(len(shard) for shard in shards)
+
+    lock = threading.Lock()
+    done = 0
+    last_percent = -1
+
+    def on_sample():
+        nonlocal done, last_percent
+        with lock:
+            done += 1
+            percent = int(done * 100 / total)
+            if progress_callback and percent != last_percent:
+                progress_callback(percent)
+                last_percent = percent
+
+    names = [SHARD_PATTERN.format(i) for i in range(len(shards))]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sizes = list(executor.map(lambda name, shard: write_shard(os.path.join(export_dir, name), shard, on_sample),
+                                  names, shards))
+
+    for name in load_manifest_shards(export_dir):
+        shard_path = os.path.join(export_dir, name)
+        if name not in names and os.path.exists(shard_path):
+            os.remove(shard_path)
+
+    manifest = {"format": "webdataset", "samples": total,
+                "categories": [{"id": i + 1, "name": label} for i, label in enumerate(labels)],
+                "shards": [{"name": name, "samples": len(shard), "size": size} for name, shard, size in
+                           zip(names, shards, sizes)]}
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+    if progress_callback and last_percent != 100:
+        progress_callback(100)
+    return missing
@@ -0,0 +1,137 @@
+import numpy as np
+import shapely
+from shapely import Polygon, STRtree
+
+from utils import rle
+
+# на сколько пикселей полигон может не доходить до края фрагмента, чтобы считаться обрезанным
+BORDER_TOL = 2.0
+
+
+def get_tile_bounds(masks_results):
+    """
+    Рамки фрагментов [x_min, y_min, x_max, y_max] в формате calc_parts и признак наличия фрагмента
+    """
+    bounds = np.zeros((len(masks_results), 4))
+    has_tile = np.zeros(len(masks_results), dtype=bool)
+    for i, res in enumerate(masks_results):
+        tile = res.get('tile')
+        if tile:
+            (x_min, x_max), (y_min, y_max) = tile
+            bounds[i] = x_min, y_min, x_max, y_max
+            has_tile[i] = True
+    return bounds, has_tile
+
+
+def calc_cut(polygons, tile_bounds, tol=BORDER_TOL):
+    """
+    По каким краям своего фрагмента (x_min, y_min, x_max, y_max) обрезан полигон - N x 4
+    """
+    return np.abs(shapely.bounds(polygons) - tile_bounds) <= tol
+
+
+def calc_inner_edges(first_bounds, second_bounds):
+    """
+    Какие края первого фрагмента лежат внутри второго (N x 4): объект, обрезанный таким краем,
+    продолжается во втором фрагменте
+    """
+    edges = []
+    for side in range(4):
+        axis = side % 2
+        edge = first_bounds[:, side]
+        edges.append((edge > second_bounds[:, axis]) & (edge < second_bounds[:, axis + 2]))
+    return np.stack(edges, axis=1)
+
+
+def find_groups(count, pairs):
+    """
+    Группы связанных пар (система непересекающихся множеств). Группа - отсортированный список номеров
+    """
+    parents = list(range(count))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(count):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def merge_polygons(polygons, tol=BORDER_TOL):
+    merged = shapely.union_all(polygons)
+    if merged.geom_type != 'Polygon':
+        # части касаются с зазором до tol - закрываем зазор
+        merged = merged.buffer(tol).buffer(-tol)
+    if merged.geom_type == 'MultiPolygon':
+        merged = max(merged.geoms, key=lambda pol: pol.area)
+    return merged
+
+
+def stitch_tile_polygons(masks_results, tol=BORDER_TOL):
+    """
+    Сшивка частей объектов, разрезанных краями фрагментов при сканировании.
+    masks_results - {'cls_num', 'points', 'conf', 'tile'}, tile - рамка фрагмента из calc_parts.
+    Сшиваются только полигоны одного класса из перекрывающихся фрагментов: хотя бы один из пары обрезан краем
+    своего фрагмента, который лежит внутри другого фрагмента, и в полосе перекрытия фрагментов полигоны
+    пересекаются (с зазором до tol). Результаты без tile (обнаружение по всему изображению) не сшиваются.
+    Пары ищутся в R-дереве. Объединенный полигон встает на место первой части, conf - максимальный.
+    Возвращает результаты без поля tile
+    """
+    results = [{key: value for key, value in res.items() if key != 'tile'} for res in masks_results]
+    tile_bounds, has_tile = get_tile_bounds(masks_results)
+    tiled_nums = np.flatnonzero(has_tile)
+    if len(tiled_nums) < 2:
+        return results
+
+    polygons = np.array([Polygon(masks_results[i]['points']) for i in tiled_nums.tolist()], dtype=object)
+    tile_bounds = tile_bounds[tiled_nums]
+    is_cut = calc_cut(polygons, tile_bounds, tol=tol)
+    if not is_cut.any():
+        return results
+
+    cls_nums = np.array([masks_results[i]['cls_num'] for i in tiled_nums.tolist()])
+    tree = STRtree(polygons)
+    # для каждого обрезанного полигона - соседи ближе tol
+    cut_nums = np.flatnonzero(is_cut.any(axis=1))
+    input_nums, tree_nums = tree.query(polygons[cut_nums], predicate='dwithin', distance=tol)
+    first, second = cut_nums[input_nums], tree_nums
+    first_bounds, second_bounds = tile_bounds[first], tile_bounds[second]
+    overlap = np.concatenate([np.maximum(first_bounds[:, :2], second_bounds[:, :2]),
+                              np.minimum(first_bounds[:, 2:], second_bounds[:, 2:])], axis=1)
+    is_overlapped = (overlap[:, 0] < overlap[:, 2]) & (overlap[:, 1] < overlap[:, 3])
+    # обрезан краем, за которым продолжается фрагмент второго полигона
+    is_cut_inside = (is_cut[first] & calc_inner_edges(first_bounds, second_bounds)).any(axis=1)
+    is_pair = (first != second) & (cls_nums[first] == cls_nums[second]) & is_overlapped & is_cut_inside
+    first, second, overlap = first[is_pair], second[is_pair], overlap[is_pair]
+
+    # касание должно быть в полосе перекрытия, а не где-то еще
+    boxes = shapely.box(overlap[:, 0] - tol, overlap[:, 1] - tol, overlap[:, 2] + tol, overlap[:, 3] + tol)
+    in_overlap = shapely.dwithin(shapely.intersection(polygons[first], boxes),
+                                 shapely.intersection(polygons[second], boxes), tol)
+    pairs = zip(tiled_nums[first[in_overlap]].tolist(), tiled_nums[second[in_overlap]].tolist())
+
+    groups = find_groups(len(results), pairs)
+    polygon_nums = {num: pos for pos, num in enumerate(tiled_nums.tolist())}
+
+    stitched = [None] * len(results)
+    for group in groups:
+        if len(group) == 1:
+            stitched[group[0]] = results[group[0]]
+            continue
+        merged = merge_polygons(polygons[[polygon_nums[i] for i in group]], tol=tol)
+        # маска RLE первой части не покрывает объединенный объект - остается только полигон
+        res = {key: value for key, value in results[group[0]].items() if key != rle.RLE_FIELD}
+        res['points'] = [list(p) for p in merged.exterior.coords[:-1]]
+        res['conf'] = max(results[i]['conf'] for i in group)
+        stitched[group[0]] = res
+
+    return [res for res in stitched if res is not None]
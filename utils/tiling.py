@@ -0,0 +1,87 @@
+import math
+from collections import namedtuple
+
+# размер входа сети, пикселей
+NET_PX = 1280
+# разрешение обучающих изображений, м/пиксель, и их размер до сжатия к NET_PX
+# (в реальности - 1280, но это ужатые 8000 с ld = 0.0923)
+TRAIN_LD = 0.11
+TRAIN_IMG_PX = 8000
+# насколько масштаб целого изображения может отличаться от масштаба фрагмента, чтобы обойтись без сканирования
+SCALE_TOL = 0.25
+# перекрытие - не больше этой доли фрагмента, иначе фрагмент увеличивается
+MAX_OVERLAP = 0.5
+MIN_TILE_PX = 64
+
+# parts - рамки фрагментов [[x_min, x_max], [y_min, y_max]] как в calc_parts, пустой - сканирование не нужно.
+# resample - во сколько раз сеть сжимает фрагмент (NET_PX / tile_size)
+TilingPlan = namedtuple('TilingPlan', ('tile_size', 'overlap', 'resample', 'parts', 'x_parts_num', 'y_parts_num'))
+
+
+def calc_tile_size(lrm, train_ld=TRAIN_LD, train_img_px=TRAIN_IMG_PX):
+    """
+    Фрагмент, покрывающий ту же площадь местности, что и обучающее изображение
+    """
+    return max(int(train_img_px * train_ld / lrm), MIN_TILE_PX)
+
+
+def plan_axis(length, tile_size, overlap):
+    """
+    Наименьшее число фрагментов вдоль стороны с перекрытием не меньше overlap.
+    Фрагменты распределяются равномерно, последний доходит до края без укорачивания
+    """
+    if length <= tile_size:
+        return [[0, length]]
+    stride = max(tile_size - overlap, 1)
+    count = math.ceil((length - tile_size) / stride) + 1
+    step = (length - tile_size) / (count - 1)
+    starts = [int(round(i * step)) for i in range(count)]
+    return [[start, start + tile_size] for start in starts]
+
+
+def plan_tiles(img_width, img_height, lrm=None, train_ld=TRAIN_LD, train_img_px=TRAIN_IMG_PX, object_size=None,
+               net_px=NET_PX):
+    """
+    Разбиение изображения на фрагменты для сканирования.
+    Размер фрагмента - по масштабу обучения (lrm - м/пиксель изображения, train_ld - обучающих изображений).
+    Перекрытие - типичный размер объекта object_size в пикселях, чтобы любой такой объект целиком попал
+    хотя бы в один фрагмент (без object_size - половина фрагмента, как в calc_width_parts).
+    Если объект больше MAX_OVERLAP фрагмента, фрагмент увеличивается (сеть сожмет его сильнее).
+    Без lrm или если изображение близко к размеру фрагмента - сканирование не нужно
+    """
+    if not lrm:
+        return TilingPlan(0, 0, 1.0, [], 0, 0)
+
+    tile_size = calc_tile_size(lrm, train_ld=train_ld, train_img_px=train_img_px)
+    if max(img_width, img_height) <= tile_size * (1 + SCALE_TOL):
+        return TilingPlan(tile_size, 0, net_px / tile_size, [], 0, 0)
+
+    if object_size:
+        overlap = int(math.ceil(object_size))
+        tile_size = max(tile_size, int(math.ceil(overlap / MAX_OVERLAP)))
+    else:
+        overlap = tile_size // 2
+
+    x_parts = plan_axis(img_width, tile_size, overlap)
+    y_parts = plan_axis(img_height, tile_size, overlap)
+    parts = [[x, y] for y in y_parts for x in x_parts]
+    return TilingPlan(tile_size, overlap, net_px / tile_size, parts, len(x_parts), len(y_parts))
+
+
+def describe_plan(plan, batch_size=1, net_px=NET_PX, lang='RU'):
+    """
+    Число фрагментов и оценка стоимости: проходов сети и мегапикселей на ее входе
+    """
+    tiles = len(plan.parts)
+    if not tiles:
+        return "Сканирование не требуется" if lang == 'RU' else "Scanning is not required"
+
+    passes = math.ceil(tiles / max(batch_size, 1))
+    megapixels = tiles * net_px * net_px / 1e6
+    if lang == 'RU':
+        return f"Фрагментов {tiles} ({plan.x_parts_num}x{plan.y_parts_num}) по {plan.tile_size} пикс., " \
+               f"перекрытие {plan.overlap} пикс., сжатие {plan.resample:0.2f}: " \
+               f"{passes} проходов сети, {megapixels:0.1f} Мпикс"
+    return f"{tiles} tiles ({plan.x_parts_num}x{plan.y_parts_num}) of {plan.tile_size} px, " \
+           f"overlap {plan.overlap} px, resample {plan.resample:0.2f}: " \
+           f"{passes} network passes, {megapixels:0.1f} Mpx"
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import utils.help_functions as hf
+from utils import image_meta
+from utils.shape_columns import iter_columns, round_coords
+
+# манифест экспорта: имя txt-файла -> ключ содержимого (полигоны + размер изображения)
+MANIFEST_NAME = '.yolo_export_manifest.json'
+
+
+def make_seg_lines(shapes, width, height):
+    """
+    Строки YOLO Seg: номер класса и нормированные вершины. Нормируются все вершины изображения разом,
+    вершины float32 перед этим округляются (round_coords), чтобы в файлы не попадал шум float32
+    """
+    coords = (round_coords(shapes.coords) / np.array([width, height], dtype=np.float64)).tolist()
+    offsets = shapes.offsets.tolist()
+    lines = []
+    for i, cls_num in enumerate(shapes.cls_nums.tolist()):
+        line = f"{cls_num}"
+        for x, y in coords[offsets[i]:offsets[i + 1]]:
+            line += f" {x} {y}"
+        lines.append(f"{line}\n")
+    return lines
+
+
+def make_box_lines(shapes, width, height):
+    """
+    Строки YOLO Box: описывающие прямоугольники всех полигонов изображения считаются разом.
+    Полигоны без вершин пропускаются
+    """
+    filled, mins, maxs = shapes.bounds()
+    # границы - вершины float32, округляются так же, как в make_seg_lines
+    mins, maxs = round_coords(mins), round_coords(maxs)
+    wh = maxs - mins
+    size = np.array([width, height], dtype=np.float64)
+    centers = (mins + wh / 2) / size
+    wh = wh / size
+
+    return [f"{cls_num} {xc} {yc} {w} {h}\n" for cls_num, (xc, yc), (w, h) in
+            zip(shapes.cls_nums[filled].tolist(), centers.tolist(), wh.tolist())]
+
+
+def calc_export_key(shapes, width, height):
+    content = b''.join([f"{width} {height}".encode('utf8'), shapes.coords.tobytes(), shapes.offsets.tobytes(),
+                        shapes.cls_nums.tobytes()])
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def load_manifest(export_dir, export_format):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # другой формат в той же папке - переписываются все файлы
+    if manifest.get("format") != export_format:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(export_dir, export_format, files):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        f.write(json.dumps({"format": export_format, "files": files}))
+    os.replace(tmp_path, path)
+
+
+def write_txt(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def export_yolo(images, path_to_images, export_dir, is_seg, progress_callback=None, max_workers=None):
+    """
+    Экспорт в YOLO Seg / YOLO Box: по txt-файлу на изображение с полигонами.
+    Переписываются только файлы изображений, у которых изменились полигоны или размер с прошлого экспорта
+    в эту папку; файлы изображений, которые удалены или остались без полигонов, удаляются.
+    Строки формируются и пишутся в пуле потоков. Возвращает число записанных файлов
+    """
+    export_format = "seg" if is_seg else "box"
+    make_lines = make_seg_lines if is_seg else make_box_lines
+    old_files = load_manifest(export_dir, export_format)
+    # один проход по папке вместо проверки каждого файла
+    existing = set(os.listdir(export_dir))
+    files = {}
+    tasks = []
+    # абсолютный путь папки один раз - дальше путь к изображению склеивается без нормализации
+    images_dir = os.path.join(os.path.abspath(path_to_images), '')
+
+    for filename, shapes in iter_columns(images):
+        if not len(shapes):  # чтобы не создавать пустых файлов
+            continue
+        try:
+            width, height = image_meta.get_image_size(images_dir + filename)
+        except FileNotFoundError:
+            continue
+
+        txt_name = hf.convert_image_name_to_txt_name(filename)
+        key = calc_export_key(shapes, width, height)
+        files[txt_name] = key
+        if old_files.get(txt_name) != key or txt_name not in existing:
+            tasks.append((os.path.join(export_dir, txt_name), shapes, width, height))
+
+    for txt_name in old_files:
+        if txt_name not in files and txt_name in existing:
+            os.remove(os.path.join(export_dir, txt_name))
+
+    def export_one(txt_path, shapes, width, height):
+        write_txt(txt_path, make_lines(shapes, width, height))
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(export_one, *task) for task in tasks]
+            last_percent = -1
+            for i, future in enumerate(as_completed(futures)):
+                future.result()
+                percent = int((i + 1) * 100 / len(futures))
+                if progress_callback and percent != last_percent:
+                    progress_callback(percent)
+                    last_percent = percent
+    elif progress_callback:
+        progress_callback(100)
+
+    save_manifest(export_dir, export_format, files)
+    return len(tasks)